@@ -0,0 +1,30 @@
+"""subscription threshold index
+
+Revision ID: 3f8a1c9d2e47
+Revises: b9e3f53b7d64
+Create Date: 2026-10-17 09:12:44.218530
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "3f8a1c9d2e47"
+down_revision: Union[str, None] = "b9e3f53b7d64"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_subscriptions_pair_threshold",
+        "subscriptions",
+        ["from_asset", "to_asset", "fee_threshold"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_subscriptions_pair_threshold", table_name="subscriptions")
@@ -0,0 +1,64 @@
+"""previous fees
+
+Revision ID: 5d9e0a3b7c18
+Revises: e41b7f2c9a60
+Create Date: 2026-10-17 15:41:09.662874
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5d9e0a3b7c18"
+down_revision: Union[str, None] = "e41b7f2c9a60"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "previous_fees",
+        sa.Column("key", sa.Text(), nullable=False),
+        sa.Column("from_asset", sa.Text(), nullable=False),
+        sa.Column("to_asset", sa.Text(), nullable=False),
+        sa.Column("fee", sa.Double(), nullable=False),
+        sa.PrimaryKeyConstraint("key", "from_asset", "to_asset"),
+    )
+    op.execute(
+        """
+        INSERT INTO previous_fees (key, from_asset, to_asset, fee)
+        SELECT previous.key, from_asset.key, to_asset.key,
+               (to_asset.value #>> '{}')::double precision
+        FROM previous,
+             json_each(previous.value) AS from_asset,
+             json_each(from_asset.value) AS to_asset
+        WHERE json_typeof(to_asset.value) = 'number'
+        """
+    )
+    op.drop_table("previous")
+
+
+def downgrade() -> None:
+    op.create_table(
+        "previous",
+        sa.Column("key", sa.Text(), nullable=False),
+        sa.Column("value", sa.JSON(), nullable=True),
+        sa.PrimaryKeyConstraint("key"),
+    )
+    op.execute(
+        """
+        INSERT INTO previous (key, value)
+        SELECT key, json_object_agg(from_asset, pairs)
+        FROM (
+            SELECT key, from_asset, json_object_agg(to_asset, fee) AS pairs
+            FROM previous_fees
+            GROUP BY key, from_asset
+        ) AS assets
+        GROUP BY key
+        """
+    )
+    op.drop_table("previous_fees")
@@ -0,0 +1,46 @@
+"""fee history
+
+Revision ID: 7c2d4e9a1b35
+Revises: 3f8a1c9d2e47
+Create Date: 2026-10-17 11:03:27.904113
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "7c2d4e9a1b35"
+down_revision: Union[str, None] = "3f8a1c9d2e47"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "fee_history",
+        sa.Column("from_asset", sa.Text(), nullable=False),
+        sa.Column("to_asset", sa.Text(), nullable=False),
+        sa.Column("time", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("fee", sa.Double(), nullable=False),
+        sa.PrimaryKeyConstraint("from_asset", "to_asset", "time"),
+    )
+    op.create_table(
+        "fee_history_hourly",
+        sa.Column("from_asset", sa.Text(), nullable=False),
+        sa.Column("to_asset", sa.Text(), nullable=False),
+        sa.Column("hour", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("min_fee", sa.Double(), nullable=False),
+        sa.Column("max_fee", sa.Double(), nullable=False),
+        sa.Column("avg_fee", sa.Double(), nullable=False),
+        sa.Column("samples", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("from_asset", "to_asset", "hour"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("fee_history_hourly")
+    op.drop_table("fee_history")
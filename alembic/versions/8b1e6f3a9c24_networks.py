@@ -0,0 +1,95 @@
+"""networks
+
+Revision ID: 8b1e6f3a9c24
+Revises: f2a8d5c1b7e3
+Create Date: 2026-10-17 22:18:53.604219
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "8b1e6f3a9c24"
+down_revision: Union[str, None] = "f2a8d5c1b7e3"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# consts.DEFAULT_NETWORK, what all existing rows were fetched from
+DEFAULT_NETWORK = "mainnet"
+
+
+def network_column() -> sa.Column:
+    return sa.Column(
+        "network", sa.Text(), server_default=DEFAULT_NETWORK, nullable=False
+    )
+
+
+def upgrade() -> None:
+    for table in ("subscriptions", "outbox", "fee_history", "fee_history_hourly"):
+        op.add_column(table, network_column())
+
+    op.drop_constraint(
+        "uq_subscriptions_chat_pair_threshold", "subscriptions", type_="unique"
+    )
+    op.create_unique_constraint(
+        "uq_subscriptions_chat_pair_threshold",
+        "subscriptions",
+        ["chat_id", "network", "from_asset", "to_asset", "fee_threshold"],
+    )
+    op.drop_index("ix_subscriptions_pair_threshold", table_name="subscriptions")
+    op.create_index(
+        "ix_subscriptions_pair_threshold",
+        "subscriptions",
+        ["network", "from_asset", "to_asset", "fee_threshold"],
+    )
+
+    op.drop_constraint("fee_history_pkey", "fee_history", type_="primary")
+    op.create_primary_key(
+        "fee_history_pkey", "fee_history", ["network", "from_asset", "to_asset", "time"]
+    )
+    op.drop_constraint("fee_history_hourly_pkey", "fee_history_hourly", type_="primary")
+    op.create_primary_key(
+        "fee_history_hourly_pkey",
+        "fee_history_hourly",
+        ["network", "from_asset", "to_asset", "hour"],
+    )
+
+
+def downgrade() -> None:
+    # only the default network fits the schema without network columns
+    for table in ("subscriptions", "outbox", "fee_history", "fee_history_hourly"):
+        op.execute(f"DELETE FROM {table} WHERE network != '{DEFAULT_NETWORK}'")
+    op.execute("DELETE FROM previous_fees WHERE key LIKE 'all_fees:%'")
+
+    op.drop_constraint("fee_history_hourly_pkey", "fee_history_hourly", type_="primary")
+    op.create_primary_key(
+        "fee_history_hourly_pkey",
+        "fee_history_hourly",
+        ["from_asset", "to_asset", "hour"],
+    )
+    op.drop_constraint("fee_history_pkey", "fee_history", type_="primary")
+    op.create_primary_key(
+        "fee_history_pkey", "fee_history", ["from_asset", "to_asset", "time"]
+    )
+
+    op.drop_index("ix_subscriptions_pair_threshold", table_name="subscriptions")
+    op.create_index(
+        "ix_subscriptions_pair_threshold",
+        "subscriptions",
+        ["from_asset", "to_asset", "fee_threshold"],
+    )
+    op.drop_constraint(
+        "uq_subscriptions_chat_pair_threshold", "subscriptions", type_="unique"
+    )
+    op.create_unique_constraint(
+        "uq_subscriptions_chat_pair_threshold",
+        "subscriptions",
+        ["chat_id", "from_asset", "to_asset", "fee_threshold"],
+    )
+
+    for table in ("subscriptions", "outbox", "fee_history", "fee_history_hourly"):
+        op.drop_column(table, "network")
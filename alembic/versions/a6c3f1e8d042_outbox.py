@@ -0,0 +1,52 @@
+"""outbox
+
+Revision ID: a6c3f1e8d042
+Revises: 5d9e0a3b7c18
+Create Date: 2026-10-17 17:12:45.318206
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "a6c3f1e8d042"
+down_revision: Union[str, None] = "5d9e0a3b7c18"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "outbox",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("subscription_id", sa.BigInteger(), nullable=False),
+        sa.Column("chat_id", sa.BigInteger(), nullable=False),
+        sa.Column("from_asset", sa.Text(), nullable=False),
+        sa.Column("to_asset", sa.Text(), nullable=False),
+        sa.Column("fee_threshold", sa.DECIMAL(), nullable=False),
+        sa.Column("fee", sa.Double(), nullable=False),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.Column("attempts", sa.Integer(), server_default="0", nullable=False),
+        sa.Column(
+            "next_attempt_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_outbox_next_attempt_at", "outbox", ["next_attempt_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_outbox_next_attempt_at", table_name="outbox")
+    op.drop_table("outbox")
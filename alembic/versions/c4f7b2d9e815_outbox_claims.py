@@ -0,0 +1,31 @@
+"""outbox claims
+
+Revision ID: c4f7b2d9e815
+Revises: a6c3f1e8d042
+Create Date: 2026-10-17 19:04:21.573911
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c4f7b2d9e815"
+down_revision: Union[str, None] = "a6c3f1e8d042"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "outbox", sa.Column("claimed_at", sa.DateTime(timezone=True), nullable=True)
+    )
+    op.create_index("ix_outbox_subscription_id", "outbox", ["subscription_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_outbox_subscription_id", table_name="outbox")
+    op.drop_column("outbox", "claimed_at")
@@ -0,0 +1,59 @@
+"""unique subscriptions
+
+Revision ID: e41b7f2c9a60
+Revises: 7c2d4e9a1b35
+Create Date: 2026-10-17 13:26:51.377208
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e41b7f2c9a60"
+down_revision: Union[str, None] = "7c2d4e9a1b35"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # keep the oldest of every set of duplicate subscriptions
+    op.execute(
+        """
+        DELETE FROM subscriptions AS duplicate
+        USING subscriptions AS original
+        WHERE duplicate.chat_id = original.chat_id
+          AND duplicate.from_asset = original.from_asset
+          AND duplicate.to_asset = original.to_asset
+          AND duplicate.fee_threshold = original.fee_threshold
+          AND duplicate.id > original.id
+        """
+    )
+    # b9e3f53b7d64 added id with primary_key=True, which add_column ignores
+    op.execute(
+        """
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_constraint
+                WHERE conrelid = 'subscriptions'::regclass AND contype = 'p'
+            ) THEN
+                ALTER TABLE subscriptions ADD PRIMARY KEY (id);
+            END IF;
+        END $$
+        """
+    )
+    # leads with chat_id, so it also serves the lookups by chat
+    op.create_unique_constraint(
+        "uq_subscriptions_chat_pair_threshold",
+        "subscriptions",
+        ["chat_id", "from_asset", "to_asset", "fee_threshold"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint(
+        "uq_subscriptions_chat_pair_threshold", "subscriptions", type_="unique"
+    )
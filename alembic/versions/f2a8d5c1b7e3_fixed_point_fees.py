@@ -0,0 +1,101 @@
+"""fixed-point fees
+
+Revision ID: f2a8d5c1b7e3
+Revises: c4f7b2d9e815
+Create Date: 2026-10-17 20:36:08.142637
+
+"""
+
+import logging
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "f2a8d5c1b7e3"
+down_revision: Union[str, None] = "c4f7b2d9e815"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# consts.FEE_SCALE at the time of this migration
+FEE_SCALE = 10_000
+
+COLUMNS = [
+    ("subscriptions", "fee_threshold", sa.DECIMAL()),
+    ("outbox", "fee_threshold", sa.DECIMAL()),
+    ("outbox", "fee", sa.Double()),
+    ("previous_fees", "fee", sa.Double()),
+    ("fee_history", "fee", sa.Double()),
+    ("fee_history_hourly", "min_fee", sa.Double()),
+    ("fee_history_hourly", "max_fee", sa.Double()),
+]
+
+
+def upgrade() -> None:
+    connection = op.get_bind()
+    inexact = connection.execute(
+        sa.text(
+            f"""
+            SELECT id, chat_id, from_asset, to_asset, fee_threshold,
+                   round(fee_threshold * {FEE_SCALE}) AS units
+            FROM subscriptions
+            WHERE fee_threshold * {FEE_SCALE} <> round(fee_threshold * {FEE_SCALE})
+            ORDER BY id
+            """
+        )
+    )
+    for row in inexact:
+        logging.warning(
+            f"Rounding fee threshold {row.fee_threshold}% of subscription {row.id} "
+            f"(chat {row.chat_id}, {row.from_asset} -> {row.to_asset}) to "
+            f"{row.units / FEE_SCALE}%"
+        )
+    # thresholds that only differ below the scale become duplicates, keep the
+    # oldest of them like e41b7f2c9a60 did
+    duplicates = connection.execute(
+        sa.text(
+            f"""
+            DELETE FROM subscriptions AS duplicate
+            WHERE EXISTS (
+                SELECT 1 FROM subscriptions AS original
+                WHERE original.chat_id = duplicate.chat_id
+                  AND original.from_asset = duplicate.from_asset
+                  AND original.to_asset = duplicate.to_asset
+                  AND round(original.fee_threshold * {FEE_SCALE})
+                    = round(duplicate.fee_threshold * {FEE_SCALE})
+                  AND original.id < duplicate.id
+            )
+            RETURNING id, chat_id, from_asset, to_asset, fee_threshold
+            """
+        )
+    )
+    for row in duplicates:
+        logging.warning(
+            f"Deleting subscription {row.id} (chat {row.chat_id}, "
+            f"{row.from_asset} -> {row.to_asset} at {row.fee_threshold}%), "
+            "it duplicates an older one once rounded"
+        )
+
+    for table, column, _ in COLUMNS:
+        # through numeric, so that the doubles of the API are rounded to what
+        # they were sent as
+        op.alter_column(
+            table,
+            column,
+            type_=sa.BigInteger(),
+            postgresql_using=f"round({column}::numeric * {FEE_SCALE})",
+        )
+    op.execute(f"UPDATE fee_history_hourly SET avg_fee = avg_fee * {FEE_SCALE}")
+
+
+def downgrade() -> None:
+    op.execute(f"UPDATE fee_history_hourly SET avg_fee = avg_fee / {FEE_SCALE}")
+    for table, column, type_ in COLUMNS:
+        op.alter_column(
+            table,
+            column,
+            type_=type_,
+            postgresql_using=f"{column}::numeric / {FEE_SCALE}",
+        )
@@ -1,33 +1,221 @@
-from httpx import AsyncClient
+import asyncio
+import logging
+import random
+import time
+from collections.abc import Awaitable, Callable
 
-from consts import SwapType, Fees
+from httpx import AsyncClient, HTTPStatusError, Timeout, TransportError
+
+from consts import DEFAULT_NETWORK, SwapType, Fees
+from fixed import to_units
+from metrics import (
+    API_CIRCUIT_OPEN,
+    API_ERRORS,
+    API_REQUEST_SECONDS,
+    API_RETRIES,
+    API_STALE,
+)
 from utils import currency_to_asset
 
+REQUEST_TIMEOUT = 10
+CONNECT_TIMEOUT = 3
+READ_TIMEOUT = 5
+RETRIES = 2
+BACKOFF = 0.5
+# consecutive failed fetches after which an endpoint is left alone for a while
+FAILURE_THRESHOLD = 3
+RESET_TIMEOUT = 60
+# fees older than this are not served in place of a failed fetch
+MAX_STALE = 600
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        failure_threshold: int = FAILURE_THRESHOLD,
+        reset_timeout: float = RESET_TIMEOUT,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._trial = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        # after the timeout a single request tries whether the endpoint recovered
+        if self._trial or time.monotonic() - self.opened_at < self.reset_timeout:
+            return False
+        self._trial = True
+        return True
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def failure(self):
+        self.failures += 1
+        self._trial = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+def create_client(base_url: str) -> AsyncClient:
+    return AsyncClient(
+        base_url=base_url, timeout=Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+    )
+
+
+def retryable(error: Exception) -> bool:
+    if isinstance(error, HTTPStatusError):
+        status = error.response.status_code
+        return status >= 500 or status == 429
+    return isinstance(error, TransportError)
+
+
+class FeeClient:
+    def __init__(
+        self,
+        client: AsyncClient,
+        timeout: float = REQUEST_TIMEOUT,
+        retries: int = RETRIES,
+        backoff: float = BACKOFF,
+        failure_threshold: int = FAILURE_THRESHOLD,
+        reset_timeout: float = RESET_TIMEOUT,
+        max_stale: float = MAX_STALE,
+        network: str = DEFAULT_NETWORK,
+    ):
+        self.client = client
+        self.network = network
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_stale = max_stale
+        self.breakers = {
+            swap_type: CircuitBreaker(failure_threshold, reset_timeout)
+            for swap_type in SwapType
+        }
+        # the last fees fetched per swap type and when
+        self._last: dict[SwapType, tuple[float, Fees]] = {}
+
+    async def get_all_fees(self) -> Fees:
+        return await merge_fees(self.get_fees)
+
+    async def get_fees(self, swap_type: SwapType) -> Fees:
+        breaker = self.breakers[swap_type]
+        try:
+            if not breaker.allow():
+                raise CircuitOpenError(f"{swap_type.value} fees are not requested")
+            try:
+                fees = await asyncio.wait_for(self._fetch(swap_type), self.timeout)
+            except BaseException:
+                # also when cancelled, or a cancelled trial would keep it open
+                breaker.failure()
+                raise
+            breaker.success()
+        except Exception as e:
+            API_CIRCUIT_OPEN.set(
+                int(breaker.is_open), network=self.network, swap_type=swap_type.value
+            )
+            return self._stale(swap_type, e)
+        API_CIRCUIT_OPEN.set(0, network=self.network, swap_type=swap_type.value)
+        self._last[swap_type] = (time.monotonic(), fees)
+        return fees
+
+    async def _fetch(self, swap_type: SwapType) -> Fees:
+        for attempt in range(self.retries + 1):
+            try:
+                return await get_fees(self.client, swap_type)
+            except Exception as e:
+                if attempt == self.retries or not retryable(e):
+                    raise
+                API_RETRIES.inc(swap_type=swap_type.value)
+            # full jitter, so that retries of several clients do not line up
+            await asyncio.sleep(random.uniform(0, self.backoff * 2**attempt))
+
+    def _stale(self, swap_type: SwapType, error: Exception) -> Fees:
+        last = self._last.get(swap_type)
+        if last is None:
+            raise error
+        age = time.monotonic() - last[0]
+        if age > self.max_stale:
+            raise error
+        logging.warning(
+            f"Using {age:.0f}s old {swap_type.value} fees, fetching failed: {error!r}"
+        )
+        API_STALE.inc(swap_type=swap_type.value)
+        return last[1]
+
+
+async def get_all_fees(client: AsyncClient, timeout: float = REQUEST_TIMEOUT) -> Fees:
+    return await merge_fees(
+        lambda swap_type: asyncio.wait_for(get_fees(client, swap_type), timeout)
+    )
+
+
+async def merge_fees(fetch: Callable[[SwapType], Awaitable[Fees]]) -> Fees:
+    swap_types = list(SwapType)
+    responses = await asyncio.gather(
+        *(fetch(swap_type) for swap_type in swap_types),
+        return_exceptions=True,
+    )
 
-async def get_all_fees(client: AsyncClient) -> Fees:
     result = {}
-    for swap_type in SwapType:
-        fees = await get_fees(client, swap_type)
+    errors = []
+    # merge in SwapType order so that overlapping pairs always resolve the same way
+    for swap_type, fees in zip(swap_types, responses):
+        if isinstance(fees, BaseException):
+            if not isinstance(fees, Exception):
+                raise fees
+            logging.error(f"Could not fetch {swap_type.value} fees: {fees!r}")
+            errors.append(fees)
+            continue
         for from_asset, pairs in fees.items():
             result.setdefault(from_asset, {}).update(pairs)
+
+    if len(errors) == len(swap_types):
+        raise ExceptionGroup("Could not fetch any fees", errors)
     return result
 
 
 async def get_fees(client: AsyncClient, swap_type: SwapType) -> Fees:
-    response = await client.get(
-        f"/v2/swap/{swap_type.value}", headers={"Referral": "pro"}
-    )
-    response.raise_for_status()
-    data = response.json()
+    # counted per request, also when a timeout cancels it
+    failed = True
+    try:
+        with API_REQUEST_SECONDS.time(swap_type=swap_type.value):
+            response = await client.get(
+                f"/v2/swap/{swap_type.value}", headers={"Referral": "pro"}
+            )
+        response.raise_for_status()
+        fees = parse_fees(swap_type, response.json())
+        failed = False
+        return fees
+    finally:
+        if failed:
+            API_ERRORS.inc(swap_type=swap_type.value)
+
 
+def parse_fees(swap_type: SwapType, data: dict) -> Fees:
     fees = {}
     for quote_currency in data:
         from_asset = currency_to_asset(swap_type, quote_currency, True)
-        fees[from_asset] = {}
         for base_currency in data[quote_currency]:
             to_asset = currency_to_asset(swap_type, base_currency, False)
-            fees[from_asset][to_asset] = data[quote_currency][base_currency]["fees"][
-                "percentage"
-            ]
+            percentage = data[quote_currency][base_currency]["fees"]["percentage"]
+            try:
+                fees.setdefault(from_asset, {})[to_asset] = to_units(percentage)
+            except ValueError as e:
+                # left out like a pair that failed, so its previous fee is kept
+                logging.warning(f"Skipping {from_asset} -> {to_asset} fees: {e}")
 
     return fees
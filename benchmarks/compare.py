@@ -0,0 +1,37 @@
+import argparse
+import json
+from pathlib import Path
+
+
+def load(path: Path) -> dict:
+    results = json.loads(path.read_text())
+    return {
+        (run["subscriptions"], stage): values
+        for run in results["runs"]
+        for stage, values in run["stages"].items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark results")
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("candidate", type=Path)
+    parser.add_argument("--metric", default="p50_ms")
+    args = parser.parse_args()
+
+    baseline, candidate = load(args.baseline), load(args.candidate)
+    print(
+        f"{'subscriptions':>13} {'stage':<20} {'baseline':>12} {'candidate':>12} change"
+    )
+    for key in sorted(baseline.keys() & candidate.keys()):
+        size, stage = key
+        before = baseline[key].get(args.metric)
+        after = candidate[key].get(args.metric)
+        if before is None or after is None:
+            continue
+        change = f"{(after - before) / before:+.1%}" if before else "n/a"
+        print(f"{size:>13} {stage:<20} {before:>12.3f} {after:>12.3f} {change}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from pathlib import Path
+
+from telegram.error import RetryAfter
+
+from benchmarks import synthetic
+from benchmarks.fee_check import RESULTS_DIR, git_commit
+from consts import DEFAULT_NETWORK
+from digest import Digest, build_digests, notification_text
+from dispatcher import CHAT_INTERVAL, GLOBAL_RATE, NotificationDispatcher
+from store import SubscriptionStore
+from utils import changed_pairs, get_fee
+
+# Telegram limits are divided by this so that a run takes seconds, not hours
+SPEEDUP = 100
+
+
+class FakeTelegram:
+    def __init__(self, chat_interval: float):
+        self.chat_interval = chat_interval
+        self.calls = 0
+        self.rate_limited = 0
+        self.last_sent: dict[int, float] = {}
+
+    async def send(self, digest: Digest) -> bool:
+        self.calls += 1
+        now = time.monotonic()
+        last = self.last_sent.get(digest.chat_id)
+        if last is not None and now - last < self.chat_interval * 0.9:
+            self.rate_limited += 1
+            raise RetryAfter(1)
+        self.last_sent[digest.chat_id] = now
+        await asyncio.sleep(0)
+        return True
+
+
+def per_subscription(crossed, fees) -> list[Digest]:
+    return [
+        Digest(s.chat_id, [notification_text(s, get_fee(fees, s), DEFAULT_NETWORK)])
+        for s in crossed
+    ]
+
+
+async def bench(per_chat: float, size: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    store = SubscriptionStore()
+    store.extend(synthetic.subscriptions(size, rng, per_chat=per_chat))
+    # a market move on every pair, so that chats watching many pairs cross several
+    timeline = synthetic.fee_timeline(20, rng, volatility=1)
+    current, previous = timeline[-1], timeline[0]
+    crossed = store.crossed(current, previous, changed_pairs(current, previous))
+
+    result = {"per_chat": per_chat, "crossings": len(crossed)}
+    for name, build in (
+        ("per_subscription", per_subscription),
+        ("digest", build_digests),
+    ):
+        telegram = FakeTelegram(CHAT_INTERVAL / SPEEDUP)
+        dispatcher = NotificationDispatcher(
+            rate=GLOBAL_RATE * SPEEDUP, chat_interval=CHAT_INTERVAL / SPEEDUP
+        )
+        start = time.perf_counter()
+        await dispatcher.dispatch(build(crossed, current), telegram.send)
+        result[name] = {
+            "api_calls": telegram.calls,
+            "rate_limited": telegram.rate_limited,
+            # in real seconds at the actual Telegram limits
+            "delivery_s": (time.perf_counter() - start) * SPEEDUP,
+        }
+    return result
+
+
+async def run(args: argparse.Namespace):
+    commit = git_commit()
+    results = {"commit": commit, "seed": args.seed, "size": args.size, "runs": []}
+    for per_chat in args.per_chat:
+        result = await bench(per_chat, args.size, args.seed)
+        results["runs"].append(result)
+        before, after = result["per_subscription"], result["digest"]
+        logging.info(
+            f"{per_chat:>5} subscriptions/chat: {result['crossings']} crossings, "
+            f"{before['api_calls']} -> {after['api_calls']} API calls, "
+            f"{before['delivery_s']:.0f}s -> {after['delivery_s']:.0f}s delivery"
+        )
+
+    output = args.output or RESULTS_DIR / f"digest-{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    logging.info(f"Results written to {output}")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    parser = argparse.ArgumentParser(
+        description="Compare per-subscription messages with per-chat digests"
+    )
+    parser.add_argument("--per-chat", type=float, nargs="+", default=[1, 3, 10, 30])
+    parser.add_argument("--size", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", type=Path)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+from pathlib import Path
+
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+
+from benchmarks import synthetic
+from benchmarks.fee_check import (
+    RESULTS_DIR,
+    bench_database_url,
+    git_commit,
+    insert_subscriptions,
+    measure,
+)
+from bot import crossing_ranges
+from db import Base, get_subscriptions, get_subscriptions_in_ranges
+from utils import changed_pairs
+
+# the schema before and after e41b7f2c9a60 and 3f8a1c9d2e47
+DROP_INDEXES = [
+    "ALTER TABLE subscriptions DROP CONSTRAINT uq_subscriptions_chat_pair_threshold",
+    "DROP INDEX ix_subscriptions_pair_threshold",
+]
+CREATE_INDEXES = [
+    "ALTER TABLE subscriptions ADD CONSTRAINT uq_subscriptions_chat_pair_threshold "
+    "UNIQUE (chat_id, network, from_asset, to_asset, fee_threshold)",
+    "CREATE INDEX ix_subscriptions_pair_threshold "
+    "ON subscriptions (network, from_asset, to_asset, fee_threshold)",
+]
+
+
+async def execute(engine: AsyncEngine, statements: list[str]):
+    async with engine.begin() as conn:
+        for statement in statements:
+            await conn.exec_driver_sql(statement)
+        await conn.exec_driver_sql("ANALYZE subscriptions")
+
+
+async def bench_lookups(
+    engine: AsyncEngine, chat_ids: list[int], ranges: list, repeat: int
+) -> dict:
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def by_chat(i: int):
+        async with session_maker() as session:
+            return await get_subscriptions(session, chat_ids[i])
+
+    async def in_ranges(i: int):
+        async with session_maker() as session:
+            return await get_subscriptions_in_ranges(session, ranges[i])
+
+    return {
+        "by_chat": await measure(by_chat, repeat),
+        "in_ranges": await measure(in_ranges, repeat),
+    }
+
+
+async def bench_size(engine: AsyncEngine, size: int, repeat: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    subscriptions = synthetic.subscriptions(size, rng)
+    timeline = synthetic.fee_timeline(repeat + 1, rng)
+    ranges = [
+        list(crossing_ranges(current, previous, changed_pairs(current, previous)))
+        for current, previous in zip(timeline[1:], timeline)
+    ]
+    chat_ids = [rng.choice(subscriptions).chat_id for _ in range(repeat)]
+
+    await insert_subscriptions(engine, subscriptions)
+    await execute(engine, DROP_INDEXES)
+    before = await bench_lookups(engine, chat_ids, ranges, repeat)
+    await execute(engine, CREATE_INDEXES)
+    after = await bench_lookups(engine, chat_ids, ranges, repeat)
+    return {"subscriptions": size, "before": before, "after": after}
+
+
+async def run(args: argparse.Namespace):
+    url = await bench_database_url()
+    if url is None:
+        logging.error("The lookup benchmark needs Postgres, run make postgres")
+        return
+    engine = create_async_engine(url)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    commit = git_commit()
+    results = {"commit": commit, "seed": args.seed, "runs": []}
+    for size in args.sizes:
+        result = await bench_size(engine, size, args.repeat, args.seed)
+        results["runs"].append(result)
+        for stage in ("by_chat", "in_ranges"):
+            before, after = result["before"][stage], result["after"][stage]
+            logging.info(
+                f"{size:>9} {stage:<10} p50 {before['p50_ms']:9.3f}ms -> "
+                f"{after['p50_ms']:7.3f}ms, p95 {before['p95_ms']:9.3f}ms -> "
+                f"{after['p95_ms']:7.3f}ms"
+            )
+    await engine.dispose()
+
+    output = args.output or RESULTS_DIR / f"lookup-{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    logging.info(f"Results written to {output}")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    parser = argparse.ArgumentParser(
+        description="Subscription lookup latency without and with indexes"
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", type=Path)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
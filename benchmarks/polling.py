@@ -0,0 +1,131 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+from pathlib import Path
+
+from benchmarks import synthetic
+from benchmarks.fee_check import RESULTS_DIR, git_commit
+from consts import Fees
+from polling import AdaptiveInterval
+from store import SubscriptionStore
+from utils import changed_pairs, get_fee
+
+# resolution of the simulated market, in seconds
+STEP = 5
+# the market switches between flat, calm and busy hours
+REGIMES = [(0.5, 0.0), (0.4, 0.002), (0.1, 0.05)]
+
+
+def market(hours: int, rng: random.Random) -> list[Fees]:
+    # the random walk of synthetic.fee_timeline, at a volatility that changes hourly
+    low, high = synthetic.FEE_RANGE
+    fees = {pair: 1000 for pair, _ in synthetic.PAIRS}
+    weights = [weight for weight, _ in REGIMES]
+    timeline = []
+    for _ in range(hours):
+        volatility = rng.choices([v for _, v in REGIMES], weights=weights)[0]
+        for _ in range(3600 // STEP):
+            snapshot: Fees = {}
+            for pair in fees:
+                if rng.random() < volatility:
+                    step = synthetic.FEE_STEP * rng.choice((-3, -2, -1, 1, 2, 3))
+                    fees[pair] = min(high, max(low, fees[pair] + step))
+                from_asset, to_asset = pair
+                snapshot.setdefault(from_asset, {})[to_asset] = fees[pair]
+            timeline.append(snapshot)
+    return timeline
+
+
+def last_crossing(timeline: list[Fees], subscription, since: int, until: int) -> int:
+    def below(step: int) -> bool:
+        return get_fee(timeline[step], subscription) <= subscription.fee_threshold
+
+    for step in range(until, since, -1):
+        if below(step) != below(step - 1):
+            return step
+    return until
+
+
+async def simulate(
+    timeline: list[Fees], store: SubscriptionStore, polling: AdaptiveInterval | None
+) -> dict:
+    async def count(ranges):
+        return store.count_in_ranges(ranges)
+
+    polls, latencies = 0, []
+    previous_step, step = None, 0
+    interval = 60
+    while step < len(timeline):
+        polls += 1
+        current = timeline[step]
+        if previous_step is not None:
+            previous = timeline[previous_step]
+            for subscription in store.crossed(
+                current, previous, changed_pairs(current, previous)
+            ):
+                crossed = last_crossing(timeline, subscription, previous_step, step)
+                latencies.append((step - crossed) * STEP)
+        if polling is not None:
+            interval = await polling.observe(current, count)
+        previous_step = step
+        step += max(1, round(interval / STEP))
+
+    latencies.sort()
+    return {
+        "api_calls": polls,
+        "notifications": len(latencies),
+        "latency_p50_s": latencies[len(latencies) // 2] if latencies else 0,
+        "latency_mean_s": sum(latencies) / len(latencies) if latencies else 0,
+    }
+
+
+async def run(args: argparse.Namespace):
+    rng = random.Random(args.seed)
+    store = SubscriptionStore()
+    store.extend(synthetic.subscriptions(args.size, rng))
+    timeline = market(args.hours, rng)
+
+    commit = git_commit()
+    results = {
+        "commit": commit,
+        "seed": args.seed,
+        "size": args.size,
+        "hours": args.hours,
+        "fixed": await simulate(timeline, store, None),
+        "adaptive": await simulate(
+            timeline, store, AdaptiveInterval(args.minimum, args.maximum, 60)
+        ),
+    }
+    for name in ("fixed", "adaptive"):
+        result = results[name]
+        logging.info(
+            f"{name:<8} {result['api_calls']:>6} API calls, "
+            f"{result['notifications']:>7} notifications, "
+            f"latency p50 {result['latency_p50_s']:.0f}s "
+            f"mean {result['latency_mean_s']:.1f}s"
+        )
+
+    output = args.output or RESULTS_DIR / f"polling-{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    logging.info(f"Results written to {output}")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    parser = argparse.ArgumentParser(
+        description="Simulate a fixed 60s and an adaptive polling interval"
+    )
+    parser.add_argument("--hours", type=int, default=48)
+    parser.add_argument("--size", type=int, default=1000)
+    parser.add_argument("--minimum", type=float, default=10)
+    parser.add_argument("--maximum", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", type=Path)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
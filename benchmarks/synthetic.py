@@ -0,0 +1,96 @@
+import random
+
+from consts import FEE_SCALE, Fees, Pair, SwapType
+from store import StoredSubscription
+
+# the pairs offered by Boltz, lightning ones are by far the most watched
+PAIRS: list[tuple[Pair, int]] = [
+    (("BTC", "LN"), 30),
+    (("LN", "BTC"), 25),
+    (("L-BTC", "LN"), 10),
+    (("LN", "L-BTC"), 10),
+    (("RBTC", "LN"), 3),
+    (("LN", "RBTC"), 3),
+    (("BTC", "L-BTC"), 6),
+    (("L-BTC", "BTC"), 6),
+    (("BTC", "RBTC"), 2),
+    (("RBTC", "BTC"), 2),
+    (("L-BTC", "RBTC"), 1),
+    (("RBTC", "L-BTC"), 1),
+]
+
+# the values offered as buttons by /subscribe, 0.05%, -0.1% and -0.15%
+COMMON_THRESHOLDS = [500, -1000, -1500]
+
+FEE_STEP = 100
+FEE_RANGE = (-3000, 5000)
+
+
+def random_threshold(rng: random.Random) -> int:
+    if rng.random() < 0.7:
+        return rng.choice(COMMON_THRESHOLDS)
+    low, high = FEE_RANGE
+    return low + FEE_STEP * rng.randrange((high - low) // FEE_STEP + 1)
+
+
+def subscriptions(
+    count: int, rng: random.Random, per_chat: float = 3
+) -> list[StoredSubscription]:
+    pairs = [pair for pair, _ in PAIRS]
+    weights = [weight for _, weight in PAIRS]
+    chats = max(1, int(count / per_chat))
+    # a chat can only subscribe to a pair and threshold once
+    seen = set()
+    result = []
+    while len(result) < count:
+        from_asset, to_asset = rng.choices(pairs, weights=weights)[0]
+        chat_id = rng.randrange(chats) + 1
+        threshold = random_threshold(rng)
+        key = (chat_id, from_asset, to_asset, threshold)
+        if key in seen:
+            continue
+        seen.add(key)
+        result.append(
+            StoredSubscription(
+                id=len(result) + 1,
+                chat_id=chat_id,
+                from_asset=from_asset,
+                to_asset=to_asset,
+                fee_threshold=threshold,
+            )
+        )
+    return result
+
+
+def fee_timeline(ticks: int, rng: random.Random, volatility: float = 0.3) -> list[Fees]:
+    # every pair does a bounded random walk and moves in a share of the ticks
+    low, high = FEE_RANGE
+    fees = {pair: 1000 for pair, _ in PAIRS}
+    timeline = []
+    for _ in range(ticks):
+        snapshot: Fees = {}
+        for pair in fees:
+            if rng.random() < volatility:
+                step = FEE_STEP * rng.choice((-3, -2, -1, 1, 2, 3))
+                fees[pair] = min(high, max(low, fees[pair] + step))
+            from_asset, to_asset = pair
+            snapshot.setdefault(from_asset, {})[to_asset] = fees[pair]
+        timeline.append(snapshot)
+    return timeline
+
+
+def api_responses(fees: Fees) -> dict[SwapType, dict]:
+    # inverse of api.get_fees: lightning is BTC on the other side of the swap
+    responses = {swap_type: {} for swap_type in SwapType}
+    for from_asset, pairs in fees.items():
+        for to_asset, fee in pairs.items():
+            if to_asset == "LN":
+                swap_type, quote, base = SwapType.SUBMARINE, from_asset, "BTC"
+            elif from_asset == "LN":
+                swap_type, quote, base = SwapType.REVERSE, "BTC", to_asset
+            else:
+                swap_type, quote, base = SwapType.CHAIN, from_asset, to_asset
+            responses[swap_type].setdefault(quote, {})[base] = {
+                "fees": {"percentage": fee / FEE_SCALE}
+            }
+    return responses
@@ -0,0 +1,155 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+from telegram.ext import Application
+from telegram.request import BaseRequest, RequestData
+
+from commands.start import start_handler
+from webhook import start_webhook_server
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Boltz", "username": "boltz_bot"}
+PATH = "/webhook"
+SECRET = "benchmark"
+
+
+class FakeTelegram(BaseRequest):
+    # answers the Bot API locally, so that only the webhook side is measured
+    def __init__(self):
+        self.sent: list[dict] = []
+        self.all_sent = asyncio.Event()
+        self.expected = 0
+
+    @property
+    def read_timeout(self) -> float | None:
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(
+        self, url: str, method: str, request_data: RequestData | None = None, **_
+    ) -> tuple[int, bytes]:
+        endpoint = url.rsplit("/", 1)[-1]
+        parameters = request_data.parameters if request_data else {}
+        if endpoint == "getMe":
+            result = BOT_USER
+        elif endpoint == "sendMessage":
+            self.sent.append(parameters)
+            if len(self.sent) >= self.expected:
+                self.all_sent.set()
+            result = message(len(self.sent), parameters["chat_id"], BOT_USER)
+            result["text"] = parameters["text"]
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def message(message_id: int, chat_id: int, user: dict, text: str = "") -> dict:
+    return {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": user,
+        "text": text,
+    }
+
+
+def start_update(update_id: int) -> dict:
+    # shape of a recorded /start update of a private chat
+    user = {"id": update_id, "is_bot": False, "first_name": "User"}
+    update = message(update_id, update_id, user, "/start")
+    update["entities"] = [{"type": "bot_command", "offset": 0, "length": 6}]
+    return {"update_id": update_id, "message": update}
+
+
+def build_application(telegram: FakeTelegram) -> Application:
+    application = (
+        Application.builder()
+        .token("1:benchmark")
+        .request(telegram)
+        .get_updates_request(telegram)
+        .updater(None)
+        .build()
+    )
+    application.add_handler(start_handler)
+    return application
+
+
+async def post_updates(port: int, updates: list[dict], connections: int) -> list[int]:
+    # a bare keep-alive client, an HTTP library costs more than the server
+    async def post(chunk: list[dict]) -> list[int]:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        statuses = []
+        for update in chunk:
+            body = json.dumps(update).encode()
+            writer.write(
+                f"POST {PATH} HTTP/1.1\r\n"
+                f"Host: 127.0.0.1:{port}\r\n"
+                "Content-Type: application/json\r\n"
+                f"X-Telegram-Bot-Api-Secret-Token: {SECRET}\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n".encode()
+                + body
+            )
+            status = await reader.readline()
+            while (await reader.readline()).strip():
+                pass
+            statuses.append(int(status.split()[1]))
+        writer.close()
+        return statuses
+
+    results = await asyncio.gather(
+        *(post(updates[i::connections]) for i in range(connections))
+    )
+    return [status for statuses in results for status in statuses]
+
+
+async def measure(count: int, connections: int) -> dict:
+    telegram = FakeTelegram()
+    telegram.expected = count
+    application = build_application(telegram)
+    async with application:
+        await application.start()
+        server = await start_webhook_server(application, "127.0.0.1", 0, PATH, SECRET)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            updates = [start_update(i + 1) for i in range(count)]
+            start = time.perf_counter()
+            statuses = await post_updates(port, updates, connections)
+            received = time.perf_counter() - start
+            await asyncio.wait_for(telegram.all_sent.wait(), 60)
+            handled = time.perf_counter() - start
+        finally:
+            server.close()
+            server.close_clients()
+            await application.stop()
+
+    return {
+        "updates": count,
+        "accepted": statuses.count(200),
+        "replies": len(telegram.sent),
+        "received_per_s": count / received,
+        "handled_per_s": count / handled,
+    }
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Measure webhook update throughput")
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--connections", type=int, default=8)
+    args = parser.parse_args()
+    result = asyncio.run(measure(args.updates, args.connections))
+    logging.info(
+        f"{result['updates']} updates: received {result['received_per_s']:.0f}/s, "
+        f"handled {result['handled_per_s']:.0f}/s"
+    )
+
+
+if __name__ == "__main__":
+    main()
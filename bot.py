@@ -1,54 +1,77 @@
+import asyncio
 import logging
+import time
+from collections.abc import AsyncIterator, Callable, Iterable, Iterator
 
-from httpx import AsyncClient
 from pydantic import ValidationError
+from sqlalchemy import Row
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from telegram import Bot
+from telegram.error import BadRequest, NetworkError, RetryAfter
 from telegram.ext import Application
+from telegram.request import HTTPXRequest
 
-from api import get_all_fees
+from api import FeeClient, create_client
 from commands.mysubscriptions import mysubscriptions_handler
 from commands.start import start_handler
 from commands.unsubscribe import unsubscribe_handler
-from consts import Fees, ALL_FEES
+from consts import DEFAULT_NETWORK, Fees, ALL_FEES, Pair
+from digest import Digest
+from dispatcher import NotificationDispatcher
+from history import ROLLUP_INTERVAL, HistoryWriter, rollup_history
+from instrumentation import InstrumentedRequest, instrument, instrument_engine
+from metrics import (
+    CROSSINGS,
+    EVALUATION_SECONDS,
+    TICK_OVERRUNS,
+    TICK_SECONDS,
+    start_metrics_server,
+)
+from sharding import ShardWorker, listen_snapshots
+from snapshot import latest_fees, publish_snapshot
+from outbox import OutboxDelivery, Undeliverable
+from pipeline import MonitorPipeline
+from polling import AdaptiveInterval, SingleFlight, count_near
+from store import STORE_KEY, StoredSubscription, SubscriptionStore, record_pair_counts
 from db import (
+    STREAM_BATCH,
+    add_outbox,
     get_previous,
+    stream_subscriptions_in_ranges,
+    lock_previous,
     upsert_previous,
     Subscription,
-    get_subscriptions,
+    FeeRange,
 )
 from settings import Settings
 from commands.subscribe import subscribe_handler
-from utils import encode_url_params, get_fee
+from utils import get_fee, changed_pairs, network_key
+from webhook import run_webhook
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
 logging.getLogger("apscheduler").setLevel(logging.WARN)
 logging.getLogger("httpx").setLevel(logging.WARN)
 
 
-async def notify_subscription(
-    bot: Bot,
-    subscription: Subscription,
-    fees: Fees,
-):
-    from_asset = subscription.from_asset
-    to_asset = subscription.to_asset
-
-    url = encode_url_params(from_asset, to_asset)
-    threshold_msg = (
-        f"have reached {subscription.fee_threshold}%"
-        if get_fee(fees, subscription) <= subscription.fee_threshold
-        else f"are above {subscription.fee_threshold}% again"
-    )
-    message = f"Fees for {from_asset} -> {to_asset} {threshold_msg}: {url}"
+async def notify_chat(bot: Bot, digest: Digest) -> bool:
     try:
         await bot.send_message(
-            chat_id=subscription.chat_id,
-            text=message,
+            chat_id=digest.chat_id,
+            text=digest.text,
         )
-        logging.debug(f"Notification sent to {subscription.chat_id}")
+        logging.debug(f"Notification sent to {digest.chat_id}")
+        return True
+    except RetryAfter:
+        raise
+    except NetworkError as e:
+        # a bad request fails the same way when it is sent again
+        if isinstance(e, BadRequest):
+            raise Undeliverable(f"Could not notify chat {digest.chat_id}: {e}") from e
+        logging.error(f"Error notifying chat {digest.chat_id}: {e}")
+        return False
     except Exception as e:
-        logging.error(f"Error notifying subscription {subscription.chat_id}: {e}")
+        # e.g. the bot was blocked or the chat was deleted
+        raise Undeliverable(f"Could not notify chat {digest.chat_id}: {e}") from e
 
 
 def check_subscription(
@@ -64,60 +87,332 @@ def check_subscription(
     return below or above
 
 
-async def check_fees(session: AsyncSession, current: Fees) -> list[Subscription]:
-    previous = await get_previous(session, ALL_FEES)
-    result = []
-    if previous:
-        result = [
-            subscription
-            for subscription in await get_subscriptions(session)
-            if check_subscription(current, previous, subscription)
-        ]
-    await upsert_previous(session, ALL_FEES, current)
-    return result
+def crossing_ranges(
+    current: Fees, previous: Fees, pairs: Iterable[Pair]
+) -> Iterator[FeeRange]:
+    for from_asset, to_asset in sorted(pairs):
+        fee = current.get(from_asset, {}).get(to_asset, None)
+        previous_fee = previous.get(from_asset, {}).get(to_asset, None)
+        if fee is None or previous_fee is None or fee == previous_fee:
+            continue
+        yield from_asset, to_asset, min(fee, previous_fee), max(fee, previous_fee)
+
+
+async def stream_crossings(
+    session: AsyncSession,
+    current: Fees,
+    previous: Fees,
+    changed: set[Pair],
+    store: SubscriptionStore | None = None,
+    network: str = DEFAULT_NETWORK,
+) -> AsyncIterator[StoredSubscription | Row]:
+    if store is not None:
+        for subscription in store.crossed(current, previous, changed):
+            yield subscription
+        return
+    # crossings are handed on while the query is still being read
+    async for row in stream_subscriptions_in_ranges(
+        session, crossing_ranges(current, previous, changed), network
+    ):
+        yield row
+
+
+async def queue_crossings(
+    session: AsyncSession,
+    crossed: list[StoredSubscription | Row],
+    current: Fees,
+    network: str,
+    wake: Callable[[], None] | None,
+) -> int:
+    count = await add_outbox(session, crossed, current, network)
+    await session.commit()
+    if count and wake is not None:
+        wake()
+    return count
+
+
+async def check_fees(
+    session: AsyncSession,
+    current: Fees,
+    store: SubscriptionStore | None = None,
+    network: str = DEFAULT_NETWORK,
+    wake: Callable[[], None] | None = None,
+) -> int:
+    key = network_key(ALL_FEES, network)
+    await lock_previous(session, key)
+    previous = await get_previous(session, key)
+    if not previous:
+        await upsert_previous(session, key, current)
+        return 0
+
+    changed = changed_pairs(current, previous)
+    if not changed:
+        await session.commit()
+        return 0
+    # every batch of crossings is committed on its own, so that delivery starts
+    # before the scan finishes. The fees are stored once all of them are queued: a
+    # crash in between detects the crossings again, and pending ones are not repeated
+    count = 0
+    async with AsyncSession(session.bind, expire_on_commit=False) as outbox:
+        with EVALUATION_SECONDS.time():
+            batch = []
+            async for subscription in stream_crossings(
+                session, current, previous, changed, store, network
+            ):
+                batch.append(subscription)
+                if len(batch) == STREAM_BATCH:
+                    count += await queue_crossings(
+                        outbox, batch, current, network, wake
+                    )
+                    batch = []
+            count += await queue_crossings(outbox, batch, current, network, wake)
+    CROSSINGS.inc(count)
+    await upsert_previous(session, key, current, changed)
+    return count
+
+
+class NetworkMonitor:
+    # fetches and evaluates the fees of one Boltz deployment with its own API
+    # connections, the database, the dispatcher and the outbox are shared
+    def __init__(
+        self,
+        network: str,
+        api_url: str,
+        application: Application,
+        session_maker: async_sessionmaker,
+        outbox: OutboxDelivery,
+        settings: Settings,
+        store: SubscriptionStore | None = None,
+    ):
+        self.network = network
+        self.application = application
+        self.session_maker = session_maker
+        self.outbox = outbox
+        self.store = store
+        self.deadline = settings.tick_deadline
+        self.client = create_client(api_url)
+        self.fee_client = FeeClient(self.client, network=network)
+        self.history = HistoryWriter(session_maker, network)
+        self.polling = AdaptiveInterval(
+            settings.min_check_interval,
+            settings.max_check_interval,
+            settings.check_interval,
+            network,
+        )
+        self.flight = SingleFlight(settings.tick_deadline)
+        self.pipeline = MonitorPipeline(self.fetch, self.evaluate)
+        self._evaluator: asyncio.Task | None = None
+
+    async def start(self):
+        if self.store is not None:
+            async with self.session_maker() as session:
+                await self.store.load(session, network=self.network)
+            logging.info(f"Loaded {len(self.store)} {self.network} subscriptions")
+        self._evaluator = asyncio.create_task(self.pipeline.run_evaluator())
+        try:
+            await self.tick()
+        except Exception as e:
+            # the tick is already rescheduled, and the other networks and the
+            # commands keep running while this API is down
+            logging.error(f"First monitor tick of {self.network} failed: {e!r}")
+
+    async def close(self):
+        if self._evaluator is not None:
+            self._evaluator.cancel()
+        await self.client.aclose()
+        await self.history.flush()
+
+    async def tick(self, _context=None):
+        start = time.perf_counter()
+        interval = self.polling.interval
+        try:
+            await self.flight.run(self.pipeline.fetch)
+        finally:
+            # every tick schedules the next one, also when it failed, counted from
+            # its start so that the cadence holds and an overrun does not pile up
+            duration = time.perf_counter() - start
+            self.application.job_queue.run_once(
+                self.tick, max(self.polling.interval - duration, 0)
+            )
+            TICK_SECONDS.observe(duration)
+            if duration > interval:
+                TICK_OVERRUNS.inc()
+                logging.warning(
+                    f"Monitor tick of {self.network} took {duration:.1f}s, "
+                    "longer than the check interval"
+                )
+
+    async def fetch(self) -> Fees:
+        current = await self.fee_client.get_all_fees()
+        publish_snapshot(self.application.bot_data, current, self.network)
+        self.history.record(current)
+        return current
+
+    async def evaluate(self, current: Fees):
+        async with asyncio.timeout(self.deadline):
+            async with self.session_maker() as session:
+                await check_fees(
+                    session, current, self.store, self.network, self.outbox.wake
+                )
+        await self.polling.observe(
+            current,
+            lambda ranges: count_near(
+                self.session_maker, ranges, self.store, self.network
+            ),
+        )
+        await record_pair_counts(self.session_maker, self.store, self.network)
+
+
+async def run_worker(settings: Settings):
+    engine = create_async_engine(settings.database_url)
+    async_session = async_sessionmaker(engine, expire_on_commit=False)
+    metrics_server = None
+    if settings.metrics_port is not None:
+        metrics_server = await start_metrics_server(
+            settings.metrics_host, settings.metrics_port
+        )
+
+    # several networks need the standalone mode, see Settings.check_networks
+    network, api_url = next(iter(settings.networks.items()))
+    async with (
+        create_client(api_url) as client,
+        Bot(settings.telegram_bot_token) as bot,
+    ):
+        worker = ShardWorker(
+            database_url=settings.database_url,
+            session_maker=async_session,
+            shard_index=settings.shard_index,
+            shard_count=settings.shard_count,
+            polling=AdaptiveInterval(
+                settings.min_check_interval,
+                settings.max_check_interval,
+                settings.check_interval,
+                network,
+            ),
+            fetch=FeeClient(client, network=network).get_all_fees,
+            send=lambda digest: notify_chat(bot, digest),
+            # the global limit of Telegram applies to the bot, not to a process
+            dispatcher=NotificationDispatcher(
+                rate=settings.notification_rate / settings.shard_count,
+                chat_interval=settings.chat_notification_interval,
+            ),
+            history=HistoryWriter(async_session, network),
+            network=network,
+        )
+        try:
+            await worker.run()
+        finally:
+            await worker.history.flush()
+            if metrics_server is not None:
+                metrics_server.close()
+            await engine.dispose()
 
 
 def main():
     try:
         settings = Settings()
+        if settings.mode == "worker":
+            asyncio.run(run_worker(settings))
+            return
 
         engine = create_async_engine(settings.database_url)
         async_session = async_sessionmaker(engine, expire_on_commit=False)
 
-        application = Application.builder().token(settings.telegram_bot_token).build()
+        builder = Application.builder().token(settings.telegram_bot_token)
+        if settings.webhook_url:
+            builder.updater(None)
+        if settings.handler_instrumentation:
+            instrument_engine(engine)
+            # the pool size is what the builder uses by default
+            builder.request(InstrumentedRequest(HTTPXRequest(connection_pool_size=256)))
+        application = builder.build()
         application.bot_data["settings"] = settings
         application.bot_data["session_maker"] = async_session
+        stores = {}
+        if settings.subscription_store:
+            stores = {network: SubscriptionStore() for network in settings.networks}
+            application.bot_data[STORE_KEY] = stores
 
-        application.add_handler(start_handler)
-        application.add_handler(mysubscriptions_handler)
-        application.add_handler(subscribe_handler)
-        application.add_handler(unsubscribe_handler)
+        handlers = [
+            start_handler,
+            mysubscriptions_handler,
+            subscribe_handler,
+            unsubscribe_handler,
+        ]
+        for handler in handlers:
+            if settings.handler_instrumentation:
+                instrument(handler, settings.slow_update_threshold)
+            application.add_handler(handler)
 
-        client = AsyncClient(base_url=settings.api_url)
+        dispatcher = NotificationDispatcher(
+            rate=settings.notification_rate,
+            chat_interval=settings.chat_notification_interval,
+        )
+        # one outbox for all networks, so that they share the limits of the bot
+        outbox = OutboxDelivery(
+            async_session,
+            dispatcher,
+            lambda digest: notify_chat(application.bot, digest),
+            current_fees=lambda network: latest_fees(application.bot_data, network),
+        )
+        monitors = [
+            NetworkMonitor(
+                network,
+                api_url,
+                application,
+                async_session,
+                outbox,
+                settings,
+                stores.get(network),
+            )
+            for network, api_url in settings.networks.items()
+        ]
+        metrics_server = None
+        snapshot_listener = None
+        delivery = None
 
         async def post_init(app: Application):
-            await monitor_fees(app)
+            nonlocal metrics_server, snapshot_listener, delivery
+            if settings.metrics_port is not None:
+                metrics_server = await start_metrics_server(
+                    settings.metrics_host, settings.metrics_port
+                )
+            if settings.mode == "commands":
+                # the workers fetch fees, this process only keeps /subscribe current
+                snapshot_listener = asyncio.create_task(
+                    listen_snapshots(
+                        settings.database_url,
+                        async_session,
+                        app.bot_data,
+                        settings.networks,
+                    )
+                )
+                return
+            # also delivers what was left in the outbox by the last run
+            delivery = asyncio.create_task(outbox.run())
+            await asyncio.gather(*(monitor.start() for monitor in monitors))
 
         async def post_shutdown(app: Application):
-            await client.aclose()
-
-        async def monitor_fees(app: Application):
-            current = await get_all_fees(client)
-            async with async_session() as session:
-                notifications = await check_fees(session, current)
-            if len(notifications) > 0:
-                logging.info(
-                    f"Sending notifications to {len(notifications)} subscriptions"
-                )
-                for subscription in notifications:
-                    await notify_subscription(app.bot, subscription, current)
+            if delivery is not None:
+                delivery.cancel()
+            for monitor in monitors:
+                await monitor.close()
+            if snapshot_listener is not None:
+                snapshot_listener.cancel()
+            if metrics_server is not None:
+                metrics_server.close()
+                await metrics_server.wait_closed()
+
+        async def rollup(_):
+            await rollup_history(async_session, settings.history_retention)
 
         application.post_init = post_init
         application.post_shutdown = post_shutdown
-        application.job_queue.run_repeating(
-            monitor_fees, interval=settings.check_interval
-        )
-        application.run_polling()
+        application.job_queue.run_repeating(rollup, interval=ROLLUP_INTERVAL)
+        if settings.webhook_url:
+            asyncio.run(run_webhook(application, settings))
+        else:
+            application.run_polling()
 
     except ValidationError as e:
         logging.error(f"Configuration validation error: {e}")
@@ -1,6 +1,4 @@
-import decimal
 import logging
-from decimal import Decimal
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from telegram import (
@@ -22,7 +20,10 @@ from db import (
     get_subscriptions,
     get_subscription,
     remove_subscription,
+    update_subscription,
 )
+from fixed import parse_threshold
+from store import subscription_store
 
 SELECT, ACTION, UPDATE_THRESHOLD = range(3)
 
@@ -97,7 +98,11 @@ async def action(update: Update, context: ContextTypes.DEFAULT_TYPE):
         async with db_session(context) as session:
             subscription = await selected_subscription(session, update, context)
             if subscription:
-                await remove_subscription(session, subscription)
+                await remove_subscription(
+                    session,
+                    subscription,
+                    subscription_store(context, subscription.network),
+                )
                 await query.message.chat.send_message("Subscription removed.")
                 logging.info(f"Removed: {subscription}")
 
@@ -111,12 +116,20 @@ async def update_threshold(update: Update, context: ContextTypes.DEFAULT_TYPE):
         subscription = await selected_subscription(session, update, context)
         if subscription:
             try:
-                subscription.fee_threshold = Decimal(update.message.text)
-            except decimal.InvalidOperation:
+                subscription.fee_threshold = parse_threshold(update.message.text)
+            except ValueError:
                 await update.message.reply_text("Invalid threshold. Try again.")
                 return UPDATE_THRESHOLD
-            await session.commit()
-            await update.message.reply_text("Threshold updated.")
+            if await update_subscription(
+                session,
+                subscription,
+                subscription_store(context, subscription.network),
+            ):
+                await update.message.reply_text("Threshold updated.")
+            else:
+                await update.message.reply_text(
+                    "You are already subscribed at this threshold."
+                )
 
     return ConversationHandler.END
 
@@ -1,7 +1,5 @@
-import decimal
 import logging
-from decimal import Decimal
-from typing import Iterable
+from typing import Iterable, Mapping
 
 from telegram import (
     Update,
@@ -17,18 +15,22 @@ from telegram.ext import (
     CallbackQueryHandler,
 )
 
-from consts import Fees, ALL_FEES
+from consts import DEFAULT_NETWORK, Fees
 from db import (
     add_subscription,
     Subscription,
     db_session,
     get_subscriptions,
-    get_previous,
 )
+from fixed import format_fee, parse_threshold
+from snapshot import get_snapshot_fees
+from store import subscription_store
 from utils import encode_url_params, get_fee
 
-FROM_ASSET, TO_ASSET, THRESHOLD, CUSTOM_THRESHOLD = range(4)
+NETWORK, FROM_ASSET, TO_ASSET, THRESHOLD, CUSTOM_THRESHOLD = range(5)
 
+NETWORK_PREFIX = "network_"
+NETWORK_PATTERN = rf"^{NETWORK_PREFIX}.+$"
 ASSET_PREFIX = "asset_"
 ASSET_PATTERN = rf"^{ASSET_PREFIX}.+$"
 
@@ -37,37 +39,69 @@ def remove_asset_prefix(asset: str) -> str:
     return asset.replace(ASSET_PREFIX, "")
 
 
-def inline_keyboard(assets: Iterable[str]):
-    rows = [
-        [
-            InlineKeyboardButton(asset, callback_data=ASSET_PREFIX + asset)
-            for asset in assets
-        ]
-    ]
+def inline_keyboard(items: Iterable[str], prefix: str = ASSET_PREFIX):
+    rows = [[InlineKeyboardButton(item, callback_data=prefix + item) for item in items]]
     return InlineKeyboardMarkup(rows)
 
 
-def filter_fees(fees: Fees, subscriptions: list[Subscription]) -> Fees:
-    for subscription in subscriptions:
-        fees[subscription.from_asset].pop(subscription.to_asset, None)
-        if len(fees[subscription.from_asset]) == 0:
-            fees.pop(subscription.from_asset)
-    return fees
+def filter_fees(
+    fees: Mapping[str, Mapping[str, int]], subscriptions: list[Subscription]
+) -> Fees:
+    subscribed = {(sub.from_asset, sub.to_asset) for sub in subscriptions}
+    result = {}
+    for from_asset, pairs in fees.items():
+        available = {
+            to_asset: fee
+            for to_asset, fee in pairs.items()
+            if (from_asset, to_asset) not in subscribed
+        }
+        if available:
+            result[from_asset] = available
+    return result
 
 
 async def subscribe(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    async with db_session(context) as session:
-        subscriptions = await get_subscriptions(session, update.effective_chat.id)
-        fees = await get_previous(session, ALL_FEES)
-        context.chat_data["available_pairs"] = filter_fees(fees, subscriptions)
+    networks = context.bot_data["settings"].networks
+    if len(networks) > 1:
+        await update.message.reply_text(
+            "Select the network for your notifications.",
+            reply_markup=inline_keyboard(networks.keys(), NETWORK_PREFIX),
+        )
+        return NETWORK
+
+    context.chat_data["network"] = next(iter(networks), DEFAULT_NETWORK)
     await update.message.reply_text(
         "Select the send asset for your notifications.",
-        reply_markup=inline_keyboard(fees.keys()),
+        reply_markup=await asset_keyboard(update, context),
     )
+    return FROM_ASSET
 
+
+async def network(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    context.chat_data["network"] = query.data.replace(NETWORK_PREFIX, "")
+    await query.edit_message_text(
+        "Select the send asset for your notifications.",
+        reply_markup=await asset_keyboard(update, context),
+    )
     return FROM_ASSET
 
 
+async def asset_keyboard(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> InlineKeyboardMarkup:
+    network = context.chat_data["network"]
+    async with db_session(context) as session:
+        subscriptions = await get_subscriptions(
+            session, update.effective_chat.id, network
+        )
+        fees = await get_snapshot_fees(context, session, network)
+    available_pairs = filter_fees(fees, subscriptions)
+    context.chat_data["available_pairs"] = available_pairs
+    return inline_keyboard(available_pairs.keys())
+
+
 async def from_asset(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
@@ -108,17 +142,20 @@ async def save_threshold(
         try:
             subscription = Subscription(
                 chat_id=chat.id,
-                fee_threshold=Decimal(fee_threshold.strip("%")),
+                fee_threshold=parse_threshold(fee_threshold),
                 from_asset=context.chat_data["from_asset"],
                 to_asset=context.chat_data["to_asset"],
+                network=context.chat_data.get("network", DEFAULT_NETWORK),
             )
-        except decimal.InvalidOperation:
+        except ValueError:
             await chat.send_message("Invalid threshold value. Please try again.")
             return
 
-        if await add_subscription(session, subscription):
-            latest = await get_previous(session, ALL_FEES)
-            current_value = get_fee(latest, subscription)
+        store = subscription_store(context, subscription.network)
+        if await add_subscription(session, subscription, store):
+            latest = await get_snapshot_fees(context, session, subscription.network)
+            fee = get_fee(latest, subscription)
+            current_value = format_fee(fee) if fee is not None else "unknown"
             url = encode_url_params(subscription.from_asset, subscription.to_asset)
             await chat.send_message(
                 f"You have subscribed to fee alerts for *{subscription.pretty_string()}*!\nCurrent fees: [{current_value}%]({url})",
@@ -152,6 +189,7 @@ entry_point = CommandHandler("subscribe", subscribe)
 subscribe_handler = ConversationHandler(
     entry_points=[entry_point],
     states={
+        NETWORK: [CallbackQueryHandler(network, pattern=NETWORK_PATTERN)],
         FROM_ASSET: [CallbackQueryHandler(from_asset, pattern=ASSET_PATTERN)],
         TO_ASSET: [CallbackQueryHandler(to_asset, pattern=ASSET_PATTERN)],
         THRESHOLD: [CallbackQueryHandler(threshold, pattern=r"^(custom|-?\d*\.?\d+)$")],
@@ -7,13 +7,16 @@ from db import (
     remove_all_subscriptions,
     db_session,
 )
+from store import subscription_stores
 
 
 async def unsubscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
     async with db_session(context) as session:
         chat_id = update.message.chat_id
 
-        if await remove_all_subscriptions(session, chat_id):
+        if await remove_all_subscriptions(
+            session, chat_id, subscription_stores(context).values()
+        ):
             await update.message.reply_text(
                 "You have unsubscribed from all fee alerts."
             )
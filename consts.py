@@ -1,6 +1,8 @@
 import enum
 
-Fees = dict[str, dict[str, float]]
+# fees and thresholds are fixed-point integers of FEE_SCALE units per percent
+Fees = dict[str, dict[str, int]]
+Pair = tuple[str, str]
 
 PRO_URL = "https://pro.boltz.exchange"
 
@@ -8,6 +10,15 @@ SUBMARINE_SWAP_TYPE = "submarine"
 
 ALL_FEES = "all_fees"
 
+# the network of the api_url setting, which existed before several were supported
+DEFAULT_NETWORK = "mainnet"
+
+# hundredths of a basis point
+FEE_SCALE = 10_000
+
+SNAPSHOT_CHANNEL = "fee_snapshot"
+SUBSCRIPTIONS_CHANNEL = "subscription_changes"
+
 
 class SwapType(enum.Enum):
     SUBMARINE = "submarine"
@@ -1,11 +1,22 @@
-from sqlalchemy import Column, Text, JSON, BigInteger, delete, DECIMAL
-from sqlalchemy import select
+from collections.abc import AsyncIterator, Iterable
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING
+
+from sqlalchemy import Column, Text, BigInteger, delete, Index, Row
+from sqlalchemy import UniqueConstraint, update
+from sqlalchemy import DateTime, Double, Integer, insert, select, and_, or_, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import declarative_base
+from sqlalchemy.orm import aliased, declarative_base
 from telegram.ext import ContextTypes
 
-from consts import Fees
+from consts import ALL_FEES, DEFAULT_NETWORK, Fees, Pair, SUBSCRIPTIONS_CHANNEL
+from fixed import format_fee
+from metrics import DB_QUERY_SECONDS, OUTBOX_SUPERSEDED, timed
+
+if TYPE_CHECKING:
+    from store import SubscriptionStore
 
 Base = declarative_base()
 
@@ -14,40 +25,111 @@ class Subscription(Base):
     __tablename__ = "subscriptions"
     id = Column(BigInteger, primary_key=True, autoincrement=True)
     chat_id = Column(BigInteger, nullable=False)
+    network = Column(
+        Text, nullable=False, default=DEFAULT_NETWORK, server_default=DEFAULT_NETWORK
+    )
     from_asset = Column(Text, nullable=False)
     to_asset = Column(Text, nullable=False)
-    fee_threshold = Column(DECIMAL, nullable=False)
+    # in FEE_SCALE units, so that evaluation only compares integers
+    fee_threshold = Column(BigInteger, nullable=False)
+
+    __table_args__ = (
+        Index(
+            "ix_subscriptions_pair_threshold",
+            network,
+            from_asset,
+            to_asset,
+            fee_threshold,
+        ),
+        # also serves the lookups by chat_id
+        UniqueConstraint(
+            chat_id,
+            network,
+            from_asset,
+            to_asset,
+            fee_threshold,
+            name="uq_subscriptions_chat_pair_threshold",
+        ),
+    )
 
     def __str__(self):
-        return f"Subscription(chat_id={self.chat_id}, from_asset={self.from_asset}, to_asset={self.to_asset}, fee_threshold={self.fee_threshold})"
+        return f"Subscription(chat_id={self.chat_id}, network={self.network}, from_asset={self.from_asset}, to_asset={self.to_asset}, fee_threshold={self.fee_threshold})"
 
     def pretty_string(self):
-        return f"{self.from_asset} -> {self.to_asset} at {self.fee_threshold}%"
+        return f"{self.from_asset} -> {self.to_asset}{on_network(self.network)} at {format_fee(self.fee_threshold)}%"
+
+
+def on_network(network: str | None) -> str:
+    # only other networks are named, so that a single network reads as before
+    return f" on {network}" if network and network != DEFAULT_NETWORK else ""
 
 
 def db_session(context: ContextTypes.DEFAULT_TYPE) -> AsyncSession:
     return context.bot_data["session_maker"]()
 
 
-async def add_subscription(session: AsyncSession, subscription: Subscription) -> bool:
+async def notify_subscription_change(session: AsyncSession, chat_id: int):
+    # delivered on commit to the workers that keep their own subscription store
+    await session.execute(select(func.pg_notify(SUBSCRIPTIONS_CHANNEL, str(chat_id))))
+
+
+async def add_subscription(
+    session: AsyncSession,
+    subscription: Subscription,
+    store: "SubscriptionStore | None" = None,
+) -> bool:
     try:
         session.add(subscription)
+        await notify_subscription_change(session, subscription.chat_id)
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        return False
+    if store is not None:
+        store.add(subscription)
+    return True
+
+
+async def update_subscription(
+    session: AsyncSession,
+    subscription: Subscription,
+    store: "SubscriptionStore | None" = None,
+) -> bool:
+    try:
+        await notify_subscription_change(session, subscription.chat_id)
         await session.commit()
     except IntegrityError:
+        await session.rollback()
         return False
+    if store is not None:
+        store.add(subscription)
     return True
 
 
-async def remove_all_subscriptions(session: AsyncSession, chat_id: int) -> bool:
+async def remove_all_subscriptions(
+    session: AsyncSession,
+    chat_id: int,
+    stores: "Iterable[SubscriptionStore]" = (),
+) -> bool:
     statement = delete(Subscription).where(Subscription.chat_id == chat_id)
     await session.execute(statement)
+    await notify_subscription_change(session, chat_id)
     await session.commit()
+    for store in stores:
+        store.remove_chat(chat_id)
     return True
 
 
-async def remove_subscription(session: AsyncSession, subscription: Subscription):
+async def remove_subscription(
+    session: AsyncSession,
+    subscription: Subscription,
+    store: "SubscriptionStore | None" = None,
+):
     await session.delete(subscription)
+    await notify_subscription_change(session, subscription.chat_id)
     await session.commit()
+    if store is not None:
+        store.remove(subscription.id)
 
 
 async def get_subscription(
@@ -56,34 +138,468 @@ async def get_subscription(
     return await session.get(Subscription, subscription_id)
 
 
+@timed(DB_QUERY_SECONDS, query="get_subscriptions")
 async def get_subscriptions(
-    session: AsyncSession, chat_id: int = None
+    session: AsyncSession, chat_id: int = None, network: str | None = None
 ) -> list[Subscription]:
     query = select(Subscription)
     if chat_id:
         query = query.where(Subscription.chat_id == chat_id)
+    if network is not None:
+        query = query.where(Subscription.network == network)
     return (await session.execute(query)).scalars().all()
 
 
-class Previous(Base):
-    __tablename__ = "previous"
+FeeRange = tuple[str, str, int, int]
+
+# (index, count) of a hash partition of chat ids
+Shard = tuple[int, int]
+
+
+SUBSCRIPTION_COLUMNS = select(
+    Subscription.id,
+    Subscription.chat_id,
+    Subscription.from_asset,
+    Subscription.to_asset,
+    Subscription.fee_threshold,
+)
+
+STREAM_BATCH = 1000
+
+
+def in_shard(chat_id: Column, shard: Shard):
+    index, count = shard
+    # chat ids of groups are negative, so normalize the remainder like python does
+    return (chat_id % count + count) % count == index
+
+
+def in_ranges(ranges: Iterable[FeeRange], network: str = DEFAULT_NETWORK) -> list:
+    # a threshold was crossed iff it lies in [low, high) of the pair's fee change
+    return [
+        and_(
+            Subscription.network == network,
+            Subscription.from_asset == from_asset,
+            Subscription.to_asset == to_asset,
+            Subscription.fee_threshold >= low,
+            Subscription.fee_threshold < high,
+        )
+        for from_asset, to_asset, low, high in ranges
+    ]
+
+
+@timed(DB_QUERY_SECONDS, query="get_subscriptions_in_ranges")
+async def get_subscriptions_in_ranges(
+    session: AsyncSession, ranges: Iterable[FeeRange], network: str = DEFAULT_NETWORK
+) -> list[Subscription]:
+    conditions = in_ranges(ranges, network)
+    if not conditions:
+        return []
+    query = select(Subscription).where(or_(*conditions))
+    return (await session.execute(query)).scalars().all()
+
+
+async def stream_subscriptions_in_ranges(
+    session: AsyncSession, ranges: Iterable[FeeRange], network: str = DEFAULT_NETWORK
+) -> AsyncIterator[Row]:
+    conditions = in_ranges(ranges, network)
+    if not conditions:
+        return
+    # plain rows stay out of the identity map and are fetched from a server-side
+    # cursor in batches; ordered by chat so that a chat's crossings are queued together
+    query = (
+        SUBSCRIPTION_COLUMNS.where(or_(*conditions))
+        .order_by(Subscription.chat_id)
+        .execution_options(yield_per=STREAM_BATCH)
+    )
+    result = await session.stream(query)
+    async for row in result:
+        yield row
+
+
+@timed(DB_QUERY_SECONDS, query="count_subscriptions_in_ranges")
+async def count_subscriptions_in_ranges(
+    session: AsyncSession, ranges: Iterable[FeeRange], network: str = DEFAULT_NETWORK
+) -> int:
+    conditions = in_ranges(ranges, network)
+    if not conditions:
+        return 0
+    query = select(func.count()).select_from(Subscription).where(or_(*conditions))
+    return (await session.execute(query)).scalar_one()
+
+
+@timed(DB_QUERY_SECONDS, query="count_subscriptions_by_pair")
+async def count_subscriptions_by_pair(
+    session: AsyncSession, network: str = DEFAULT_NETWORK
+) -> dict[Pair, int]:
+    query = (
+        select(Subscription.from_asset, Subscription.to_asset, func.count())
+        .where(Subscription.network == network)
+        .group_by(Subscription.from_asset, Subscription.to_asset)
+    )
+    result = await session.execute(query)
+    return {(from_asset, to_asset): count for from_asset, to_asset, count in result}
+
+
+class PreviousFee(Base):
+    __tablename__ = "previous_fees"
     key = Column(Text, primary_key=True)
-    value = Column(JSON)
+    from_asset = Column(Text, primary_key=True)
+    to_asset = Column(Text, primary_key=True)
+    fee = Column(BigInteger, nullable=False)
+
 
+# arbitrary, held while the previous fees are compared with new ones and replaced
+PREVIOUS_LOCK = 0x70726576
 
-async def upsert_previous(session: AsyncSession, key: str, value: Fees) -> None:
-    previous = await session.get(Previous, key)
-    if previous:
-        previous.value = value
-    else:
-        previous = Previous(key=key, value=value)
-        session.add(previous)
 
+async def lock_previous(session: AsyncSession, key: str = ALL_FEES):
+    # released with the transaction, so that two checks never read the same
+    # previous fees and queue the same crossings twice; per key, so that the
+    # checks of different networks do not wait for each other
+    await session.execute(
+        select(func.pg_advisory_xact_lock(PREVIOUS_LOCK, func.hashtext(key)))
+    )
+
+
+@timed(DB_QUERY_SECONDS, query="upsert_previous")
+async def upsert_previous(
+    session: AsyncSession, key: str, value: Fees, pairs: Iterable[Pair] | None = None
+) -> None:
+    # only the given pairs are written, all of them if there are none; pairs missing
+    # from the fees keep their row, a failed fetch must not forget them
+    if pairs is None:
+        pairs = [
+            (from_asset, to_asset)
+            for from_asset, fees in value.items()
+            for to_asset in fees
+        ]
+    rows = [
+        {"key": key, "from_asset": from_asset, "to_asset": to_asset, "fee": fee}
+        for from_asset, to_asset in pairs
+        if (fee := value.get(from_asset, {}).get(to_asset)) is not None
+    ]
+
+    if rows:
+        statement = pg_insert(PreviousFee).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=["key", "from_asset", "to_asset"],
+            set_={"fee": statement.excluded.fee},
+        )
+        await session.execute(statement)
     await session.commit()
 
 
+@timed(DB_QUERY_SECONDS, query="get_previous")
 async def get_previous(session: AsyncSession, key: str) -> Fees | None:
-    result = await session.get(Previous, key)
-    if not result:
-        return None
-    return result.value  # type: ignore
+    result = await session.execute(
+        select(PreviousFee.from_asset, PreviousFee.to_asset, PreviousFee.fee).where(
+            PreviousFee.key == key
+        )
+    )
+    fees: Fees = {}
+    for from_asset, to_asset, fee in result:
+        fees.setdefault(from_asset, {})[to_asset] = fee
+    return fees or None
+
+
+class FeeHistory(Base):
+    __tablename__ = "fee_history"
+    # the primary key doubles as the index for time ranges of a pair
+    network = Column(Text, primary_key=True, server_default=DEFAULT_NETWORK)
+    from_asset = Column(Text, primary_key=True)
+    to_asset = Column(Text, primary_key=True)
+    time = Column(DateTime(timezone=True), primary_key=True)
+    fee = Column(BigInteger, nullable=False)
+
+
+class FeeHistoryHourly(Base):
+    __tablename__ = "fee_history_hourly"
+    network = Column(Text, primary_key=True, server_default=DEFAULT_NETWORK)
+    from_asset = Column(Text, primary_key=True)
+    to_asset = Column(Text, primary_key=True)
+    hour = Column(DateTime(timezone=True), primary_key=True)
+    min_fee = Column(BigInteger, nullable=False)
+    max_fee = Column(BigInteger, nullable=False)
+    avg_fee = Column(Double, nullable=False)
+    samples = Column(Integer, nullable=False)
+
+
+FeeSample = tuple[datetime, str, str, int]
+
+
+@timed(DB_QUERY_SECONDS, query="add_fee_history")
+async def add_fee_history(
+    session: AsyncSession,
+    samples: Iterable[FeeSample],
+    network: str = DEFAULT_NETWORK,
+):
+    rows = [
+        {
+            "network": network,
+            "time": time,
+            "from_asset": from_asset,
+            "to_asset": to_asset,
+            "fee": fee,
+        }
+        for time, from_asset, to_asset, fee in samples
+    ]
+    if not rows:
+        return
+    await session.execute(insert(FeeHistory), rows)
+    await session.commit()
+
+
+@timed(DB_QUERY_SECONDS, query="rollup_fee_history")
+async def rollup_fee_history(session: AsyncSession, before: datetime) -> int:
+    hour = func.date_trunc("hour", FeeHistory.time)
+    hourly = select(
+        FeeHistory.network,
+        FeeHistory.from_asset,
+        FeeHistory.to_asset,
+        hour,
+        func.min(FeeHistory.fee),
+        func.max(FeeHistory.fee),
+        func.avg(FeeHistory.fee),
+        func.count(),
+    ).where(FeeHistory.time < before)
+    hourly = hourly.group_by(
+        FeeHistory.network, FeeHistory.from_asset, FeeHistory.to_asset, hour
+    )
+
+    statement = pg_insert(FeeHistoryHourly).from_select(
+        [
+            "network",
+            "from_asset",
+            "to_asset",
+            "hour",
+            "min_fee",
+            "max_fee",
+            "avg_fee",
+            "samples",
+        ],
+        hourly,
+    )
+    # an hour that was split by the cutoff of an earlier run is merged
+    new = statement.excluded
+    samples = FeeHistoryHourly.samples + new.samples
+    statement = statement.on_conflict_do_update(
+        index_elements=["network", "from_asset", "to_asset", "hour"],
+        set_={
+            "min_fee": func.least(FeeHistoryHourly.min_fee, new.min_fee),
+            "max_fee": func.greatest(FeeHistoryHourly.max_fee, new.max_fee),
+            "avg_fee": (
+                FeeHistoryHourly.avg_fee * FeeHistoryHourly.samples
+                + new.avg_fee * new.samples
+            )
+            / samples,
+            "samples": samples,
+        },
+    )
+    await session.execute(statement)
+    result = await session.execute(delete(FeeHistory).where(FeeHistory.time < before))
+    await session.commit()
+    return result.rowcount
+
+
+class Outbox(Base):
+    __tablename__ = "outbox"
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    subscription_id = Column(BigInteger, nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    network = Column(Text, nullable=False, server_default=DEFAULT_NETWORK)
+    from_asset = Column(Text, nullable=False)
+    to_asset = Column(Text, nullable=False)
+    fee_threshold = Column(BigInteger, nullable=False)
+    fee = Column(BigInteger, nullable=False)
+    created_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+    attempts = Column(Integer, nullable=False, server_default="0")
+    next_attempt_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+    # set while a delivery loop is sending the entry
+    claimed_at = Column(DateTime(timezone=True))
+
+    __table_args__ = (
+        Index("ix_outbox_next_attempt_at", next_attempt_at),
+        Index("ix_outbox_subscription_id", subscription_id),
+    )
+
+
+async def cancel_outbox(
+    session: AsyncSession, subscription_ids, fees: Fees
+) -> set[int]:
+    # returns the subscriptions that get no new entry: a pending notification and a
+    # newer crossing of the same subscription cancel out, the fee went back to the
+    # side the chat was last told about. A pending crossing to the same side was
+    # detected again, after a crash before the fees it was found with were stored
+    result = await session.execute(
+        select(
+            Outbox.id,
+            Outbox.subscription_id,
+            Outbox.from_asset,
+            Outbox.to_asset,
+            Outbox.fee,
+            Outbox.fee_threshold,
+        ).where(
+            Outbox.subscription_id.in_(subscription_ids), Outbox.claimed_at.is_(None)
+        )
+    )
+    pending = result.all()
+    crossed_back = [
+        entry.id
+        for entry in pending
+        if (fees[entry.from_asset][entry.to_asset] <= entry.fee_threshold)
+        != (entry.fee <= entry.fee_threshold)
+    ]
+    if crossed_back:
+        await session.execute(delete(Outbox).where(Outbox.id.in_(crossed_back)))
+    OUTBOX_SUPERSEDED.inc(len(crossed_back))
+    return {entry.subscription_id for entry in pending}
+
+
+# does not commit, so that the caller decides which transaction the crossings are
+# stored in; returns the number of crossings, including those that cancelled or
+# repeated a pending notification
+@timed(DB_QUERY_SECONDS, query="add_outbox")
+async def add_outbox(
+    session: AsyncSession,
+    subscriptions: Iterable[Subscription],
+    fees: Fees,
+    network: str = DEFAULT_NETWORK,
+) -> int:
+    subscriptions = list(subscriptions)
+    if not subscriptions:
+        return 0
+    cancelled = await cancel_outbox(
+        session, [subscription.id for subscription in subscriptions], fees
+    )
+    rows = [
+        {
+            "subscription_id": subscription.id,
+            "chat_id": subscription.chat_id,
+            "network": network,
+            "from_asset": subscription.from_asset,
+            "to_asset": subscription.to_asset,
+            "fee_threshold": subscription.fee_threshold,
+            "fee": fees[subscription.from_asset][subscription.to_asset],
+        }
+        for subscription in subscriptions
+        if subscription.id not in cancelled
+    ]
+    if rows:
+        await session.execute(insert(Outbox), rows)
+    return len(subscriptions)
+
+
+@timed(DB_QUERY_SECONDS, query="claim_outbox")
+async def claim_outbox(
+    session: AsyncSession, limit: int, lease: float, shard: Shard | None = None
+) -> list[Outbox]:
+    due = select(Outbox.id).where(Outbox.next_attempt_at <= func.now())
+    if shard is not None:
+        due = due.where(in_shard(Outbox.chat_id, shard))
+    due = due.order_by(Outbox.id).limit(limit).with_for_update(skip_locked=True)
+    # entries of a process that dies while sending are due again once the lease ends
+    statement = (
+        update(Outbox)
+        .where(Outbox.id.in_(due.scalar_subquery()))
+        .values(
+            next_attempt_at=func.now() + timedelta(seconds=lease),
+            claimed_at=func.now(),
+        )
+        .returning(Outbox)
+        .execution_options(synchronize_session=False)
+    )
+    entries = (await session.execute(statement)).scalars().all()
+    await session.commit()
+    return sorted(entries, key=lambda entry: entry.id)
+
+
+@timed(DB_QUERY_SECONDS, query="complete_outbox")
+async def complete_outbox(session: AsyncSession, ids: Iterable[int]):
+    ids = list(ids)
+    if not ids:
+        return
+    await session.execute(delete(Outbox).where(Outbox.id.in_(ids)))
+    await session.commit()
+
+
+@timed(DB_QUERY_SECONDS, query="retry_outbox")
+async def retry_outbox(
+    session: AsyncSession,
+    ids: Iterable[int],
+    backoff: float,
+    max_backoff: float,
+    max_attempts: int,
+) -> int:
+    ids = list(ids)
+    if not ids:
+        return 0
+    delay = func.least(backoff * func.power(2, Outbox.attempts), max_backoff)
+    await session.execute(
+        update(Outbox)
+        .where(Outbox.id.in_(ids))
+        .values(
+            claimed_at=None,
+            attempts=Outbox.attempts + 1,
+            next_attempt_at=func.now() + func.make_interval(0, 0, 0, 0, 0, 0, delay),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    result = await session.execute(
+        delete(Outbox).where(Outbox.id.in_(ids), Outbox.attempts >= max_attempts)
+    )
+    await session.commit()
+    return result.rowcount
+
+
+@timed(DB_QUERY_SECONDS, query="release_outbox")
+async def release_outbox(session: AsyncSession, ids: Iterable[int], delay: float):
+    ids = list(ids)
+    if not ids:
+        return
+    # the evaluation cancelled nothing while these were claimed and queued the
+    # crossing back instead, the two cancel out here
+    newer = aliased(Outbox)
+    pairs = (
+        await session.execute(
+            select(Outbox.id, newer.id)
+            .join(
+                newer,
+                and_(
+                    newer.subscription_id == Outbox.subscription_id,
+                    newer.id > Outbox.id,
+                    newer.claimed_at.is_(None),
+                ),
+            )
+            .where(Outbox.id.in_(ids))
+        )
+    ).all()
+    cancelled = {id for pair in pairs for id in pair}
+    if cancelled:
+        await session.execute(delete(Outbox).where(Outbox.id.in_(cancelled)))
+    await session.execute(
+        update(Outbox)
+        .where(Outbox.id.in_(ids), Outbox.id.not_in(cancelled))
+        .values(
+            claimed_at=None,
+            next_attempt_at=func.now() + timedelta(seconds=delay),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    await session.commit()
+    OUTBOX_SUPERSEDED.inc(len(pairs))
+
+
+@timed(DB_QUERY_SECONDS, query="outbox_backlog")
+async def outbox_backlog(
+    session: AsyncSession, shard: Shard | None = None
+) -> tuple[int, float]:
+    age = func.extract("epoch", func.now() - func.min(Outbox.created_at))
+    query = select(func.count(), func.coalesce(age, 0))
+    if shard is not None:
+        query = query.where(in_shard(Outbox.chat_id, shard))
+    count, age = (await session.execute(query)).one()
+    return count, float(age)
@@ -0,0 +1,100 @@
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+
+from telegram.constants import MessageLimit
+
+from consts import DEFAULT_NETWORK, Fees
+from db import Outbox, Subscription, on_network
+from fixed import format_fee
+from utils import encode_url_params, get_fee
+
+SEPARATOR = "\n\n"
+
+
+@dataclass
+class Digest:
+    chat_id: int
+    lines: list[str] = field(default_factory=list)
+    length: int = 0
+    # the outbox entries the lines were built from
+    ids: list[int] = field(default_factory=list)
+
+    def added_length(self, line: str) -> int:
+        return len(SEPARATOR) + len(line) if self.lines else len(line)
+
+    def fits(self, line: str) -> bool:
+        return self.length + self.added_length(line) <= MessageLimit.MAX_TEXT_LENGTH
+
+    def add(self, line: str, id: int | None = None):
+        self.length += self.added_length(line)
+        self.lines.append(line)
+        if id is not None:
+            self.ids.append(id)
+
+    @property
+    def text(self) -> str:
+        return SEPARATOR.join(self.lines)
+
+
+def notification_text(
+    subscription: Subscription | Outbox, fee: int, network: str | None
+) -> str:
+    from_asset = subscription.from_asset
+    to_asset = subscription.to_asset
+
+    url = encode_url_params(from_asset, to_asset)
+    threshold = format_fee(subscription.fee_threshold)
+    threshold_msg = (
+        f"have reached {threshold}%"
+        if fee <= subscription.fee_threshold
+        else f"are above {threshold}% again"
+    )
+    return (
+        f"Fees for {from_asset} -> {to_asset}{on_network(network)} "
+        f"{threshold_msg} "
+        f"(now {format_fee(fee)}%): {url}"
+    )
+
+
+def add_line(
+    digests: list[Digest],
+    subscription: Subscription | Outbox,
+    fee: int,
+    network: str | None,
+    id: int | None = None,
+):
+    line = notification_text(subscription, fee, network)
+    # one message per chat, only split when it would exceed what Telegram accepts
+    if not digests or not digests[-1].fits(line):
+        digests.append(Digest(subscription.chat_id))
+    digests[-1].add(line, id)
+
+
+def build_digests(
+    subscriptions: Iterable[Subscription],
+    fees: Fees,
+    network: str = DEFAULT_NETWORK,
+) -> list[Digest]:
+    # the subscriptions are those of one network, like the ones of a store
+    chats: dict[int, list[Digest]] = {}
+    for subscription in subscriptions:
+        add_line(
+            chats.setdefault(subscription.chat_id, []),
+            subscription,
+            get_fee(fees, subscription),
+            network,
+        )
+    return [digest for digests in chats.values() for digest in digests]
+
+
+def outbox_digests(entries: Iterable[Outbox]) -> list[Digest]:
+    chats: dict[int, list[Digest]] = {}
+    for entry in entries:
+        add_line(
+            chats.setdefault(entry.chat_id, []),
+            entry,
+            entry.fee,
+            entry.network,
+            entry.id,
+        )
+    return [digest for digests in chats.values() for digest in digests]
@@ -0,0 +1,186 @@
+import asyncio
+import heapq
+import logging
+import time
+import warnings
+from collections import defaultdict, deque
+from collections.abc import AsyncIterable, Awaitable, Callable, Iterable
+from datetime import timedelta
+from typing import Protocol, TypeVar
+
+from telegram.error import RetryAfter
+from telegram.warnings import PTBDeprecationWarning
+
+from metrics import NOTIFICATIONS, QUEUE_DEPTH, SEND_SECONDS
+
+# https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+GLOBAL_RATE = 30
+CHAT_INTERVAL = 1.0
+WORKERS = 32
+
+
+class Notification(Protocol):
+    chat_id: int
+
+
+T = TypeVar("T", bound=Notification)
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    # newer versions return a timedelta and warn when the int fallback is used
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", PTBDeprecationWarning)
+        retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class NotificationDispatcher:
+    def __init__(
+        self,
+        rate: float = GLOBAL_RATE,
+        chat_interval: float = CHAT_INTERVAL,
+        workers: int = WORKERS,
+    ):
+        self.bucket = TokenBucket(rate)
+        self.chat_interval = chat_interval
+        self.workers = workers
+        self.queue_depth = 0
+        self.sent = 0
+        self.failed = 0
+        # kept across dispatches, so that a chat that receives notifications again
+        # still waits for its interval
+        self._last_sent: dict[int, float] = {}
+
+    async def dispatch(
+        self,
+        notifications: Iterable[T] | AsyncIterable[T],
+        send: Callable[[T], Awaitable[bool]],
+    ):
+        pending: dict[int, deque[T]] = defaultdict(deque)
+        # one entry per chat, so that a chat is never served by two workers at once
+        ready: list[tuple[float, int]] = []
+        arrived = asyncio.Event()
+        received = False
+        sent, failed = self.sent, self.failed
+        start = time.monotonic()
+
+        def add(notification: T):
+            chat_id = notification.chat_id
+            queue = pending[chat_id]
+            queue.append(notification)
+            if len(queue) == 1:
+                last = self._last_sent.get(chat_id)
+                ready_at = 0.0 if last is None else last + self.chat_interval
+                heapq.heappush(ready, (max(time.monotonic(), ready_at), chat_id))
+                arrived.set()
+            self.queue_depth += 1
+            QUEUE_DEPTH.set(self.queue_depth)
+
+        async def receive():
+            # notifications can be sent while a streaming source still produces
+            nonlocal received
+            try:
+                if isinstance(notifications, AsyncIterable):
+                    async for notification in notifications:
+                        add(notification)
+                else:
+                    for notification in notifications:
+                        add(notification)
+            finally:
+                received = True
+                arrived.set()
+
+        async def worker():
+            while True:
+                if not ready:
+                    if received:
+                        return
+                    arrived.clear()
+                    await arrived.wait()
+                    continue
+                ready_at, chat_id = heapq.heappop(ready)
+                delay = ready_at - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                queue = pending[chat_id]
+                await self.bucket.acquire()
+                try:
+                    with SEND_SECONDS.time():
+                        success = await send(queue[0])
+                except RetryAfter as e:
+                    NOTIFICATIONS.inc(result="rate_limited")
+                    seconds = retry_after_seconds(e)
+                    logging.warning(f"Rate limited, retrying in {seconds}s")
+                    self.bucket.pause(seconds)
+                    heapq.heappush(ready, (time.monotonic() + seconds, chat_id))
+                    continue
+
+                self._last_sent[chat_id] = time.monotonic()
+                queue.popleft()
+                self.queue_depth -= 1
+                QUEUE_DEPTH.set(self.queue_depth)
+                if success:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+                NOTIFICATIONS.inc(result="sent" if success else "failed")
+                if queue:
+                    heapq.heappush(
+                        ready, (time.monotonic() + self.chat_interval, chat_id)
+                    )
+                else:
+                    del pending[chat_id]
+
+        # what was received before a failing source is still delivered
+        results = await asyncio.gather(
+            receive(), *(worker() for _ in range(self.workers)), return_exceptions=True
+        )
+        now = time.monotonic()
+        self._last_sent = {
+            chat_id: last
+            for chat_id, last in self._last_sent.items()
+            if last + self.chat_interval > now
+        }
+        if isinstance(results[0], BaseException):
+            raise results[0]
+        if self.sent == sent and self.failed == failed:
+            return
+
+        elapsed = max(time.monotonic() - start, 1e-6)
+        sent, failed = self.sent - sent, self.failed - failed
+        logging.info(
+            f"Sent {sent} notifications in {elapsed:.2f}s "
+            f"({sent / elapsed:.1f}/s), {failed} failed"
+        )
@@ -0,0 +1,35 @@
+from decimal import Decimal, InvalidOperation
+
+from consts import FEE_SCALE
+
+DECIMALS = len(str(FEE_SCALE)) - 1
+# float arithmetic leaves digits like those of 0.30000000000000004 far below a unit
+FLOAT_NOISE = Decimal("1e-6")
+
+
+def to_units(percentage: float | str | Decimal) -> int:
+    # through the shortest repr, so that 0.1 from JSON is exactly 1000 units
+    units = Decimal(str(percentage)).scaleb(DECIMALS)
+    rounded = units.to_integral_value()
+    # a rounded fee would compare as equal to thresholds it is above or below
+    if abs(units - rounded) > FLOAT_NOISE:
+        raise ValueError(f"{percentage} has more than {DECIMALS} decimals")
+    return int(rounded)
+
+
+def parse_threshold(text: str) -> int:
+    try:
+        value = Decimal(text.strip().rstrip("%"))
+    except InvalidOperation:
+        raise ValueError(f"{text} is not a number") from None
+    if not value.is_finite():
+        raise ValueError(f"{text} is not a number")
+    units = value.scaleb(DECIMALS)
+    # rounding would move the threshold away from what the user asked for
+    if units != units.to_integral_value():
+        raise ValueError(f"{text} has more than {DECIMALS} decimals")
+    return int(units)
+
+
+def format_fee(units: int) -> str:
+    return f"{Decimal(units).scaleb(-DECIMALS).normalize():f}"
@@ -0,0 +1,60 @@
+import asyncio
+import logging
+from datetime import UTC, datetime, timedelta
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from consts import DEFAULT_NETWORK, Fees
+from db import FeeSample, add_fee_history, rollup_fee_history
+from utils import changed_pairs, iter_pairs
+
+ROLLUP_INTERVAL = 3600
+
+
+class HistoryWriter:
+    def __init__(
+        self, session_maker: async_sessionmaker, network: str = DEFAULT_NETWORK
+    ):
+        self.session_maker = session_maker
+        self.network = network
+        self.last: Fees | None = None
+        self._pending: list[FeeSample] = []
+        self._task: asyncio.Task | None = None
+
+    def record(self, fees: Fees, time: datetime | None = None):
+        time = time or datetime.now(UTC)
+        pairs = dict(iter_pairs(fees))
+        changed = pairs.keys() if self.last is None else changed_pairs(fees, self.last)
+        self.last = fees
+        self._pending.extend(
+            (time, from_asset, to_asset, pairs[(from_asset, to_asset)])
+            for from_asset, to_asset in changed
+            if (from_asset, to_asset) in pairs
+        )
+        # the monitor never waits for history, samples of ticks that arrive
+        # while a write is in flight go out together with the next one
+        if self._pending and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._write())
+
+    async def _write(self):
+        while self._pending:
+            samples, self._pending = self._pending, []
+            try:
+                async with self.session_maker() as session:
+                    await add_fee_history(session, samples, self.network)
+            except Exception as e:
+                logging.error(f"Could not write {len(samples)} fee samples: {e!r}")
+
+    async def flush(self):
+        if self._task is not None:
+            await self._task
+
+
+async def rollup_history(session_maker: async_sessionmaker, retention: int):
+    # only whole hours are rolled up
+    before = datetime.now(UTC).replace(minute=0, second=0, microsecond=0)
+    before -= timedelta(hours=retention)
+    async with session_maker() as session:
+        removed = await rollup_fee_history(session, before)
+    if removed:
+        logging.info(f"Rolled up {removed} fee samples older than {before}")
@@ -0,0 +1,121 @@
+import logging
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import wraps
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from telegram.ext import BaseHandler, CommandHandler, ConversationHandler
+from telegram.request import BaseRequest, RequestData
+
+from metrics import HANDLER_API_SECONDS, HANDLER_DB_SECONDS, HANDLER_SECONDS
+
+
+@dataclass
+class HandlerTiming:
+    handler: str
+    state: str
+    db: float = 0.0
+    queries: int = 0
+    api: float = 0.0
+    api_calls: int = 0
+
+
+_timing: ContextVar[HandlerTiming | None] = ContextVar("handler_timing", default=None)
+
+
+def handler_name(handler: BaseHandler) -> str:
+    if isinstance(handler, ConversationHandler):
+        return handler_name(handler.entry_points[0])
+    if isinstance(handler, CommandHandler):
+        return min(handler.commands)
+    return getattr(handler.callback, "__name__", type(handler).__name__)
+
+
+def instrument(handler: BaseHandler, slow_threshold: float, name: str | None = None):
+    # wraps the callbacks in place, a conversation is labelled with its entry command
+    name = name or handler_name(handler)
+    if isinstance(handler, ConversationHandler):
+        handlers = [
+            *handler.entry_points,
+            *(h for state in handler.states.values() for h in state),
+            *handler.fallbacks,
+        ]
+        # the entry point usually doubles as fallback
+        for child in {id(h): h for h in handlers}.values():
+            instrument(child, slow_threshold, name)
+        return
+
+    callback = handler.callback
+    state = callback.__name__
+
+    @wraps(callback)
+    async def timed_callback(update, context):
+        timing = HandlerTiming(name, state)
+        token = _timing.set(timing)
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            _timing.reset(token)
+            record(timing, time.perf_counter() - start, slow_threshold)
+
+    handler.callback = timed_callback
+
+
+def record(timing: HandlerTiming, total: float, slow_threshold: float):
+    labels = {"handler": timing.handler, "state": timing.state}
+    HANDLER_SECONDS.observe(total, **labels)
+    HANDLER_DB_SECONDS.observe(timing.db, **labels)
+    HANDLER_API_SECONDS.observe(timing.api, **labels)
+    if total >= slow_threshold:
+        other = max(total - timing.db - timing.api, 0)
+        logging.warning(
+            f"Slow update in {timing.handler}/{timing.state}: {total:.3f}s, "
+            f"db {timing.db:.3f}s in {timing.queries} queries, "
+            f"Telegram {timing.api:.3f}s in {timing.api_calls} calls, "
+            f"other {other:.3f}s"
+        )
+
+
+def instrument_engine(engine: AsyncEngine):
+    # the greenlet running the statement shares the context of the handler
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before(conn, *_):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after(conn, *_):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        timing = _timing.get()
+        if timing is not None:
+            timing.db += elapsed
+            timing.queries += 1
+
+
+class InstrumentedRequest(BaseRequest):
+    def __init__(self, request: BaseRequest):
+        self.request = request
+
+    @property
+    def read_timeout(self) -> float | None:
+        return self.request.read_timeout
+
+    async def initialize(self):
+        await self.request.initialize()
+
+    async def shutdown(self):
+        await self.request.shutdown()
+
+    async def do_request(
+        self, url: str, method: str, request_data: RequestData | None = None, **kwargs
+    ) -> tuple[int, bytes]:
+        start = time.perf_counter()
+        try:
+            return await self.request.do_request(url, method, request_data, **kwargs)
+        finally:
+            timing = _timing.get()
+            if timing is not None:
+                timing.api += time.perf_counter() - start
+                timing.api_calls += 1
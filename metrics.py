@@ -0,0 +1,272 @@
+import abc
+import asyncio
+import logging
+import math
+import time
+from bisect import bisect_left
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from functools import wraps
+
+# a minimal implementation of the Prometheus text format, so that the
+# hot path is a dict update and no extra dependency or thread is needed
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+LabelValues = tuple[str, ...]
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: tuple[str, ...], values: LabelValues, **extra: str) -> str:
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(str(v))}"' for name, v in pairs) + "}"
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric(abc.ABC):
+    type = ""
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        REGISTRY.append(self)
+
+    def key(self, labels: dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labels)
+
+    @abc.abstractmethod
+    def samples(self) -> Iterator[str]: ...
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.type}",
+            *self.samples(),
+        ]
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, description, labels)
+        self.values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        return self.values.get(self.key(labels), 0)
+
+    def samples(self) -> Iterator[str]:
+        for key, value in self.values.items():
+            yield f"{self.name}{format_labels(self.labels, key)} {format_value(value)}"
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, **labels: str):
+        self.values[self.key(labels)] = value
+
+    def clear(self, **labels: str):
+        # only the label sets that match the given labels, all without any
+        self.values = {
+            key: value
+            for key, value in self.values.items()
+            if any(key[self.labels.index(name)] != str(v) for name, v in labels.items())
+        }
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+        # per label set: non-cumulative bucket counts, sum
+        self.values: dict[LabelValues, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self.key(labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = ([0] * len(self.buckets), [0.0])
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1][0] += value
+
+    def count(self, **labels: str) -> int:
+        entry = self.values.get(self.key(labels))
+        return sum(entry[0]) if entry else 0
+
+    @contextmanager
+    def time(self, **labels: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[str]:
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = format_labels(self.labels, key, le=format_value(bound))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = format_labels(self.labels, key)
+            yield f"{self.name}_sum{labels} {format_value(total[0])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+REGISTRY: list[Metric] = []
+
+
+def timed(histogram: Histogram, **labels: str) -> Callable:
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+async def handle_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request = await reader.readline()
+        while (await reader.readline()).strip():
+            pass
+        parts = request.split()
+        if len(parts) >= 2 and parts[0] == b"GET" and parts[1] == b"/metrics":
+            status, body = "200 OK", render().encode()
+        else:
+            status, body = "404 Not Found", b"Not Found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+    except ConnectionError as e:
+        logging.debug(f"Metrics request failed: {e}")
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str, port: int) -> asyncio.Server:
+    server = await asyncio.start_server(handle_request, host, port)
+    logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+
+API_REQUEST_SECONDS = Histogram(
+    "boltz_api_request_seconds", "Latency of fee requests", ("swap_type",)
+)
+API_ERRORS = Counter("boltz_api_errors_total", "Failed fee requests", ("swap_type",))
+DB_QUERY_SECONDS = Histogram("db_query_seconds", "Time spent in queries", ("query",))
+EVALUATION_SECONDS = Histogram(
+    "evaluation_seconds", "Time spent finding crossed subscriptions"
+)
+CROSSINGS = Counter("crossings_total", "Subscriptions whose threshold was crossed")
+SEND_SECONDS = Histogram("notification_send_seconds", "Latency of sending alerts")
+NOTIFICATIONS = Counter(
+    "notifications_total", "Alerts by outcome of the send", ("result",)
+)
+QUEUE_DEPTH = Gauge("notification_queue_depth", "Alerts waiting to be sent")
+TICK_SECONDS = Histogram("monitor_tick_seconds", "Duration of monitor ticks")
+TICK_OVERRUNS = Counter(
+    "monitor_tick_overruns_total", "Monitor ticks that took longer than the interval"
+)
+TICK_COALESCED = Counter(
+    "monitor_tick_coalesced_total",
+    "Monitor ticks requested while one was running, folded into one rerun",
+)
+TICK_TIMEOUTS = Counter(
+    "monitor_tick_timeouts_total", "Monitor ticks cancelled at their deadline"
+)
+SUBSCRIPTIONS = Gauge(
+    "subscriptions", "Subscriptions per pair", ("network", "from_asset", "to_asset")
+)
+OUTBOX_ENTRIES = Gauge("outbox_entries", "Alerts waiting in the outbox")
+OUTBOX_AGE = Gauge(
+    "outbox_oldest_age_seconds", "Age of the oldest alert waiting in the outbox"
+)
+OUTBOX_DELIVERED = Counter("outbox_delivered_total", "Alerts delivered from the outbox")
+OUTBOX_RETRIES = Counter("outbox_retries_total", "Alerts rescheduled after a failure")
+OUTBOX_DROPPED = Counter(
+    "outbox_dropped_total", "Alerts given up on after the last attempt"
+)
+OUTBOX_SUPERSEDED = Counter(
+    "outbox_superseded_total",
+    "Alerts dropped before delivery since the fee crossed back",
+)
+OUTBOX_LATENCY = Histogram(
+    "outbox_delivery_latency_seconds",
+    "Time from the crossing to the delivery of an alert",
+    buckets=(1, 5, 10, 30, 60, 300, 900, 3600),
+)
+MONITOR_INTERVAL = Gauge(
+    "monitor_interval_seconds", "Current interval between two fee checks", ("network",)
+)
+API_RETRIES = Counter(
+    "boltz_api_retries_total", "Fee requests that were retried", ("swap_type",)
+)
+API_CIRCUIT_OPEN = Gauge(
+    "boltz_api_circuit_open",
+    "Whether fee requests are suspended after repeated failures",
+    ("network", "swap_type"),
+)
+API_STALE = Counter(
+    "boltz_api_stale_total",
+    "Failed fee requests answered with the last fetched fees",
+    ("swap_type",),
+)
+HANDLER_SECONDS = Histogram(
+    "handler_seconds", "Wall time of command handlers", ("handler", "state")
+)
+HANDLER_DB_SECONDS = Histogram(
+    "handler_db_seconds", "Time command handlers spent in queries", ("handler", "state")
+)
+HANDLER_API_SECONDS = Histogram(
+    "handler_api_seconds",
+    "Time command handlers spent in Telegram API calls",
+    ("handler", "state"),
+)
+PIPELINE_STAGE_SECONDS = Histogram(
+    "pipeline_stage_seconds", "Duration of the monitor pipeline stages", ("stage",)
+)
+PIPELINE_QUEUE_SECONDS = Histogram(
+    "pipeline_queue_seconds", "Time fetched fees waited for their evaluation"
+)
+SNAPSHOTS_SUPERSEDED = Counter(
+    "snapshots_superseded_total",
+    "Fetched fees replaced by newer ones before they were evaluated",
+)
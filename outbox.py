@@ -0,0 +1,163 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable, Mapping
+from datetime import datetime, timezone
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from db import (
+    Outbox,
+    Shard,
+    claim_outbox,
+    complete_outbox,
+    outbox_backlog,
+    release_outbox,
+    retry_outbox,
+)
+from digest import Digest, outbox_digests
+from dispatcher import NotificationDispatcher
+from metrics import (
+    OUTBOX_AGE,
+    OUTBOX_DELIVERED,
+    OUTBOX_DROPPED,
+    OUTBOX_ENTRIES,
+    OUTBOX_LATENCY,
+    OUTBOX_RETRIES,
+    PIPELINE_STAGE_SECONDS,
+)
+from utils import get_fee
+
+BATCH = 500
+# has to outlast sending a batch, which takes about 17s at the global rate limit
+LEASE = 300
+BACKOFF = 5
+MAX_BACKOFF = 3600
+# about two days with the backoff above
+MAX_ATTEMPTS = 50
+# picks up entries whose backoff ended without a new crossing waking the loop
+POLL_INTERVAL = 5
+
+
+class Undeliverable(Exception):
+    # raised by send for failures that retrying does not fix
+    pass
+
+
+class OutboxDelivery:
+    def __init__(
+        self,
+        session_maker: async_sessionmaker,
+        dispatcher: NotificationDispatcher,
+        send: Callable[[Digest], Awaitable[bool]],
+        shard: Shard | None = None,
+        batch: int = BATCH,
+        lease: float = LEASE,
+        backoff: float = BACKOFF,
+        max_backoff: float = MAX_BACKOFF,
+        max_attempts: int = MAX_ATTEMPTS,
+        poll_interval: float = POLL_INTERVAL,
+        current_fees: Callable[[str], Mapping | None] | None = None,
+    ):
+        self.session_maker = session_maker
+        self.dispatcher = dispatcher
+        self.send = send
+        self.shard = shard
+        self.batch = batch
+        self.lease = lease
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.current_fees = current_fees
+        self._woken = asyncio.Event()
+
+    def wake(self):
+        self._woken.set()
+
+    async def run(self):
+        while True:
+            # cleared first, so that a wake up during a delivery is not lost
+            self._woken.clear()
+            try:
+                claimed = await self.deliver()
+            except Exception as e:
+                logging.error(f"Could not deliver notifications: {e!r}")
+                claimed = 0
+            if claimed < self.batch:
+                try:
+                    await asyncio.wait_for(self._woken.wait(), self.poll_interval)
+                except TimeoutError:
+                    pass
+
+    async def deliver(self) -> int:
+        async with self.session_maker() as session:
+            entries = await claim_outbox(session, self.batch, self.lease, self.shard)
+        if entries:
+            await self._send(entries)
+        await self.update_backlog()
+        return len(entries)
+
+    async def update_backlog(self):
+        async with self.session_maker() as session:
+            count, age = await outbox_backlog(session, self.shard)
+        OUTBOX_ENTRIES.set(count)
+        OUTBOX_AGE.set(age)
+
+    def _fresh(self, entries: list[Outbox]) -> tuple[list[Outbox], list[int]]:
+        # the fees may have moved since the crossing was queued, a notification is
+        # only sent when the fee is still on the side of the threshold it reported.
+        # Otherwise it is held back rather than dropped: the fees it is checked
+        # against may not have been evaluated yet, and only the evaluation, which
+        # cancels it, keeps the crossing back from being sent on its own
+        if self.current_fees is None:
+            return entries, []
+        fresh, held = [], []
+        for entry in entries:
+            fees = self.current_fees(entry.network)
+            fee = get_fee(fees, entry) if fees else None
+            if fee is None:
+                fresh.append(entry)
+            elif (fee <= entry.fee_threshold) != (entry.fee <= entry.fee_threshold):
+                held.append(entry.id)
+            else:
+                entry.fee = fee
+                fresh.append(entry)
+        return fresh, held
+
+    async def _send(self, entries: list[Outbox]):
+        delivered: list[int] = []
+        failed: list[int] = []
+        undeliverable: list[int] = []
+        fresh, held = self._fresh(entries)
+
+        async def send(digest: Digest) -> bool:
+            try:
+                success = await self.send(digest)
+            except Undeliverable as e:
+                logging.warning(f"Dropping {len(digest.ids)} notifications: {e}")
+                undeliverable.extend(digest.ids)
+                return False
+            (delivered if success else failed).extend(digest.ids)
+            return success
+
+        with PIPELINE_STAGE_SECONDS.time(stage="deliver"):
+            await self.dispatcher.dispatch(outbox_digests(fresh), send)
+        # an entry is only removed once it was sent, so it is delivered at least once
+        async with self.session_maker() as session:
+            await complete_outbox(session, delivered + undeliverable)
+            await release_outbox(session, held, self.backoff)
+            dropped = await retry_outbox(
+                session, failed, self.backoff, self.max_backoff, self.max_attempts
+            )
+
+        now = datetime.now(timezone.utc)
+        created = {entry.id: entry.created_at for entry in entries}
+        for entry_id in delivered:
+            OUTBOX_LATENCY.observe((now - created[entry_id]).total_seconds())
+        OUTBOX_DELIVERED.inc(len(delivered))
+        OUTBOX_RETRIES.inc(len(failed) - dropped)
+        OUTBOX_DROPPED.inc(dropped + len(undeliverable))
+        if dropped:
+            logging.warning(
+                f"Gave up on {dropped} notifications after {self.max_attempts} attempts"
+            )
@@ -0,0 +1,44 @@
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable
+
+from consts import Fees
+from metrics import PIPELINE_QUEUE_SECONDS, PIPELINE_STAGE_SECONDS, SNAPSHOTS_SUPERSEDED
+
+# an evaluation always compares with the stored previous fees, so a snapshot that
+# is still waiting can be replaced by a newer one without losing a crossing
+SNAPSHOT_QUEUE = 1
+
+
+class MonitorPipeline:
+    # fetch -> evaluate -> deliver, where the outbox is the queue to the delivery
+    # workers; fetching stays on schedule however long the later stages take
+    def __init__(
+        self,
+        fetch: Callable[[], Awaitable[Fees]],
+        evaluate: Callable[[Fees], Awaitable[None]],
+        queue_size: int = SNAPSHOT_QUEUE,
+    ):
+        self._fetch = fetch
+        self._evaluate = evaluate
+        self.snapshots: asyncio.Queue[tuple[float, Fees]] = asyncio.Queue(queue_size)
+
+    async def fetch(self) -> Fees:
+        with PIPELINE_STAGE_SECONDS.time(stage="fetch"):
+            fees = await self._fetch()
+        if self.snapshots.full():
+            self.snapshots.get_nowait()
+            SNAPSHOTS_SUPERSEDED.inc()
+        self.snapshots.put_nowait((time.perf_counter(), fees))
+        return fees
+
+    async def run_evaluator(self):
+        while True:
+            fetched, fees = await self.snapshots.get()
+            PIPELINE_QUEUE_SECONDS.observe(time.perf_counter() - fetched)
+            try:
+                with PIPELINE_STAGE_SECONDS.time(stage="evaluate"):
+                    await self._evaluate(fees)
+            except Exception as e:
+                logging.error(f"Could not evaluate fees: {e!r}")
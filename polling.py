@@ -0,0 +1,105 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable, Iterable, Iterator
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from consts import DEFAULT_NETWORK, Fees, Pair
+from db import FeeRange, count_subscriptions_in_ranges
+from metrics import MONITOR_INTERVAL, TICK_COALESCED, TICK_TIMEOUTS
+from store import SubscriptionStore
+from utils import changed_pairs
+
+GROWTH = 1.5
+SHRINK = 2
+# subscriptions one more move away from crossing that make polling faster
+NEAR_SUBSCRIPTIONS = 1
+
+
+def near_ranges(
+    current: Fees, previous: Fees, pairs: Iterable[Pair]
+) -> Iterator[FeeRange]:
+    # the thresholds that the next move of the same size would cross, either way
+    for from_asset, to_asset in sorted(pairs):
+        fee = current.get(from_asset, {}).get(to_asset, None)
+        previous_fee = previous.get(from_asset, {}).get(to_asset, None)
+        if fee is None or previous_fee is None or fee == previous_fee:
+            continue
+        step = abs(fee - previous_fee)
+        yield from_asset, to_asset, fee - step, fee + step
+
+
+async def count_near(
+    session_maker: async_sessionmaker,
+    ranges: list[FeeRange],
+    store: SubscriptionStore | None = None,
+    network: str = DEFAULT_NETWORK,
+) -> int:
+    if store is not None:
+        return store.count_in_ranges(ranges)
+    async with session_maker() as session:
+        return await count_subscriptions_in_ranges(session, ranges, network)
+
+
+class AdaptiveInterval:
+    def __init__(
+        self,
+        minimum: float,
+        maximum: float,
+        initial: float,
+        network: str = DEFAULT_NETWORK,
+    ):
+        self.network = network
+        self.minimum = minimum
+        self.maximum = maximum
+        self.interval = min(max(initial, minimum), maximum)
+        self.fees: Fees | None = None
+        MONITOR_INTERVAL.set(self.interval, network=self.network)
+
+    async def observe(
+        self, fees: Fees, count: Callable[[list[FeeRange]], Awaitable[int]]
+    ) -> float:
+        # polls faster while fees move close to thresholds and slower otherwise
+        previous, self.fees = self.fees, fees
+        if previous is not None:
+            changed = changed_pairs(fees, previous)
+            near = 0
+            if changed:
+                near = await count(list(near_ranges(fees, previous, changed)))
+            if near >= NEAR_SUBSCRIPTIONS:
+                self.interval = max(self.interval / SHRINK, self.minimum)
+            else:
+                self.interval = min(self.interval * GROWTH, self.maximum)
+        MONITOR_INTERVAL.set(self.interval, network=self.network)
+        return self.interval
+
+
+class SingleFlight:
+    def __init__(self, deadline: float | None = None):
+        self.deadline = deadline
+        self._lock = asyncio.Lock()
+        self._coalesced = False
+
+    async def run(self, tick: Callable[[], Awaitable[None]]) -> bool:
+        # a tick requested while one is running does not start a second one, all
+        # such requests are folded into a single rerun once it is done
+        if self._lock.locked():
+            self._coalesced = True
+            TICK_COALESCED.inc()
+            return False
+        async with self._lock:
+            self._coalesced = True
+            while self._coalesced:
+                self._coalesced = False
+                timeout = asyncio.timeout(self.deadline)
+                try:
+                    async with timeout:
+                        await tick()
+                except TimeoutError:
+                    if not timeout.expired():
+                        raise
+                    TICK_TIMEOUTS.inc()
+                    logging.warning(
+                        f"Monitor tick cancelled after its deadline of {self.deadline}s"
+                    )
+        return True
@@ -1,6 +1,10 @@
-from pydantic import Field, ConfigDict
+from typing import Literal
+
+from pydantic import Field, ConfigDict, field_validator, model_validator
 from pydantic_settings import BaseSettings
 
+from consts import DEFAULT_NETWORK
+
 
 class DbSettings(BaseSettings):
     database_url: str = Field(
@@ -16,10 +20,103 @@ class DbSettings(BaseSettings):
 class Settings(DbSettings):
     telegram_bot_token: str = Field(..., description="Telegram bot token")
     check_interval: int = Field(60, description="Interval to check API (seconds)")
+    min_check_interval: int = Field(
+        10,
+        ge=1,
+        description="Shortest interval to check the API while fees move close to "
+        "thresholds (seconds)",
+    )
+    max_check_interval: int = Field(
+        300,
+        description="Longest interval to check the API while fees are flat (seconds)",
+    )
+    tick_deadline: float = Field(
+        30, description="Time after which a monitor tick is cancelled (seconds)"
+    )
+    mode: Literal["standalone", "commands", "worker"] = Field(
+        "standalone",
+        description="standalone does everything in one process, commands only "
+        "handles commands and worker evaluates and delivers one shard of chats. "
+        "polling is accepted for commands",
+    )
+    shard_count: int = Field(1, ge=1, description="Number of worker processes")
+    shard_index: int = Field(0, ge=0, description="Shard handled by this worker")
+    subscription_store: bool = Field(
+        True,
+        description="Keep all subscriptions in memory, otherwise crossings are "
+        "found and queued by the database every tick",
+    )
+    notification_rate: float = Field(
+        30, description="Maximum notifications sent per second across all chats"
+    )
+    chat_notification_interval: float = Field(
+        1.0, description="Minimum interval between notifications to a chat (seconds)"
+    )
+    metrics_port: int | None = Field(
+        None, description="Port of the Prometheus metrics endpoint, disabled if unset"
+    )
+    metrics_host: str = Field(
+        "127.0.0.1", description="Address the metrics endpoint listens on"
+    )
+    history_retention: int = Field(
+        7 * 24,
+        description="Hours of full resolution fee history kept before it is "
+        "rolled up to hourly min/max/avg",
+    )
+    handler_instrumentation: bool = Field(
+        False,
+        description="Record wall, query and Telegram API time of command handlers",
+    )
+    slow_update_threshold: float = Field(
+        1.0,
+        description="Handler time above which an update is logged with a breakdown "
+        "when handler_instrumentation is enabled (seconds)",
+    )
+    webhook_url: str | None = Field(
+        None,
+        description="Public URL Telegram posts updates to, long polling is used if unset",
+    )
+    webhook_host: str = Field("127.0.0.1", description="Address the webhook listens on")
+    webhook_port: int = Field(8080, description="Port the webhook listens on")
+    webhook_path: str = Field("/webhook", description="Path the webhook listens on")
+    webhook_secret: str | None = Field(
+        None, description="Secret token Telegram sends along with every update"
+    )
     api_url: str = Field(
         "https://api.boltz.exchange",
         description="Boltz API URL for submarine swaps",
     )
+    networks: dict[str, str] = Field(
+        default_factory=dict,
+        description="Boltz API URLs by network name, all monitored by one process, "
+        f"as JSON. Defaults to api_url as {DEFAULT_NETWORK}",
+    )
     database_url: str = Field(
         description="Database URL for PostgreSQL",
     )
+
+    @field_validator("mode", mode="before")
+    @classmethod
+    def rename_polling(cls, mode):
+        # the commands mode was called polling before it could also use a webhook
+        return "commands" if mode == "polling" else mode
+
+    @model_validator(mode="after")
+    def check_shard(self):
+        if self.shard_index >= self.shard_count:
+            raise ValueError("shard_index has to be lower than shard_count")
+        return self
+
+    @model_validator(mode="after")
+    def check_networks(self):
+        if not self.networks:
+            self.networks = {DEFAULT_NETWORK: self.api_url}
+        if len(self.networks) > 1 and self.mode != "standalone":
+            raise ValueError("several networks are only supported in standalone mode")
+        return self
+
+    @model_validator(mode="after")
+    def check_intervals(self):
+        if self.min_check_interval > self.max_check_interval:
+            raise ValueError("min_check_interval can not exceed max_check_interval")
+        return self
@@ -0,0 +1,309 @@
+import asyncio
+import json
+import logging
+from collections.abc import Awaitable, Callable, Iterable
+
+import asyncpg
+from sqlalchemy import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from consts import (
+    ALL_FEES,
+    DEFAULT_NETWORK,
+    SNAPSHOT_CHANNEL,
+    SUBSCRIPTIONS_CHANNEL,
+    Fees,
+)
+from db import add_outbox, get_previous, lock_previous, upsert_previous
+from digest import Digest
+from dispatcher import NotificationDispatcher
+from history import HistoryWriter
+from outbox import OutboxDelivery
+from polling import AdaptiveInterval, count_near
+from snapshot import SNAPSHOT_KEY, publish_snapshot
+from store import SubscriptionStore, record_pair_counts
+from utils import changed_pairs, network_key
+
+# arbitrary, but has to be the same for all workers
+LEADER_LOCK = 0x626F6C747A
+RECONNECT_DELAY = 5
+HEALTH_CHECK_INTERVAL = 30
+# names the connections of the workers in pg_stat_activity
+APPLICATION_NAME = "boltz-fee-bot"
+
+
+def shard_of(chat_id: int, shard_count: int) -> int:
+    return chat_id % shard_count
+
+
+async def connect(database_url: str) -> asyncpg.Connection:
+    url = make_url(database_url).set(drivername="postgresql")
+    return await asyncpg.connect(
+        url.render_as_string(hide_password=False),
+        server_settings={"application_name": APPLICATION_NAME},
+    )
+
+
+async def healthy(connection: asyncpg.Connection) -> bool:
+    try:
+        await asyncio.wait_for(connection.execute("SELECT 1"), HEALTH_CHECK_INTERVAL)
+        return True
+    except Exception:
+        return False
+
+
+async def listen(
+    database_url: str,
+    listeners: dict[str, Callable],
+    on_connect: Callable[[], Awaitable[None]],
+    name: str,
+):
+    while True:
+        try:
+            connection = await connect(database_url)
+        except Exception as e:
+            logging.error(f"{name} could not listen: {e!r}")
+            await asyncio.sleep(RECONNECT_DELAY)
+            continue
+        try:
+            lost = asyncio.Event()
+            connection.add_termination_listener(lambda _: lost.set())
+            for channel, listener in listeners.items():
+                await connection.add_listener(channel, listener)
+            # what was notified while nobody listened is lost, so it is caught up
+            # with after every connect
+            await on_connect()
+            while not lost.is_set():
+                try:
+                    await asyncio.wait_for(lost.wait(), HEALTH_CHECK_INTERVAL)
+                except TimeoutError:
+                    # a connection that went away silently is only noticed when used
+                    if not await healthy(connection):
+                        break
+            logging.warning(f"{name} lost its listener")
+        except Exception as e:
+            logging.error(f"{name} stopped listening: {e!r}")
+        finally:
+            connection.terminate()
+        await asyncio.sleep(RECONNECT_DELAY)
+
+
+async def listen_snapshots(
+    database_url: str,
+    session_maker: async_sessionmaker,
+    bot_data: dict,
+    networks: Iterable[str] = (DEFAULT_NETWORK,),
+):
+    # keeps the snapshot of a process that does not fetch fees itself up to date
+    def on_snapshot(_connection, _pid, _channel, payload: str):
+        snapshot = json.loads(payload)
+        network = snapshot.get("network", DEFAULT_NETWORK)
+        publish_snapshot(bot_data, snapshot["current"], network)
+
+    async def load():
+        for network in networks:
+            key = network_key(SNAPSHOT_KEY, network)
+            published = bot_data.get(key)
+            async with session_maker() as session:
+                current = await get_previous(session, network_key(ALL_FEES, network))
+            # unless a snapshot that arrived meanwhile is newer
+            if current and bot_data.get(key) is published:
+                publish_snapshot(bot_data, current, network)
+
+    await listen(database_url, {SNAPSHOT_CHANNEL: on_snapshot}, load, "Commands")
+
+
+class ShardWorker:
+    def __init__(
+        self,
+        database_url: str,
+        session_maker: async_sessionmaker,
+        shard_index: int,
+        shard_count: int,
+        polling: AdaptiveInterval,
+        fetch: Callable[[], Awaitable[Fees]],
+        send: Callable[[Digest], Awaitable[bool]],
+        dispatcher: NotificationDispatcher,
+        history: HistoryWriter | None = None,
+        network: str = DEFAULT_NETWORK,
+    ):
+        self.database_url = database_url
+        self.session_maker = session_maker
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.polling = polling
+        self.fetch = fetch
+        self.history = history
+        self.network = network
+        self.store = SubscriptionStore()
+        # the fees of the last snapshot, to check queued notifications against
+        self.fees: Fees | None = None
+        self.outbox = OutboxDelivery(
+            session_maker,
+            dispatcher,
+            send,
+            (shard_index, shard_count),
+            current_fees=lambda network: self.fees,
+        )
+        self.is_leader = False
+        self.ready = asyncio.Event()
+        # snapshots and subscription changes, handled in order of arrival
+        self._events: asyncio.Queue[tuple[str, object]] = asyncio.Queue()
+
+    def owns(self, chat_id: int) -> bool:
+        return shard_of(chat_id, self.shard_count) == self.shard_index
+
+    async def run(self):
+        async with asyncio.TaskGroup() as tasks:
+            tasks.create_task(self._listen())
+            tasks.create_task(self._lead())
+            tasks.create_task(self._handle_events())
+            tasks.create_task(self.outbox.run())
+
+    async def _listen(self):
+        async def resync():
+            # the store is loaded again and the last stored fees are evaluated
+            # before the notifications that arrive from now on
+            self._events.put_nowait(("resync", None))
+
+        await listen(
+            self.database_url,
+            {
+                SNAPSHOT_CHANNEL: self._on_snapshot,
+                SUBSCRIPTIONS_CHANNEL: self._on_subscription_change,
+            },
+            resync,
+            f"Shard {self.shard_index}",
+        )
+
+    async def _resync(self):
+        async with self.session_maker() as session:
+            await self.store.load(
+                session, (self.shard_index, self.shard_count), self.network
+            )
+            current = await get_previous(session, network_key(ALL_FEES, self.network))
+        logging.info(
+            f"Shard {self.shard_index}/{self.shard_count} loaded "
+            f"{len(self.store)} subscriptions"
+        )
+        self.ready.set()
+        if current:
+            await self._evaluate(current, None)
+
+    def _on_snapshot(self, _connection, _pid, _channel, payload: str):
+        snapshot = json.loads(payload)
+        self._events.put_nowait(("snapshot", snapshot))
+
+    def _on_subscription_change(self, _connection, _pid, _channel, payload: str):
+        chat_id = int(payload)
+        if self.owns(chat_id):
+            self._events.put_nowait(("chat", chat_id))
+
+    async def _lead(self):
+        # the advisory lock lives as long as its connection
+        lock: asyncpg.Connection | None = None
+        try:
+            while True:
+                try:
+                    if lock is None or lock.is_closed():
+                        # a lost connection took the lock with it
+                        self.is_leader = False
+                        lock = await connect(self.database_url)
+                    if not self.is_leader:
+                        self.is_leader = await lock.fetchval(
+                            "SELECT pg_try_advisory_lock($1)", LEADER_LOCK
+                        )
+                        if self.is_leader:
+                            logging.info(
+                                f"Shard {self.shard_index} is now fetching fees"
+                            )
+                    if self.is_leader:
+                        current = await self._fetch_and_publish(lock)
+                        # the leader does not hold all subscriptions, so they are
+                        # counted by the database
+                        await self.polling.observe(
+                            current,
+                            lambda ranges: count_near(
+                                self.session_maker, ranges, network=self.network
+                            ),
+                        )
+                        await record_pair_counts(
+                            self.session_maker, network=self.network
+                        )
+                except Exception as e:
+                    logging.error(f"Shard {self.shard_index} could not lead: {e!r}")
+                    if lock is not None and not await healthy(lock):
+                        lock.terminate()
+                await asyncio.sleep(self.polling.interval)
+        finally:
+            if lock is not None:
+                lock.terminate()
+
+    async def _fetch_and_publish(self, connection: asyncpg.Connection) -> Fees:
+        current = await self.fetch()
+        if self.history is not None:
+            self.history.record(current)
+        async with self.session_maker() as session:
+            key = network_key(ALL_FEES, self.network)
+            await lock_previous(session, key)
+            previous = await get_previous(session, key)
+            changed = changed_pairs(current, previous) if previous else None
+            if previous and not changed:
+                return current
+            await upsert_previous(session, key, current, changed)
+        if previous:
+            payload = json.dumps(
+                {"network": self.network, "previous": previous, "current": current}
+            )
+            await connection.execute(
+                "SELECT pg_notify($1, $2)", SNAPSHOT_CHANNEL, payload
+            )
+        return current
+
+    async def _handle_events(self):
+        while True:
+            kind, payload = await self._events.get()
+            try:
+                if kind == "resync":
+                    await self._resync()
+                elif kind == "chat":
+                    async with self.session_maker() as session:
+                        await self.store.reload_chat(session, payload, self.network)
+                else:
+                    await self._evaluate(payload["current"], payload.get("previous"))
+            except Exception as e:
+                logging.error(f"Could not handle {kind} event: {e!r}")
+                if kind == "resync":
+                    asyncio.get_running_loop().call_later(
+                        RECONNECT_DELAY, self._events.put_nowait, ("resync", None)
+                    )
+            finally:
+                self._events.task_done()
+
+    async def _evaluate(self, current: Fees, published_previous: Fees | None):
+        self.fees = current
+        key = network_key(
+            f"{ALL_FEES}:{self.shard_index}/{self.shard_count}", self.network
+        )
+        async with self.session_maker() as session:
+            await lock_previous(session, key)
+            # every shard stores the fees it evaluated together with its crossings,
+            # so that a crash or a missed snapshot is caught up with the next one
+            previous = await get_previous(session, key) or published_previous
+            if not previous:
+                await upsert_previous(session, key, current)
+                return
+            changed = changed_pairs(current, previous)
+            if not changed:
+                await session.commit()
+                return
+            crossed = self.store.crossed(current, previous, changed)
+            await add_outbox(session, crossed, current, self.network)
+            await upsert_previous(session, key, current, changed)
+        if not crossed:
+            return
+        logging.info(
+            f"Shard {self.shard_index} queued notifications "
+            f"for {len(crossed)} subscriptions"
+        )
+        self.outbox.wake()
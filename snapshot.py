@@ -0,0 +1,58 @@
+from collections.abc import Mapping
+from dataclasses import dataclass
+from types import MappingProxyType
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from telegram.ext import ContextTypes
+
+from consts import DEFAULT_NETWORK, Fees, ALL_FEES
+from db import get_previous
+from utils import network_key
+
+SNAPSHOT_KEY = "fee_snapshot"
+
+
+@dataclass(frozen=True)
+class FeeSnapshot:
+    version: int
+    fees: Mapping[str, Mapping[str, int]]
+
+
+def freeze_fees(fees: Fees) -> Mapping[str, Mapping[str, int]]:
+    return MappingProxyType(
+        {
+            from_asset: MappingProxyType(dict(pairs))
+            for from_asset, pairs in fees.items()
+        }
+    )
+
+
+def publish_snapshot(
+    bot_data: dict, fees: Fees, network: str = DEFAULT_NETWORK
+) -> FeeSnapshot:
+    key = network_key(SNAPSHOT_KEY, network)
+    previous: FeeSnapshot | None = bot_data.get(key)
+    snapshot = FeeSnapshot(
+        version=previous.version + 1 if previous else 1, fees=freeze_fees(fees)
+    )
+    # handlers only ever see a complete snapshot since this is a single assignment
+    bot_data[key] = snapshot
+    return snapshot
+
+
+def latest_fees(
+    bot_data: dict, network: str = DEFAULT_NETWORK
+) -> Mapping[str, Mapping[str, int]] | None:
+    snapshot: FeeSnapshot | None = bot_data.get(network_key(SNAPSHOT_KEY, network))
+    return snapshot.fees if snapshot else None
+
+
+async def get_snapshot_fees(
+    context: ContextTypes.DEFAULT_TYPE,
+    session: AsyncSession,
+    network: str = DEFAULT_NETWORK,
+) -> Mapping[str, Mapping[str, int]] | None:
+    fees = latest_fees(context.bot_data, network)
+    if fees is not None:
+        return fees
+    return await get_previous(session, network_key(ALL_FEES, network))
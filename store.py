@@ -0,0 +1,233 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Iterable
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from telegram.ext import ContextTypes
+
+from consts import DEFAULT_NETWORK, Fees, Pair
+from db import (
+    STREAM_BATCH,
+    SUBSCRIPTION_COLUMNS,
+    FeeRange,
+    Shard,
+    Subscription,
+    count_subscriptions_by_pair,
+    in_shard,
+)
+from metrics import DB_QUERY_SECONDS, SUBSCRIPTIONS, timed
+
+STORE_KEY = "subscription_store"
+
+
+class StoredSubscription:
+    __slots__ = ("id", "chat_id", "from_asset", "to_asset", "fee_threshold")
+
+    def __init__(
+        self,
+        id: int,
+        chat_id: int,
+        from_asset: str,
+        to_asset: str,
+        fee_threshold: int,
+    ):
+        self.id = id
+        self.chat_id = chat_id
+        self.from_asset = from_asset
+        self.to_asset = to_asset
+        self.fee_threshold = fee_threshold
+
+    @classmethod
+    def from_subscription(cls, subscription: Subscription) -> "StoredSubscription":
+        return cls(
+            subscription.id,
+            subscription.chat_id,
+            subscription.from_asset,
+            subscription.to_asset,
+            subscription.fee_threshold,
+        )
+
+    def __str__(self):
+        return f"Subscription(chat_id={self.chat_id}, from_asset={self.from_asset}, to_asset={self.to_asset}, fee_threshold={self.fee_threshold})"
+
+
+class PairIndex:
+    __slots__ = ("keys", "subscriptions")
+
+    def __init__(self):
+        # ordered by threshold, the keys are a contiguous column of 64-bit
+        # integers that is binary searched without touching the subscription objects
+        self.keys = array("q")
+        self.subscriptions: list[StoredSubscription] = []
+
+    def extend(self, subscriptions: list[StoredSubscription]):
+        # sorting once is much cheaper than inserting one by one
+        self.subscriptions = sorted(
+            self.subscriptions + subscriptions, key=lambda s: s.fee_threshold
+        )
+        self.keys = array(
+            "q", (subscription.fee_threshold for subscription in self.subscriptions)
+        )
+
+    def add(self, subscription: StoredSubscription):
+        index = bisect_right(self.keys, subscription.fee_threshold)
+        self.keys.insert(index, subscription.fee_threshold)
+        self.subscriptions.insert(index, subscription)
+
+    def remove(self, subscription: StoredSubscription):
+        index = bisect_left(self.keys, subscription.fee_threshold)
+        while self.subscriptions[index].id != subscription.id:
+            index += 1
+        del self.keys[index]
+        del self.subscriptions[index]
+
+    def crossings(self, fee: int, previous_fee: int) -> tuple[slice, slice]:
+        # the keys are sorted, so the thresholds crossed downwards (fee <= t <
+        # previous) and upwards (previous <= t < fee) are each one contiguous run
+        fee_index = bisect_left(self.keys, fee)
+        previous_index = bisect_left(self.keys, previous_fee)
+        return slice(fee_index, previous_index), slice(previous_index, fee_index)
+
+    def count(self, low: int, high: int) -> int:
+        return bisect_left(self.keys, high) - bisect_left(self.keys, low)
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class SubscriptionStore:
+    def __init__(self):
+        self._pairs: dict[Pair, PairIndex] = {}
+        self._by_id: dict[int, StoredSubscription] = {}
+        self._by_chat: dict[int, set[int]] = {}
+
+    def __len__(self):
+        return len(self._by_id)
+
+    @timed(DB_QUERY_SECONDS, query="load_subscriptions")
+    async def load(
+        self,
+        session: AsyncSession,
+        shard: Shard | None = None,
+        network: str = DEFAULT_NETWORK,
+    ):
+        self.clear()
+        query = SUBSCRIPTION_COLUMNS.where(Subscription.network == network)
+        if shard is not None:
+            query = query.where(in_shard(Subscription.chat_id, shard))
+        # streamed in batches, so that the raw rows are never all held at once
+        result = await session.stream(query.execution_options(yield_per=STREAM_BATCH))
+        self.extend([StoredSubscription(*row) async for row in result])
+
+    async def reload_chat(
+        self, session: AsyncSession, chat_id: int, network: str = DEFAULT_NETWORK
+    ):
+        result = await session.execute(
+            SUBSCRIPTION_COLUMNS.where(
+                Subscription.chat_id == chat_id, Subscription.network == network
+            )
+        )
+        self.remove_chat(chat_id)
+        self.extend(StoredSubscription(*row) for row in result)
+
+    def clear(self):
+        self._pairs.clear()
+        self._by_id.clear()
+        self._by_chat.clear()
+
+    def extend(self, subscriptions: Iterable[StoredSubscription]):
+        by_pair: dict[Pair, list[StoredSubscription]] = {}
+        for subscription in subscriptions:
+            self.remove(subscription.id)
+            pair = (subscription.from_asset, subscription.to_asset)
+            by_pair.setdefault(pair, []).append(subscription)
+            self._by_id[subscription.id] = subscription
+            self._by_chat.setdefault(subscription.chat_id, set()).add(subscription.id)
+        for pair, pair_subscriptions in by_pair.items():
+            self._pairs.setdefault(pair, PairIndex()).extend(pair_subscriptions)
+
+    def add(self, subscription: Subscription):
+        self.remove(subscription.id)
+        self._add(StoredSubscription.from_subscription(subscription))
+
+    def _add(self, subscription: StoredSubscription):
+        pair = (subscription.from_asset, subscription.to_asset)
+        self._pairs.setdefault(pair, PairIndex()).add(subscription)
+        self._by_id[subscription.id] = subscription
+        self._by_chat.setdefault(subscription.chat_id, set()).add(subscription.id)
+
+    def remove(self, subscription_id: int):
+        subscription = self._by_id.pop(subscription_id, None)
+        if subscription is None:
+            return
+        pair = (subscription.from_asset, subscription.to_asset)
+        index = self._pairs[pair]
+        index.remove(subscription)
+        if not index:
+            del self._pairs[pair]
+        chat = self._by_chat[subscription.chat_id]
+        chat.discard(subscription_id)
+        if not chat:
+            del self._by_chat[subscription.chat_id]
+
+    def remove_chat(self, chat_id: int):
+        for subscription_id in list(self._by_chat.get(chat_id, ())):
+            self.remove(subscription_id)
+
+    def pair_counts(self) -> dict[Pair, int]:
+        return {pair: len(index) for pair, index in self._pairs.items()}
+
+    def count_in_ranges(self, ranges: Iterable[FeeRange]) -> int:
+        count = 0
+        for from_asset, to_asset, low, high in ranges:
+            index = self._pairs.get((from_asset, to_asset))
+            if index is not None:
+                count += index.count(low, high)
+        return count
+
+    def crossed(
+        self, current: Fees, previous: Fees, pairs: Iterable[Pair]
+    ) -> list[StoredSubscription]:
+        result = []
+        for from_asset, to_asset in sorted(pairs):
+            index = self._pairs.get((from_asset, to_asset))
+            if index is None:
+                continue
+            fee = current.get(from_asset, {}).get(to_asset, None)
+            previous_fee = previous.get(from_asset, {}).get(to_asset, None)
+            if fee is None or previous_fee is None or fee == previous_fee:
+                continue
+            down, up = index.crossings(fee, previous_fee)
+            result.extend(index.subscriptions[down])
+            result.extend(index.subscriptions[up])
+        return result
+
+
+def subscription_store(
+    context: ContextTypes.DEFAULT_TYPE, network: str = DEFAULT_NETWORK
+) -> SubscriptionStore | None:
+    # one store per network, each only holds the subscriptions of its network
+    return subscription_stores(context).get(network)
+
+
+def subscription_stores(
+    context: ContextTypes.DEFAULT_TYPE,
+) -> dict[str, SubscriptionStore]:
+    return context.bot_data.get(STORE_KEY, {})
+
+
+async def record_pair_counts(
+    session_maker: async_sessionmaker,
+    store: SubscriptionStore | None = None,
+    network: str = DEFAULT_NETWORK,
+):
+    if store is not None:
+        counts = store.pair_counts()
+    else:
+        async with session_maker() as session:
+            counts = await count_subscriptions_by_pair(session, network)
+    SUBSCRIPTIONS.clear(network=network)
+    for (from_asset, to_asset), count in counts.items():
+        SUBSCRIPTIONS.set(
+            count, network=network, from_asset=from_asset, to_asset=to_asset
+        )
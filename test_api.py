@@ -0,0 +1,230 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+from api import CircuitOpenError, FeeClient, get_all_fees
+from consts import SwapType
+from metrics import API_CIRCUIT_OPEN, API_ERRORS, API_REQUEST_SECONDS, API_STALE
+
+RESPONSES = {
+    "submarine": {"L-BTC": {"BTC": {"fees": {"percentage": 0.1}}}},
+    "reverse": {"BTC": {"L-BTC": {"fees": {"percentage": 0.25}}}},
+    "chain": {"BTC": {"L-BTC": {"fees": {"percentage": 0.1}}}},
+}
+
+
+def mock_client(
+    delays: dict[str, float], failing: tuple[str, ...] = (), responses=RESPONSES
+):
+    async def handler(request: httpx.Request) -> httpx.Response:
+        swap_type = request.url.path.rsplit("/", 1)[-1]
+        await asyncio.sleep(delays.get(swap_type, 0))
+        if swap_type in failing:
+            return httpx.Response(500)
+        return httpx.Response(200, json=responses[swap_type])
+
+    return httpx.AsyncClient(
+        base_url="http://boltz.test", transport=httpx.MockTransport(handler)
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_all_fees():
+    async with mock_client({}) as client:
+        fees = await get_all_fees(client)
+    assert fees == {
+        "L-BTC": {"LN": 1000},
+        "LN": {"L-BTC": 2500},
+        "BTC": {"L-BTC": 1000},
+    }
+
+
+@pytest.mark.asyncio
+async def test_get_all_fees_inexact(caplog):
+    responses = {
+        **RESPONSES,
+        "reverse": {
+            "BTC": {
+                "L-BTC": {"fees": {"percentage": 0.25}},
+                "RBTC": {"fees": {"percentage": 0.12345}},
+            }
+        },
+    }
+    async with mock_client({}, responses=responses) as client:
+        fees = await get_all_fees(client)
+    # a fee that can not be stored exactly is left out
+    assert fees["LN"] == {"L-BTC": 2500}
+    assert "0.12345" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_get_all_fees_concurrent():
+    delays = {"submarine": 0.2, "reverse": 0.3, "chain": 0.2}
+    async with mock_client(delays) as client:
+        start = time.perf_counter()
+        await get_all_fees(client)
+        elapsed = time.perf_counter() - start
+    assert max(delays.values()) <= elapsed < sum(delays.values())
+
+
+@pytest.mark.asyncio
+async def test_get_all_fees_partial(caplog):
+    errors = {swap_type: API_ERRORS.get(swap_type=swap_type) for swap_type in RESPONSES}
+    timed = API_REQUEST_SECONDS.count(swap_type="chain")
+    async with mock_client({"chain": 0.5}, failing=("reverse",)) as client:
+        fees = await get_all_fees(client, timeout=0.1)
+    assert fees == {"L-BTC": {"LN": 1000}}
+    assert "reverse" in caplog.text
+    assert "chain" in caplog.text
+    # the request that timed out is counted as well
+    assert API_ERRORS.get(swap_type="submarine") == errors["submarine"]
+    assert API_ERRORS.get(swap_type="reverse") == errors["reverse"] + 1
+    assert API_ERRORS.get(swap_type="chain") == errors["chain"] + 1
+    assert API_REQUEST_SECONDS.count(swap_type="chain") == timed + 1
+
+
+@pytest.mark.asyncio
+async def test_get_all_fees_failed():
+    async with mock_client({}, failing=("submarine", "reverse", "chain")) as client:
+        with pytest.raises(ExceptionGroup):
+            await get_all_fees(client)
+
+
+class FaultyServer:
+    # a local Boltz API that fails, stalls or drops connections on demand
+    def __init__(self):
+        self.faults: list[str] = []
+        self.requests = 0
+        self.server: asyncio.Server | None = None
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        request = await reader.readline()
+        while (await reader.readline()).strip():
+            pass
+        self.requests += 1
+        fault = self.faults.pop(0) if self.faults else "ok"
+        try:
+            if fault == "reset":
+                return
+            if fault == "stall":
+                await asyncio.sleep(1)
+            swap_type = request.split()[1].decode().rsplit("/", 1)[-1]
+            status, body = "200 OK", json.dumps(RESPONSES[swap_type]).encode()
+            if fault == "error":
+                status, body = "500 Internal Server Error", b""
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def __aenter__(self) -> str:
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}"
+
+    async def __aexit__(self, *_):
+        self.server.close()
+
+
+def fee_client(url: str, **kwargs) -> FeeClient:
+    client = httpx.AsyncClient(base_url=url, timeout=httpx.Timeout(0.2))
+    return FeeClient(client, timeout=1, backoff=0.01, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_retries():
+    server = FaultyServer()
+    async with server as url:
+        client = fee_client(url)
+        server.faults = ["error", "reset"]
+        assert await client.get_fees(SwapType.SUBMARINE) == {"L-BTC": {"LN": 1000}}
+        assert server.requests == 3
+
+        # read timeouts are retried as well, but only so often
+        server.faults = ["stall"] * 3
+        with pytest.raises(httpx.ReadTimeout):
+            await client._fetch(SwapType.SUBMARINE)
+        await client.client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker():
+    server = FaultyServer()
+    async with server as url:
+        client = fee_client(url, retries=0, failure_threshold=2, reset_timeout=0.2)
+        server.faults = ["error"] * 2
+        for _ in range(2):
+            with pytest.raises(httpx.HTTPStatusError):
+                await client.get_fees(SwapType.CHAIN)
+        assert client.breakers[SwapType.CHAIN].is_open
+        assert API_CIRCUIT_OPEN.get(network="mainnet", swap_type="chain") == 1
+
+        # an open circuit does not send requests
+        with pytest.raises(CircuitOpenError):
+            await client.get_fees(SwapType.CHAIN)
+        assert server.requests == 2
+
+        # one trial after the timeout, a failing one opens it again
+        await asyncio.sleep(0.2)
+        server.faults = ["error"]
+        with pytest.raises(httpx.HTTPStatusError):
+            await client.get_fees(SwapType.CHAIN)
+        with pytest.raises(CircuitOpenError):
+            await client.get_fees(SwapType.CHAIN)
+
+        await asyncio.sleep(0.2)
+        assert await client.get_fees(SwapType.CHAIN) == {"BTC": {"L-BTC": 1000}}
+        assert not client.breakers[SwapType.CHAIN].is_open
+        assert server.requests == 4
+        await client.client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_cancelled():
+    server = FaultyServer()
+    async with server as url:
+        client = fee_client(url, retries=0, failure_threshold=1, reset_timeout=0.2)
+        server.faults = ["error"]
+        with pytest.raises(httpx.HTTPStatusError):
+            await client.get_fees(SwapType.CHAIN)
+
+        # a trial cancelled from outside, e.g. by the tick deadline
+        await asyncio.sleep(0.2)
+        server.faults = ["stall"]
+        with pytest.raises(TimeoutError):
+            async with asyncio.timeout(0.05):
+                await client.get_fees(SwapType.CHAIN)
+        assert client.breakers[SwapType.CHAIN].is_open
+
+        # does not keep the circuit open once the endpoint recovered
+        await asyncio.sleep(0.2)
+        assert await client.get_fees(SwapType.CHAIN) == {"BTC": {"L-BTC": 1000}}
+        assert not client.breakers[SwapType.CHAIN].is_open
+        await client.client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_stale_fees():
+    server = FaultyServer()
+    async with server as url:
+        client = fee_client(url, retries=0, max_stale=0.3)
+        fees = await client.get_all_fees()
+
+        server.faults = ["error", "stall", "reset"]
+        start = time.perf_counter()
+        assert await client.get_all_fees() == fees
+        assert time.perf_counter() - start < 0.5
+        assert API_STALE.get(swap_type="submarine") >= 1
+
+        await asyncio.sleep(0.3)
+        server.faults = ["error"] * 3
+        with pytest.raises(ExceptionGroup):
+            await client.get_all_fees()
+        await client.client.aclose()
@@ -0,0 +1,25 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+# the benchmarks of `make bench` at a size that only checks that they still run,
+# but with enough subscriptions that some of them cross
+BENCHMARKS = [
+    ("fee_check", ["--sizes", "1000", "--ticks", "5", "--in-memory"]),
+    ("digest", ["--per-chat", "3", "--size", "1000"]),
+    ("lookup", ["--sizes", "50", "--repeat", "2"]),
+    ("polling", ["--hours", "1", "--size", "50"]),
+]
+
+
+@pytest.mark.parametrize("name, args", BENCHMARKS)
+def test_benchmark(tmp_path, name, args):
+    output = tmp_path / f"{name}.json"
+    subprocess.run(
+        [sys.executable, "-m", f"benchmarks.{name}", *args, "--output", output],
+        check=True,
+        timeout=60,
+    )
+    assert json.loads(output.read_text())
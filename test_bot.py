@@ -1,91 +1,112 @@
+import asyncio
+from types import SimpleNamespace
+
 import pytest
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from telegram.error import BadRequest, Forbidden, NetworkError, TimedOut
 
-from bot import check_subscription, check_fees
-from db import Subscription
+from bot import (
+    NetworkMonitor,
+    check_fees,
+    check_subscription,
+    crossing_ranges,
+    notify_chat,
+    stream_crossings,
+)
+from consts import ALL_FEES
+from db import Outbox, PreviousFee, Subscription, get_previous
+from digest import Digest
+from metrics import TICK_OVERRUNS, TICK_SECONDS
+from outbox import Undeliverable
+from pipeline import MonitorPipeline
+from polling import SingleFlight
+from store import SubscriptionStore
+from utils import changed_pairs
 
 
 @pytest.mark.parametrize(
     "current_fees, previous_fees, from_asset, to_asset, threshold, expected, test_description",
     [
         (
-            {"BTC": {"LN": 1.2}},
-            {"BTC": {"LN": 1.0}},
+            {"BTC": {"LN": 12000}},
+            {"BTC": {"LN": 10000}},
             "BTC",
             "LN",
-            1.0,
+            10000,
             True,
             "fee exactly at threshold",
         ),
         (
-            {"BTC": {"LN": 0.8}},
-            {"BTC": {"LN": 1.2}},
+            {"BTC": {"LN": 8000}},
+            {"BTC": {"LN": 12000}},
             "BTC",
             "LN",
-            1.0,
+            10000,
             True,
             "fee drops below threshold",
         ),
         (
-            {"LN": {"BTC": 1.2}},
-            {"LN": {"BTC": 0.8}},
+            {"LN": {"BTC": 12000}},
+            {"LN": {"BTC": 8000}},
             "LN",
             "BTC",
-            1.0,
+            10000,
             True,
             "LN to BTC fee goes above threshold",
         ),
         (
-            {"LN": {"BTC": 0.8}},
-            {"LN": {"BTC": 1.0}},
+            {"LN": {"BTC": 8000}},
+            {"LN": {"BTC": 10000}},
             "LN",
             "BTC",
-            1.0,
+            10000,
             False,
             "fee goes back to threshold",
         ),
         (
-            {"L-BTC": {"RBTC": 1.5}},
-            {"L-BTC": {"RBTC": 1.3}},
+            {"L-BTC": {"RBTC": 15000}},
+            {"L-BTC": {"RBTC": 13000}},
             "L-BTC",
             "RBTC",
-            1.0,
+            10000,
             False,
             "L-BTC to RBTC fee changes but doesn't cross threshold",
         ),
         (
-            {"RBTC": {"LN": 1.0}},
-            {"RBTC": {"LN": 1.0}},
+            {"RBTC": {"LN": 10000}},
+            {"RBTC": {"LN": 10000}},
             "RBTC",
             "LN",
-            1.0,
+            10000,
             False,
             "RBTC to LN fee equals threshold",
         ),
         (
             {},
-            {"L-BTC": {"BTC": 1.0}},
+            {"L-BTC": {"BTC": 10000}},
             "L-BTC",
             "BTC",
-            1.0,
+            10000,
             False,
             "missing fees in current",
         ),
         (
-            {"RBTC": {"L-BTC": 1.0}},
+            {"RBTC": {"L-BTC": 10000}},
             {},
             "RBTC",
             "L-BTC",
-            1.0,
+            10000,
             False,
             "missing fees in previous",
         ),
         (
             {"LN": {}},
-            {"LN": {"RBTC": 1.0}},
+            {"LN": {"RBTC": 10000}},
             "LN",
             "RBTC",
-            1.0,
+            10000,
             False,
             "missing to_asset in current",
         ),
@@ -108,18 +129,301 @@ def test_check_subscription(
     assert result == expected, f"Failed case: {test_description}"
 
 
+@pytest.mark.parametrize(
+    "current_fees, previous_fees, expected",
+    [
+        ({"BTC": {"LN": 10000}}, {"BTC": {"LN": 10000}}, []),
+        ({"BTC": {"LN": 5000}}, {"BTC": {"LN": 10000}}, [("BTC", "LN", 5000, 10000)]),
+        ({"BTC": {"LN": 10000}}, {"BTC": {"LN": 5000}}, [("BTC", "LN", 5000, 10000)]),
+        ({"BTC": {"LN": 10000}}, {"LN": {"BTC": 5000}}, []),
+        (
+            {"BTC": {"LN": 10000, "RBTC": 2000}},
+            {"BTC": {"RBTC": 1000}},
+            [("BTC", "RBTC", 1000, 2000)],
+        ),
+    ],
+)
+def test_crossing_ranges(current_fees, previous_fees, expected):
+    pairs = changed_pairs(current_fees, previous_fees)
+    assert list(crossing_ranges(current_fees, previous_fees, pairs)) == expected
+
+
+async def queued(session: AsyncSession) -> list[int]:
+    result = await session.execute(select(Outbox.subscription_id).order_by(Outbox.id))
+    await session.execute(delete(Outbox))
+    await session.commit()
+    return list(result.scalars())
+
+
+@pytest.mark.asyncio(loop_scope="session")
+@pytest.mark.parametrize("with_store", [False, True])
+async def test_check_fees(db_session: AsyncSession, monkeypatch, with_store):
+    await db_session.execute(delete(PreviousFee))
+    await db_session.execute(delete(Subscription))
+    await db_session.execute(delete(Outbox))
+    current_fees = {"BTC": {"LN": 12000}}
+    subscriptions = [
+        Subscription(chat_id=123, from_asset="BTC", to_asset="LN", fee_threshold=10000),
+        Subscription(chat_id=123, from_asset="BTC", to_asset="LN", fee_threshold=5000),
+    ]
+    db_session.add_all(subscriptions)
+    await db_session.commit()
+    store = None
+    if with_store:
+        store = SubscriptionStore()
+        await store.load(db_session)
+
+    assert await check_fees(db_session, current_fees, store) == 0
+    assert await queued(db_session) == []
+
+    current_fees = {"BTC": {"LN": 8000}}
+    assert await check_fees(db_session, current_fees, store) == 1
+    assert await queued(db_session) == [subscriptions[0].id]
+
+    current_fees = {"BTC": {"LN": 5000}}
+    await check_fees(db_session, current_fees, store)
+    assert await queued(db_session) == [subscriptions[1].id]
+
+    current_fees = {"BTC": {"LN": 10000}}
+    await check_fees(db_session, current_fees, store)
+    assert await queued(db_session) == [subscriptions[1].id]
+
+    current_fees = {"BTC": {"LN": 11000}}
+    await check_fees(db_session, current_fees, store)
+    entries = (await db_session.execute(select(Outbox))).scalars().all()
+    assert [(e.chat_id, e.fee_threshold, e.fee) for e in entries] == [
+        (123, 10000, 11000)
+    ]
+    assert await queued(db_session) == [subscriptions[0].id]
+
+    # crossing back before the notification was sent cancels it
+    await check_fees(db_session, {"BTC": {"LN": 9000}}, store)
+    assert await check_fees(db_session, current_fees, store) == 1
+    assert await queued(db_session) == []
+
+    async def unexpected_write(*_):
+        raise AssertionError("unchanged fees must not be written")
+
+    with monkeypatch.context() as m:
+        m.setattr("bot.upsert_previous", unexpected_write)
+        assert await check_fees(db_session, current_fees, store) == 0
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_check_fees_rollback(db_session: AsyncSession, monkeypatch):
+    await db_session.execute(delete(PreviousFee))
+    await db_session.execute(delete(Subscription))
+    db_session.add(
+        Subscription(chat_id=1, from_asset="LN", to_asset="BTC", fee_threshold=3000)
+    )
+    await db_session.commit()
+    await check_fees(db_session, {"LN": {"BTC": 5000}})
+
+    async def crash(*_):
+        raise RuntimeError("crashed before the commit")
+
+    # without the new fees, the queued crossing is detected again but not repeated
+    with monkeypatch.context() as m:
+        m.setattr("bot.upsert_previous", crash)
+        with pytest.raises(RuntimeError):
+            await check_fees(db_session, {"LN": {"BTC": 1000}})
+    await db_session.rollback()
+    assert await check_fees(db_session, {"LN": {"BTC": 1000}}) == 1
+    assert len(await queued(db_session)) == 1
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_check_fees_concurrent(db_session: AsyncSession, monkeypatch):
+    await db_session.execute(delete(PreviousFee))
+    await db_session.execute(delete(Subscription))
+    db_session.add(
+        Subscription(chat_id=1, from_asset="LN", to_asset="BTC", fee_threshold=3000)
+    )
+    await db_session.commit()
+    await check_fees(db_session, {"LN": {"BTC": 5000}})
+
+    # overlapping ticks with the same fees queue the crossing once
+    session_maker = async_sessionmaker(db_session.bind)
+
+    async def slow_previous(session, key):
+        previous = await get_previous(session, key)
+        await asyncio.sleep(0.05)
+        return previous
+
+    monkeypatch.setattr("bot.get_previous", slow_previous)
+
+    async def tick():
+        async with session_maker() as session:
+            return await check_fees(session, {"LN": {"BTC": 1000}})
+
+    assert sorted(await asyncio.gather(tick(), tick(), tick())) == [0, 0, 1]
+    assert len(await queued(db_session)) == 1
+
+
 @pytest.mark.asyncio(loop_scope="session")
-async def test_check_fees(db_session: AsyncSession):
-    current_fees = {"BTC": {"LN": 1.2}}
+@pytest.mark.parametrize("with_store", [False, True])
+async def test_check_fees_networks(db_session: AsyncSession, with_store):
+    await db_session.execute(delete(PreviousFee))
+    await db_session.execute(delete(Subscription))
     subscriptions = [
-        Subscription(chat_id=123, from_asset="BTC", to_asset="LN", fee_threshold=1.0),
-        Subscription(chat_id=123, from_asset="BTC", to_asset="LN", fee_threshold=0.5),
+        Subscription(chat_id=1, from_asset="BTC", to_asset="LN", fee_threshold=3000),
+        Subscription(
+            chat_id=1,
+            from_asset="BTC",
+            to_asset="LN",
+            fee_threshold=3000,
+            network="testnet",
+        ),
     ]
     db_session.add_all(subscriptions)
     await db_session.commit()
-    result = await check_fees(db_session, current_fees)
-    assert len(result) == 0
+    stores = {"mainnet": None, "testnet": None}
+    if with_store:
+        for network in stores:
+            stores[network] = SubscriptionStore()
+            await stores[network].load(db_session, network=network)
+
+    for network in stores:
+        await check_fees(db_session, {"BTC": {"LN": 5000}}, stores[network], network)
+
+    # the previous fees of one network do not count as those of another
+    assert (
+        await check_fees(
+            db_session, {"BTC": {"LN": 1000}}, stores["testnet"], "testnet"
+        )
+        == 1
+    )
+    entries = (await db_session.execute(select(Outbox))).scalars().all()
+    assert [(e.subscription_id, e.network) for e in entries] == [
+        (subscriptions[1].id, "testnet")
+    ]
+    assert await queued(db_session) == [subscriptions[1].id]
+    assert await get_previous(db_session, ALL_FEES) == {"BTC": {"LN": 5000}}
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_stream_crossings(db_session: AsyncSession, monkeypatch):
+    await db_session.execute(delete(PreviousFee))
+    await db_session.execute(delete(Subscription))
+    await db_session.execute(delete(Outbox))
+    db_session.add_all(
+        Subscription(chat_id=chat_id, from_asset="LN", to_asset="BTC", fee_threshold=t)
+        for chat_id, t in [(333, 3000), (111, 2000), (222, 2500), (111, 4000)]
+    )
+    await db_session.commit()
+    db_session.expunge_all()
+
+    current, previous = {"LN": {"BTC": 1000}}, {"LN": {"BTC": 5000}}
+    crossed = [
+        subscription.chat_id
+        async for subscription in stream_crossings(
+            db_session, current, previous, changed_pairs(current, previous)
+        )
+    ]
+    # ordered by chat, and the rows are not kept in the session
+    assert crossed == [111, 111, 222, 333]
+    assert len(db_session.identity_map) == 0
+
+    # every batch is committed and handed to delivery while the scan goes on
+    monkeypatch.setattr("bot.STREAM_BATCH", 3)
+    wakes = []
+    await check_fees(db_session, previous)
+    assert await check_fees(db_session, current, wake=lambda: wakes.append(1)) == 4
+    assert len(wakes) == 2
+    assert len(await queued(db_session)) == 4
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_check_fees_outage(db_session: AsyncSession):
+    await db_session.execute(delete(PreviousFee))
+    await db_session.execute(delete(Subscription))
+    await db_session.execute(delete(Outbox))
+    db_session.add(
+        Subscription(chat_id=1, from_asset="LN", to_asset="BTC", fee_threshold=3000)
+    )
+    await db_session.commit()
+    await check_fees(db_session, {"LN": {"BTC": 5000}, "BTC": {"LN": 1000}})
+
+    # the swap type of LN -> BTC failed, its threshold was crossed meanwhile
+    await check_fees(db_session, {"BTC": {"LN": 2000}})
+    assert await get_previous(db_session, ALL_FEES) == {
+        "LN": {"BTC": 5000},
+        "BTC": {"LN": 2000},
+    }
+    assert await check_fees(db_session, {"LN": {"BTC": 1000}, "BTC": {"LN": 2000}}) == 1
+
+
+class FailingBot:
+    def __init__(self, error: Exception):
+        self.error = error
+
+    async def send_message(self, **_):
+        raise self.error
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "error, retried",
+    [
+        (TimedOut(), True),
+        (NetworkError("connection reset"), True),
+        (Forbidden("bot was blocked by the user"), False),
+        (BadRequest("chat not found"), False),
+    ],
+)
+async def test_notify_chat_errors(error, retried):
+    digest = Digest(1, ["Fees for BTC -> LN have reached 0.1%"])
+    if retried:
+        assert await notify_chat(FailingBot(error), digest) is False
+    else:
+        with pytest.raises(Undeliverable):
+            await notify_chat(FailingBot(error), digest)
+
+
+class JobQueue:
+    def __init__(self):
+        self.scheduled = []
+
+    def run_once(self, callback, when):
+        self.scheduled.append(when)
+
+
+def failing_monitor(error: Exception) -> NetworkMonitor:
+    async def fetch():
+        await asyncio.sleep(0.02)
+        raise error
+
+    async def evaluate(_):
+        pass
+
+    monitor = object.__new__(NetworkMonitor)
+    monitor.network = "testnet"
+    monitor.store = None
+    monitor.application = SimpleNamespace(job_queue=JobQueue())
+    monitor.polling = SimpleNamespace(interval=0.01)
+    monitor.flight = SingleFlight()
+    monitor.pipeline = MonitorPipeline(fetch, evaluate)
+    return monitor
+
+
+@pytest.mark.asyncio
+async def test_tick_failed():
+    monitor = failing_monitor(RuntimeError("Boltz is down"))
+    ticks, overruns = TICK_SECONDS.count(), TICK_OVERRUNS.get()
+    with pytest.raises(RuntimeError):
+        await monitor.tick()
+    # a failed tick is still timed and schedules the next one
+    assert TICK_SECONDS.count() == ticks + 1
+    assert TICK_OVERRUNS.get() == overruns + 1
+    assert monitor.application.job_queue.scheduled == [0]
+
 
-    current_fees = {"BTC": {"LN": 0.8}}
-    result = await check_fees(db_session, current_fees)
-    assert result[0].id == subscriptions[0].id, "Failed to check fees"
+@pytest.mark.asyncio
+async def test_start_failed(caplog):
+    error = ExceptionGroup("Could not fetch any fees", [ConnectionError()])
+    monitor = failing_monitor(error)
+    # an unreachable API at boot only affects its own network
+    await monitor.start()
+    monitor._evaluator.cancel()
+    assert monitor.application.job_queue.scheduled == [0]
+    assert "First monitor tick of testnet failed" in caplog.text
@@ -0,0 +1,51 @@
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import (
+    Subscription,
+    add_subscription,
+    get_previous,
+    get_subscriptions,
+    update_subscription,
+    upsert_previous,
+)
+from store import SubscriptionStore
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_duplicate_subscriptions(db_session: AsyncSession):
+    store = SubscriptionStore()
+
+    def subscription(threshold: float) -> Subscription:
+        return Subscription(
+            chat_id=789, from_asset="BTC", to_asset="LN", fee_threshold=threshold
+        )
+
+    assert await add_subscription(db_session, subscription(1000), store)
+    assert not await add_subscription(db_session, subscription(1000), store)
+    other = subscription(2000)
+    assert await add_subscription(db_session, other, store)
+
+    other.fee_threshold = 1000
+    assert not await update_subscription(db_session, other, store)
+    subscriptions = await get_subscriptions(db_session, 789)
+    assert sorted(sub.fee_threshold for sub in subscriptions) == [1000, 2000]
+    assert len(store) == 2
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_previous(db_session: AsyncSession):
+    key = "test_previous"
+    assert await get_previous(db_session, key) is None
+
+    fees = {"BTC": {"LN": 1000, "L-BTC": 2000}, "LN": {"BTC": 3000}}
+    await upsert_previous(db_session, key, fees)
+    assert await get_previous(db_session, key) == fees
+
+    # only the given pairs are written, and those that were not fetched are kept
+    current = {"BTC": {"LN": 1500, "L-BTC": 2500}}
+    await upsert_previous(db_session, key, current, [("BTC", "LN"), ("LN", "BTC")])
+    assert await get_previous(db_session, key) == {
+        "BTC": {"LN": 1500, "L-BTC": 2000},
+        "LN": {"BTC": 3000},
+    }
@@ -0,0 +1,67 @@
+from telegram.constants import MessageLimit
+
+from db import Outbox, Subscription
+from digest import build_digests, notification_text, outbox_digests
+
+
+def subscription(chat_id: int, from_asset: str, to_asset: str, threshold: float):
+    return Subscription(
+        chat_id=chat_id,
+        from_asset=from_asset,
+        to_asset=to_asset,
+        fee_threshold=threshold,
+    )
+
+
+def test_build_digests():
+    fees = {"BTC": {"LN": 500}, "LN": {"BTC": 2000}}
+    subscriptions = [
+        subscription(1, "BTC", "LN", 1000),
+        subscription(2, "BTC", "LN", 1000),
+        subscription(1, "LN", "BTC", 1000),
+    ]
+    digests = build_digests(subscriptions, fees)
+
+    assert [digest.chat_id for digest in digests] == [1, 2]
+    assert digests[0].text == (
+        "Fees for BTC -> LN have reached 0.1% (now 0.05%): "
+        "https://pro.boltz.exchange?sendAsset=BTC&receiveAsset=LN\n\n"
+        "Fees for LN -> BTC are above 0.1% again (now 0.2%): "
+        "https://pro.boltz.exchange?sendAsset=LN&receiveAsset=BTC"
+    )
+    assert digests[1].lines == digests[0].lines[:1]
+
+
+def test_build_digests_split():
+    fees = {"BTC": {"LN": 500}}
+    subscriptions = [subscription(1, "BTC", "LN", 1000 + 10000 * i) for i in range(100)]
+    digests = build_digests(subscriptions, fees)
+
+    assert len(digests) > 1
+    assert all(len(d.text) <= MessageLimit.MAX_TEXT_LENGTH for d in digests)
+    assert sum(len(d.lines) for d in digests) == 100
+    assert all(len(d.text) == d.length for d in digests)
+
+
+def test_outbox_digests():
+    entries = [
+        Outbox(
+            id=i,
+            chat_id=chat_id,
+            from_asset="BTC",
+            to_asset="LN",
+            fee_threshold=t,
+            fee=500,
+        )
+        for i, (chat_id, t) in enumerate([(1, 1000), (2, 1000), (1, 2000)])
+    ]
+    digests = outbox_digests(entries)
+
+    assert [(d.chat_id, d.ids) for d in digests] == [(1, [0, 2]), (2, [1])]
+    assert digests[0].lines[0] == notification_text(entries[0], 500, None)
+
+
+def test_build_digests_network():
+    fees = {"BTC": {"LN": 500}}
+    digests = build_digests([subscription(1, "BTC", "LN", 1000)], fees, "testnet")
+    assert digests[0].text.startswith("Fees for BTC -> LN on testnet have reached")
@@ -0,0 +1,147 @@
+import asyncio
+import time
+from dataclasses import dataclass
+
+import pytest
+from telegram.error import RetryAfter
+
+from dispatcher import NotificationDispatcher, TokenBucket
+
+
+@dataclass
+class Notification:
+    chat_id: int
+    index: int
+
+
+class Recorder:
+    def __init__(self, fail: set[int] = frozenset(), retry_after: set[int] = ()):
+        self.fail = fail
+        self.retry_after = set(retry_after)
+        self.sent: list[tuple[float, Notification]] = []
+
+    async def send(self, notification: Notification) -> bool:
+        if notification.index in self.retry_after:
+            self.retry_after.remove(notification.index)
+            raise RetryAfter(1)
+        self.sent.append((time.monotonic(), notification))
+        return notification.index not in self.fail
+
+
+@pytest.mark.asyncio
+async def test_token_bucket():
+    bucket = TokenBucket(rate=100, capacity=10)
+    start = time.monotonic()
+    for _ in range(30):
+        await bucket.acquire()
+    elapsed = time.monotonic() - start
+    assert 0.2 - 0.02 <= elapsed < 0.4
+
+
+@pytest.mark.asyncio
+async def test_dispatch_global_rate():
+    dispatcher = NotificationDispatcher(rate=50, chat_interval=0)
+    recorder = Recorder(fail={3})
+    notifications = [Notification(chat_id=i, index=i) for i in range(100)]
+
+    start = time.monotonic()
+    await dispatcher.dispatch(notifications, recorder.send)
+    elapsed = time.monotonic() - start
+
+    assert len(recorder.sent) == 100
+    # the first 50 messages are the burst capacity of the bucket
+    assert elapsed >= 1 - 0.05
+    assert dispatcher.sent == 99
+    assert dispatcher.failed == 1
+    assert dispatcher.queue_depth == 0
+
+
+@pytest.mark.asyncio
+async def test_dispatch_chat_interval():
+    dispatcher = NotificationDispatcher(rate=1000, chat_interval=0.1)
+    recorder = Recorder()
+    notifications = [Notification(chat_id=i % 2, index=i) for i in range(10)] + [
+        Notification(chat_id=2, index=10)
+    ]
+
+    await dispatcher.dispatch(notifications, recorder.send)
+
+    assert [n.index for _, n in recorder.sent if n.chat_id == 0] == [0, 2, 4, 6, 8]
+    for chat_id in (0, 1):
+        times = [sent for sent, n in recorder.sent if n.chat_id == chat_id]
+        assert all(b - a >= 0.1 - 0.01 for a, b in zip(times, times[1:]))
+    # other chats are not held back by busy ones
+    assert any(n.chat_id == 2 for _, n in recorder.sent[:3])
+
+
+@pytest.mark.asyncio
+async def test_dispatch_chat_interval_drained():
+    dispatcher = NotificationDispatcher(rate=1000, chat_interval=0.1)
+    recorder = Recorder()
+
+    async def stream():
+        yield Notification(chat_id=1, index=0)
+        # the first one is sent and the queue of the chat is empty again
+        await asyncio.sleep(0.02)
+        yield Notification(chat_id=1, index=1)
+
+    await dispatcher.dispatch(stream(), recorder.send)
+    await dispatcher.dispatch([Notification(chat_id=1, index=2)], recorder.send)
+
+    times = [sent for sent, _ in recorder.sent]
+    assert len(times) == 3
+    assert all(b - a >= 0.1 - 0.01 for a, b in zip(times, times[1:]))
+
+
+@pytest.mark.asyncio
+async def test_dispatch_retry_after():
+    dispatcher = NotificationDispatcher(rate=1000, chat_interval=0)
+    recorder = Recorder(retry_after={0})
+
+    start = time.monotonic()
+    await dispatcher.dispatch(
+        [Notification(chat_id=1, index=0), Notification(chat_id=2, index=1)],
+        recorder.send,
+    )
+
+    assert sorted(n.index for _, n in recorder.sent) == [0, 1]
+    sent_at = {n.index: sent - start for sent, n in recorder.sent}
+    assert sent_at[0] >= 1 - 0.05
+    assert dispatcher.sent == 2
+
+
+@pytest.mark.asyncio
+async def test_dispatch_stream():
+    dispatcher = NotificationDispatcher(rate=1000, chat_interval=0)
+    recorder = Recorder()
+    first_sent = asyncio.Event()
+
+    async def send(notification: Notification) -> bool:
+        first_sent.set()
+        return await recorder.send(notification)
+
+    async def notifications():
+        yield Notification(chat_id=1, index=0)
+        # the rest only arrives once the first one was delivered
+        await asyncio.wait_for(first_sent.wait(), 1)
+        yield Notification(chat_id=1, index=1)
+        yield Notification(chat_id=2, index=2)
+
+    await dispatcher.dispatch(notifications(), send)
+
+    assert [n.index for _, n in recorder.sent] == [0, 1, 2]
+    assert dispatcher.queue_depth == 0
+
+
+@pytest.mark.asyncio
+async def test_dispatch_stream_error():
+    dispatcher = NotificationDispatcher(rate=1000, chat_interval=0)
+    recorder = Recorder()
+
+    async def notifications():
+        yield Notification(chat_id=1, index=0)
+        raise RuntimeError("query failed")
+
+    with pytest.raises(RuntimeError):
+        await dispatcher.dispatch(notifications(), recorder.send)
+    assert [n.index for _, n in recorder.sent] == [0]
@@ -0,0 +1,38 @@
+import pytest
+
+from fixed import format_fee, parse_threshold, to_units
+
+
+@pytest.mark.parametrize(
+    "percentage, expected",
+    [(0.1, 1000), (0.25, 2500), (-0.15, -1500), (1, 10000), (0.1 + 0.2, 3000)],
+)
+def test_to_units(percentage, expected):
+    assert to_units(percentage) == expected
+
+
+@pytest.mark.parametrize("percentage", [0.12345, "0.00004", -0.10001])
+def test_to_units_inexact(percentage):
+    with pytest.raises(ValueError):
+        to_units(percentage)
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [("0.05", 500), ("-0.1%", -1000), (" 1 ", 10000), ("0.0001", 1), ("1e-2", 100)],
+)
+def test_parse_threshold(text, expected):
+    assert parse_threshold(text) == expected
+    assert parse_threshold(format_fee(expected)) == expected
+
+
+@pytest.mark.parametrize("text", ["abc", "nan", "inf", "0.00001", ""])
+def test_parse_threshold_invalid(text):
+    with pytest.raises(ValueError):
+        parse_threshold(text)
+
+
+def test_threshold_equals_fee():
+    # the API fee and the threshold typed by the user meet exactly
+    assert to_units(0.1 + 0.2) == parse_threshold("0.3")
+    assert format_fee(to_units(0.1 + 0.2)) == "0.3"
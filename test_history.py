@@ -0,0 +1,85 @@
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from db import FeeHistory, FeeHistoryHourly, rollup_fee_history
+import history
+from history import HistoryWriter
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_history_writer(db_session: AsyncSession, monkeypatch):
+    await db_session.execute(delete(FeeHistory))
+    await db_session.commit()
+    session_maker = async_sessionmaker(db_session.bind, expire_on_commit=False)
+    writer = HistoryWriter(session_maker)
+
+    inserts = []
+    add_fee_history = history.add_fee_history
+
+    async def counted_insert(session, samples, network):
+        inserts.append(samples)
+        await add_fee_history(session, samples, network)
+
+    monkeypatch.setattr(history, "add_fee_history", counted_insert)
+
+    start = datetime(2026, 1, 1, tzinfo=UTC)
+    writer.record({"BTC": {"LN": 1000, "L-BTC": 2000}}, start)
+    writer.record({"BTC": {"LN": 1000, "L-BTC": 3000}}, start + timedelta(minutes=1))
+    writer.record({"BTC": {"LN": 1000}}, start + timedelta(minutes=2))
+    await writer.flush()
+    writer.record({"BTC": {"LN": 500}}, start + timedelta(minutes=3))
+    await writer.flush()
+
+    # the second tick is batched with the first one, the third did not change
+    assert [len(samples) for samples in inserts] == [3, 1]
+    rows = (
+        await db_session.execute(
+            select(FeeHistory.to_asset, FeeHistory.time, FeeHistory.fee).order_by(
+                FeeHistory.time, FeeHistory.to_asset
+            )
+        )
+    ).all()
+    assert [(to_asset, fee) for to_asset, _, fee in rows] == [
+        ("L-BTC", 2000),
+        ("LN", 1000),
+        ("L-BTC", 3000),
+        ("LN", 500),
+    ]
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_rollup(db_session: AsyncSession):
+    await db_session.execute(delete(FeeHistory))
+    await db_session.execute(delete(FeeHistoryHourly))
+    start = datetime(2026, 1, 1, tzinfo=UTC)
+    fees = [1000, 3000, 2000, 4000]
+    db_session.add_all(
+        FeeHistory(
+            from_asset="BTC",
+            to_asset="LN",
+            time=start + timedelta(minutes=20 * i),
+            fee=fee,
+        )
+        for i, fee in enumerate(fees)
+    )
+    await db_session.commit()
+
+    # the first run splits the first hour, the second one merges the rest into it
+    assert await rollup_fee_history(db_session, start + timedelta(minutes=30)) == 2
+    assert await rollup_fee_history(db_session, start + timedelta(hours=2)) == 2
+
+    hourly = (
+        await db_session.execute(
+            select(FeeHistoryHourly).order_by(FeeHistoryHourly.hour)
+        )
+    ).scalars()
+    assert [
+        (row.hour, row.min_fee, row.max_fee, row.avg_fee, row.samples) for row in hourly
+    ] == [
+        (start, 1000, 3000, pytest.approx(2000), 3),
+        (start + timedelta(hours=1), 4000, 4000, 4000, 1),
+    ]
+    assert (await db_session.execute(select(FeeHistory))).first() is None
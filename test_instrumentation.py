@@ -0,0 +1,68 @@
+import asyncio
+import logging
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from telegram.ext import CommandHandler, ConversationHandler, MessageHandler, filters
+from telegram.request import BaseRequest
+
+from instrumentation import InstrumentedRequest, instrument, instrument_engine
+from metrics import HANDLER_API_SECONDS, HANDLER_DB_SECONDS, HANDLER_SECONDS
+
+
+class SlowTelegram(BaseRequest):
+    @property
+    def read_timeout(self) -> float | None:
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, *_, **__) -> tuple[int, bytes]:
+        await asyncio.sleep(0.05)
+        return 200, b'{"ok": true, "result": true}'
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_instrument(test_db_url: str, caplog):
+    engine = create_async_engine(test_db_url)
+    instrument_engine(engine)
+    request = InstrumentedRequest(SlowTelegram())
+
+    async def entry(_update, _context):
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT pg_sleep(0.05)"))
+            await conn.execute(text("SELECT 1"))
+        return 1
+
+    async def pick(_update, _context):
+        await request.do_request("https://api.telegram.org/bot1:x/sendMessage", "POST")
+        return ConversationHandler.END
+
+    entry_point = CommandHandler("pairs", entry)
+    conversation = ConversationHandler(
+        entry_points=[entry_point],
+        states={1: [MessageHandler(filters.TEXT, pick)]},
+        fallbacks=[entry_point],
+    )
+    instrument(conversation, slow_threshold=0.04)
+    # the entry point is wrapped once even though it is also the fallback
+    assert entry_point.callback.__wrapped__ is entry
+
+    with caplog.at_level(logging.WARNING):
+        assert await entry_point.callback(None, None) == 1
+        await conversation.states[1][0].callback(None, None)
+    await engine.dispose()
+
+    labels = {"handler": "pairs", "state": "entry"}
+    assert HANDLER_SECONDS.count(**labels) == 1
+    assert HANDLER_DB_SECONDS.values[("pairs", "entry")][1][0] >= 0.05
+    assert HANDLER_API_SECONDS.values[("pairs", "entry")][1][0] == 0
+    assert HANDLER_API_SECONDS.values[("pairs", "pick")][1][0] >= 0.05
+    assert "Slow update in pairs/entry" in caplog.text
+    assert "in 2 queries" in caplog.text
+    assert "in 1 calls" in caplog.text
@@ -0,0 +1,78 @@
+import httpx
+import pytest
+
+from metrics import (
+    Counter,
+    Gauge,
+    Histogram,
+    Metric,
+    REGISTRY,
+    render,
+    start_metrics_server,
+)
+
+
+@pytest.fixture
+def registry():
+    registered = list(REGISTRY)
+    REGISTRY.clear()
+    yield REGISTRY
+    REGISTRY[:] = registered
+
+
+def test_render(registry):
+    counter = Counter("requests_total", "Requests", ("swap_type",))
+    counter.inc(swap_type="chain")
+    counter.inc(2, swap_type="chain")
+    counter.inc(swap_type='sub"marine')
+    gauge = Gauge("depth", "Queue depth")
+    gauge.set(5)
+    histogram = Histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    assert render() == "\n".join(
+        [
+            "# HELP requests_total Requests",
+            "# TYPE requests_total counter",
+            'requests_total{swap_type="chain"} 3.0',
+            'requests_total{swap_type="sub\\"marine"} 1.0',
+            "# HELP depth Queue depth",
+            "# TYPE depth gauge",
+            "depth 5.0",
+            "# HELP latency_seconds Latency",
+            "# TYPE latency_seconds histogram",
+            'latency_seconds_bucket{le="0.1"} 1',
+            'latency_seconds_bucket{le="1.0"} 2',
+            'latency_seconds_bucket{le="+Inf"} 3',
+            "latency_seconds_sum 5.55",
+            "latency_seconds_count 3",
+            "",
+        ]
+    )
+
+
+def test_metric_abstract(registry):
+    class Untyped(Metric):
+        pass
+
+    with pytest.raises(TypeError):
+        Untyped("untyped", "Untyped")
+    assert not registry
+
+
+@pytest.mark.asyncio
+async def test_metrics_server(registry):
+    Counter("ticks_total", "Ticks").inc()
+    server = await start_metrics_server("127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as client:
+            response = await client.get("/metrics")
+            assert response.status_code == 200
+            assert "ticks_total 1.0" in response.text
+            assert (await client.get("/")).status_code == 404
+    finally:
+        server.close()
+        await server.wait_closed()
@@ -0,0 +1,260 @@
+import asyncio
+
+import pytest
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from bot import check_fees
+from db import Outbox, PreviousFee, Subscription, add_outbox, claim_outbox
+from dispatcher import NotificationDispatcher
+from metrics import (
+    OUTBOX_AGE,
+    OUTBOX_DELIVERED,
+    OUTBOX_DROPPED,
+    OUTBOX_ENTRIES,
+    OUTBOX_SUPERSEDED,
+)
+from outbox import OutboxDelivery, Undeliverable
+
+FEES = {"BTC": {"LN": 500}}
+CROSSED_BACK = {"BTC": {"LN": 1500}}
+
+
+def subscription(id: int, chat_id: int) -> Subscription:
+    return Subscription(
+        id=id,
+        chat_id=chat_id,
+        from_asset="BTC",
+        to_asset="LN",
+        fee_threshold=1000,
+    )
+
+
+async def queue(session: AsyncSession, chat_ids: list[int]):
+    await session.execute(delete(Outbox))
+    await add_outbox(
+        session,
+        [subscription(i, chat_id) for i, chat_id in enumerate(chat_ids)],
+        FEES,
+    )
+    await session.commit()
+
+
+async def pending(session: AsyncSession) -> list[Outbox]:
+    session.expunge_all()
+    result = await session.execute(select(Outbox).order_by(Outbox.id))
+    return list(result.scalars())
+
+
+def delivery(session: AsyncSession, send, **kwargs) -> OutboxDelivery:
+    return OutboxDelivery(
+        async_sessionmaker(session.bind, expire_on_commit=False),
+        NotificationDispatcher(rate=1000, chat_interval=0),
+        send,
+        **kwargs,
+    )
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_deliver(db_session: AsyncSession):
+    await queue(db_session, [1, 2, 1])
+    sent = []
+
+    async def send(digest):
+        sent.append((digest.chat_id, len(digest.lines)))
+        return digest.chat_id != 2
+
+    delivered = OUTBOX_DELIVERED.get()
+    outbox = delivery(db_session, send, backoff=60)
+    assert await outbox.deliver() == 3
+    assert sorted(sent) == [(1, 2), (2, 1)]
+    assert OUTBOX_DELIVERED.get() == delivered + 2
+
+    # the failed entry waits for its backoff
+    [entry] = await pending(db_session)
+    assert (entry.chat_id, entry.attempts) == (2, 1)
+    assert entry.next_attempt_at > entry.created_at
+    assert OUTBOX_ENTRIES.get() == 1
+    assert OUTBOX_AGE.get() >= 0
+    assert await outbox.deliver() == 0
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_max_attempts(db_session: AsyncSession):
+    await queue(db_session, [1])
+
+    async def send(_):
+        return False
+
+    dropped = OUTBOX_DROPPED.get()
+    outbox = delivery(db_session, send, backoff=0, max_attempts=2)
+    assert await outbox.deliver() == 1
+    assert [entry.attempts for entry in await pending(db_session)] == [1]
+    assert await outbox.deliver() == 1
+    assert await pending(db_session) == []
+    assert OUTBOX_DROPPED.get() == dropped + 1
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_undeliverable(db_session: AsyncSession):
+    await queue(db_session, [1, 2])
+
+    async def send(digest):
+        if digest.chat_id == 2:
+            raise Undeliverable("bot was blocked by the user")
+        return False
+
+    # only the failure that can go away is retried
+    dropped = OUTBOX_DROPPED.get()
+    assert await delivery(db_session, send).deliver() == 2
+    assert [entry.chat_id for entry in await pending(db_session)] == [1]
+    assert OUTBOX_DROPPED.get() == dropped + 1
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_lease(db_session: AsyncSession):
+    await queue(db_session, [1, 2])
+
+    async def crash(_):
+        raise RuntimeError("process died while sending")
+
+    # claimed entries are neither lost nor sent twice while the lease lasts
+    await delivery(db_session, crash).deliver()
+    assert len(await pending(db_session)) == 2
+    sent = []
+
+    async def send(digest):
+        sent.append(digest.chat_id)
+        return True
+
+    outbox = delivery(db_session, send)
+    assert await outbox.deliver() == 0
+
+    await db_session.execute(update(Outbox).values(next_attempt_at=Outbox.created_at))
+    await db_session.commit()
+    assert await outbox.deliver() == 2
+    assert sorted(sent) == [1, 2]
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_shards_and_batches(db_session: AsyncSession):
+    await queue(db_session, [-1, 1, 2, 3, 4, 5])
+    sent = []
+
+    async def send(digest):
+        sent.append(digest.chat_id)
+        return True
+
+    outbox = delivery(db_session, send, shard=(1, 2), batch=2)
+    task = asyncio.create_task(outbox.run())
+    try:
+        for _ in range(50):
+            if len(sent) == 4:
+                break
+            await asyncio.sleep(0.05)
+    finally:
+        task.cancel()
+    assert sorted(sent) == [-1, 1, 3, 5]
+    assert sorted(entry.chat_id for entry in await pending(db_session)) == [2, 4]
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_supersede(db_session: AsyncSession):
+    await queue(db_session, [1, 2])
+    superseded = OUTBOX_SUPERSEDED.get()
+
+    # a crossing that is detected again is not queued twice
+    assert await add_outbox(db_session, [subscription(0, 1)], FEES) == 1
+    await db_session.commit()
+    assert [entry.subscription_id for entry in await pending(db_session)] == [0, 1]
+    assert OUTBOX_SUPERSEDED.get() == superseded
+
+    # the fee crossed back before the first crossing was sent
+    assert await add_outbox(db_session, [subscription(0, 1)], CROSSED_BACK) == 1
+    await db_session.commit()
+    assert [entry.subscription_id for entry in await pending(db_session)] == [1]
+    assert OUTBOX_SUPERSEDED.get() == superseded + 1
+
+    async def crash(_):
+        raise RuntimeError("process died while sending")
+
+    # a notification that is being sent can not be taken back anymore
+    await delivery(db_session, crash).deliver()
+    assert await add_outbox(db_session, [subscription(1, 2)], CROSSED_BACK) == 1
+    await db_session.commit()
+    assert [entry.subscription_id for entry in await pending(db_session)] == [1, 1]
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_current_fees(db_session: AsyncSession):
+    await queue(db_session, [1, 2])
+    await db_session.execute(
+        update(Outbox).where(Outbox.chat_id == 2).values(fee=4000, fee_threshold=3000)
+    )
+    await db_session.commit()
+    sent = []
+
+    async def send(digest):
+        sent.append((digest.chat_id, digest.text))
+        return True
+
+    # chat 1 is told about the latest fee, the fee of chat 2 is below 0.3% again
+    # and its notification waits for the evaluation of those fees
+    outbox = delivery(
+        db_session, send, current_fees=lambda network: {"BTC": {"LN": 700}}
+    )
+    assert await outbox.deliver() == 2
+    assert [chat_id for chat_id, _ in sent] == [1]
+    assert "have reached 0.1% (now 0.07%)" in sent[0][1]
+    [entry] = await pending(db_session)
+    assert (entry.chat_id, entry.claimed_at, entry.attempts) == (2, None, 0)
+
+
+@pytest.mark.asyncio(loop_scope="session")
+@pytest.mark.parametrize("evaluated_while_claimed", [False, True])
+async def test_crossed_back_before_evaluation(
+    db_session: AsyncSession, monkeypatch, evaluated_while_claimed
+):
+    await db_session.execute(delete(PreviousFee))
+    await db_session.execute(delete(Subscription))
+    await db_session.execute(delete(Outbox))
+    db_session.add(
+        Subscription(chat_id=1, from_asset="BTC", to_asset="LN", fee_threshold=1000)
+    )
+    await db_session.commit()
+    await check_fees(db_session, {"BTC": {"LN": 2000}})
+    assert await check_fees(db_session, {"BTC": {"LN": 500}}) == 1
+    session_maker = async_sessionmaker(db_session.bind, expire_on_commit=False)
+
+    async def evaluate_back():
+        async with session_maker() as session:
+            return await check_fees(session, {"BTC": {"LN": 2000}})
+
+    if evaluated_while_claimed:
+
+        async def claim_then_evaluate(*args):
+            entries = await claim_outbox(*args)
+            assert await evaluate_back() == 1
+            return entries
+
+        monkeypatch.setattr("outbox.claim_outbox", claim_then_evaluate)
+    sent = []
+
+    async def send(digest):
+        sent.append(digest.text)
+        return True
+
+    # the fees are back above the threshold, but have not been evaluated yet
+    superseded = OUTBOX_SUPERSEDED.get()
+    outbox = delivery(
+        db_session, send, current_fees=lambda network: {"BTC": {"LN": 2000}}
+    )
+    assert await outbox.deliver() == 1
+    if not evaluated_while_claimed:
+        assert len(await pending(db_session)) == 1
+        assert await evaluate_back() == 1
+
+    # neither the crossing nor the crossing back is sent
+    assert await pending(db_session) == []
+    assert OUTBOX_SUPERSEDED.get() == superseded + 1
+    assert sent == []
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from metrics import PIPELINE_STAGE_SECONDS, SNAPSHOTS_SUPERSEDED
+from pipeline import MonitorPipeline
+
+
+@pytest.mark.asyncio
+async def test_pipeline():
+    ticks = iter(range(100))
+    evaluated = []
+    release = asyncio.Event()
+
+    async def fetch():
+        return {"BTC": {"LN": next(ticks)}}
+
+    async def evaluate(fees):
+        await release.wait()
+        evaluated.append(fees["BTC"]["LN"])
+
+    pipeline = MonitorPipeline(fetch, evaluate)
+    evaluator = asyncio.create_task(pipeline.run_evaluator())
+    superseded = SNAPSHOTS_SUPERSEDED.get()
+    try:
+        # fetching goes on while the first fees are still evaluated
+        await pipeline.fetch()
+        await asyncio.sleep(0)
+        for _ in range(3):
+            await asyncio.wait_for(pipeline.fetch(), 0.1)
+        assert SNAPSHOTS_SUPERSEDED.get() == superseded + 2
+
+        release.set()
+        for _ in range(20):
+            if len(evaluated) == 2:
+                break
+            await asyncio.sleep(0.01)
+        # only the latest of the fees that waited is evaluated
+        assert evaluated == [0, 3]
+    finally:
+        evaluator.cancel()
+    assert PIPELINE_STAGE_SECONDS.count(stage="fetch") >= 4
+    assert PIPELINE_STAGE_SECONDS.count(stage="evaluate") >= 2
+
+
+@pytest.mark.asyncio
+async def test_pipeline_evaluation_error(caplog):
+    async def fetch():
+        return {}
+
+    async def evaluate(_):
+        raise RuntimeError("database is gone")
+
+    pipeline = MonitorPipeline(fetch, evaluate)
+    evaluator = asyncio.create_task(pipeline.run_evaluator())
+    try:
+        for _ in range(2):
+            await pipeline.fetch()
+            await asyncio.sleep(0.01)
+        assert not evaluator.done()
+        assert caplog.text.count("database is gone") == 2
+    finally:
+        evaluator.cancel()
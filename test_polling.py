@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from db import Subscription
+from metrics import MONITOR_INTERVAL, TICK_COALESCED, TICK_TIMEOUTS
+from polling import AdaptiveInterval, SingleFlight, count_near, near_ranges
+from store import SubscriptionStore
+from utils import changed_pairs
+
+
+def test_near_ranges():
+    current = {"BTC": {"LN": 2500, "RBTC": 1000}, "LN": {"BTC": 1000}}
+    previous = {"BTC": {"LN": 5000, "RBTC": 1000}}
+    pairs = changed_pairs(current, previous)
+    assert list(near_ranges(current, previous, pairs)) == [("BTC", "LN", 0, 5000)]
+
+
+@pytest.mark.asyncio
+async def test_adaptive_interval():
+    near = 0
+
+    async def count(ranges):
+        assert ranges
+        return near
+
+    polling = AdaptiveInterval(10, 300, 60)
+    flat = {"BTC": {"LN": 1000}}
+    assert await polling.observe(flat, count) == 60
+    assert await polling.observe(flat, count) == 90
+    for _ in range(10):
+        await polling.observe(flat, count)
+    assert polling.interval == 300
+
+    # a move far from every threshold does not speed polling up
+    assert await polling.observe({"BTC": {"LN": 2000}}, count) == 300
+    near = 5
+    assert await polling.observe({"BTC": {"LN": 1000}}, count) == 150
+    for fee in (2000, 1000, 2000, 1000, 2000):
+        await polling.observe({"BTC": {"LN": fee}}, count)
+    assert polling.interval == 10
+    assert MONITOR_INTERVAL.get(network="mainnet") == 10
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_count_near(db_session: AsyncSession):
+    await db_session.execute(delete(Subscription))
+    db_session.add_all(
+        Subscription(chat_id=1, from_asset="BTC", to_asset="LN", fee_threshold=t)
+        for t in (-1000, 500, 1000, 3000)
+    )
+    await db_session.commit()
+    store = SubscriptionStore()
+    await store.load(db_session)
+    session_maker = async_sessionmaker(db_session.bind)
+
+    for current, previous, expected in [
+        (1200, 700, 1),
+        (700, 1200, 2),
+        (2200, 1200, 1),
+        (0, -5000, 4),
+        (5000, 4500, 0),
+    ]:
+        current_fees, previous_fees = (
+            {"BTC": {"LN": current}},
+            {"BTC": {"LN": previous}},
+        )
+        ranges = list(near_ranges(current_fees, previous_fees, {("BTC", "LN")}))
+        assert await count_near(session_maker, ranges) == expected
+        assert await count_near(session_maker, ranges, store) == expected
+
+
+@pytest.mark.asyncio
+async def test_single_flight():
+    flight = SingleFlight()
+    running = 0
+    ticks = []
+
+    async def tick():
+        nonlocal running
+        running += 1
+        assert running == 1
+        await asyncio.sleep(0.05)
+        ticks.append(running)
+        running -= 1
+
+    coalesced = TICK_COALESCED.get()
+    results = await asyncio.gather(*(flight.run(tick) for _ in range(5)))
+    # the four requests made during the first tick run once more after it
+    assert results == [True, False, False, False, False]
+    assert len(ticks) == 2
+    assert TICK_COALESCED.get() == coalesced + 4
+
+
+@pytest.mark.asyncio
+async def test_single_flight_deadline():
+    flight = SingleFlight(deadline=0.05)
+
+    async def slow():
+        await asyncio.sleep(1)
+
+    timeouts = TICK_TIMEOUTS.get()
+    assert await flight.run(slow)
+    assert TICK_TIMEOUTS.get() == timeouts + 1
+
+    async def failing():
+        raise TimeoutError("from the tick itself")
+
+    with pytest.raises(TimeoutError):
+        await flight.run(failing)
+    assert TICK_TIMEOUTS.get() == timeouts + 1
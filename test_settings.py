@@ -0,0 +1,16 @@
+import pytest
+
+from settings import Settings
+
+REQUIRED = {
+    "database_url": "postgresql+asyncpg://localhost/fees",
+    "telegram_bot_token": "1:x",
+}
+
+
+@pytest.mark.parametrize(
+    "mode, expected",
+    [("standalone", "standalone"), ("commands", "commands"), ("polling", "commands")],
+)
+def test_mode(mode, expected):
+    assert Settings(**REQUIRED, mode=mode).mode == expected
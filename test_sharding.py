@@ -0,0 +1,326 @@
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+import pytest
+from sqlalchemy import delete, select, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from consts import ALL_FEES, SNAPSHOT_CHANNEL
+from db import (
+    Outbox,
+    PreviousFee,
+    Subscription,
+    add_subscription,
+    get_previous,
+    upsert_previous,
+)
+from dispatcher import NotificationDispatcher
+from polling import AdaptiveInterval
+import sharding
+from sharding import (
+    APPLICATION_NAME,
+    LEADER_LOCK,
+    ShardWorker,
+    listen_snapshots,
+    shard_of,
+)
+from snapshot import latest_fees
+from store import SubscriptionStore
+
+CHAT_IDS = [-1001, -7, -2, 3, 4, 5, 1000, 1001]
+FEES = [{"BTC": {"LN": 0}}, {"BTC": {"LN": 2000}}, {"BTC": {"LN": 1200}}]
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_load_shard(db_session: AsyncSession):
+    await db_session.execute(delete(Subscription))
+    for chat_id in CHAT_IDS:
+        db_session.add(
+            Subscription(
+                chat_id=chat_id, from_asset="BTC", to_asset="LN", fee_threshold=1000
+            )
+        )
+    await db_session.commit()
+
+    loaded = []
+    for index in range(3):
+        store = SubscriptionStore()
+        await store.load(db_session, (index, 3))
+        chat_ids = [sub.chat_id for sub in store.crossed(*FEES[:2], {("BTC", "LN")})]
+        assert all(shard_of(chat_id, 3) == index for chat_id in chat_ids)
+        loaded += chat_ids
+    assert sorted(loaded) == sorted(CHAT_IDS)
+
+
+# a worker process with the fees read from a file and sends written to stdout
+WORKER = """
+import asyncio, json, sys
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import sharding
+from dispatcher import NotificationDispatcher
+from polling import AdaptiveInterval
+
+database_url, fees_path, index, count = sys.argv[1:]
+sharding.RECONNECT_DELAY = 0.1
+
+
+async def fetch():
+    with open(fees_path) as f:
+        return json.load(f)
+
+
+async def send(digest):
+    print("sent", digest.chat_id, flush=True)
+    return True
+
+
+async def main():
+    engine = create_async_engine(database_url)
+    worker = sharding.ShardWorker(
+        database_url=database_url,
+        session_maker=async_sessionmaker(engine, expire_on_commit=False),
+        shard_index=int(index),
+        shard_count=int(count),
+        polling=AdaptiveInterval(0.05, 0.05, 0.05),
+        fetch=fetch,
+        send=send,
+        dispatcher=NotificationDispatcher(rate=1000, chat_interval=0),
+    )
+    task = asyncio.create_task(worker.run())
+    await worker.ready.wait()
+    print("ready", flush=True)
+    await task
+
+
+asyncio.run(main())
+"""
+
+
+async def wait_for(condition, timeout: float = 10):
+    for _ in range(int(timeout / 0.05)):
+        if await condition():
+            return
+        await asyncio.sleep(0.05)
+    raise TimeoutError("condition not met")
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_workers(db_session: AsyncSession, test_db_url: str, tmp_path):
+    await db_session.execute(delete(Subscription))
+    await db_session.execute(delete(PreviousFee))
+    await db_session.execute(delete(Outbox))
+    await db_session.commit()
+    for chat_id in CHAT_IDS:
+        db_session.add(
+            Subscription(
+                chat_id=chat_id, from_asset="BTC", to_asset="LN", fee_threshold=1000
+            )
+        )
+    await db_session.commit()
+
+    fees_path = tmp_path / "fees.json"
+    fees_path.write_text(json.dumps(FEES[0]))
+    processes = [
+        await asyncio.create_subprocess_exec(
+            sys.executable,
+            "-c",
+            WORKER,
+            test_db_url,
+            str(fees_path),
+            str(index),
+            "3",
+            stdout=asyncio.subprocess.PIPE,
+            cwd=Path(__file__).parent,
+        )
+        for index in range(3)
+    ]
+    sent: list[tuple[int, int]] = []
+    ready = [asyncio.Event() for _ in processes]
+
+    async def read(index: int, process: asyncio.subprocess.Process):
+        async for line in process.stdout:
+            kind, *values = line.decode().split()
+            if kind == "ready":
+                ready[index].set()
+            else:
+                sent.append((index, int(values[0])))
+
+    async def connections() -> tuple[int, int]:
+        # the listener and lock connections of all workers, and the leaders
+        result = await db_session.execute(
+            text(
+                "SELECT (SELECT count(*) FROM pg_stat_activity"
+                " WHERE application_name = :name),"
+                " (SELECT count(*) FROM pg_locks WHERE locktype = 'advisory'"
+                " AND granted AND (classid::bigint << 32 | objid::bigint) = :lock)"
+            ),
+            {"name": APPLICATION_NAME, "lock": LEADER_LOCK},
+        )
+        counts = tuple(result.one())
+        # the statistics are a snapshot for the whole transaction
+        await db_session.commit()
+        return counts
+
+    async def settled() -> bool:
+        return await connections() == (6, 1)
+
+    async def pids() -> set[int]:
+        result = await db_session.execute(
+            text("SELECT pid FROM pg_stat_activity WHERE application_name = :name"),
+            {"name": APPLICATION_NAME},
+        )
+        pids = set(result.scalars())
+        await db_session.commit()
+        return pids
+
+    readers = [
+        asyncio.create_task(read(index, process))
+        for index, process in enumerate(processes)
+    ]
+    try:
+        await asyncio.wait_for(asyncio.gather(*(e.wait() for e in ready)), 20)
+        await wait_for(lambda: get_previous(db_session, ALL_FEES))
+        await wait_for(settled)
+        fees_path.write_text(json.dumps(FEES[1]))
+
+        async def all_sent() -> bool:
+            return len(sent) == len(CHAT_IDS)
+
+        await wait_for(all_sent)
+        assert sorted(sent) == sorted(
+            (shard_of(chat_id, 3), chat_id) for chat_id in CHAT_IDS
+        )
+
+        # the subscription made by the polling process reaches the owning worker,
+        # also when all workers lose their connections and take them up again
+        async with async_sessionmaker(db_session.bind)() as session:
+            await add_subscription(
+                session,
+                Subscription(
+                    chat_id=6, from_asset="BTC", to_asset="LN", fee_threshold=1500
+                ),
+            )
+        terminated = await pids()
+        await db_session.execute(
+            text(
+                "SELECT pg_terminate_backend(pid) FROM unnest(CAST(:pids AS int[])) AS pid"
+            ),
+            {"pids": list(terminated)},
+        )
+        await db_session.commit()
+
+        async def reconnected() -> bool:
+            return not terminated & await pids() and await settled()
+
+        await wait_for(reconnected)
+
+        sent.clear()
+        fees_path.write_text(json.dumps(FEES[2]))
+
+        async def any_sent() -> bool:
+            return bool(sent)
+
+        await wait_for(any_sent)
+        await asyncio.sleep(0.2)
+        assert sent == [(0, 6)]
+    finally:
+        for process in processes:
+            process.terminate()
+        await asyncio.gather(*(process.wait() for process in processes))
+        await asyncio.gather(*readers, return_exceptions=True)
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_missed_snapshot(db_session: AsyncSession, test_db_url: str):
+    await db_session.execute(delete(Subscription))
+    await db_session.execute(delete(PreviousFee))
+    await db_session.execute(delete(Outbox))
+    db_session.add(
+        Subscription(chat_id=1, from_asset="BTC", to_asset="LN", fee_threshold=1000)
+    )
+    await db_session.commit()
+
+    def shard_worker() -> ShardWorker:
+        return ShardWorker(
+            database_url=test_db_url,
+            session_maker=async_sessionmaker(db_session.bind, expire_on_commit=False),
+            shard_index=0,
+            shard_count=1,
+            polling=AdaptiveInterval(0.05, 0.05, 0.05),
+            fetch=None,
+            send=None,
+            dispatcher=NotificationDispatcher(),
+        )
+
+    worker = shard_worker()
+    await worker.store.load(db_session, (0, 1))
+    await worker._evaluate({"BTC": {"LN": 2000}}, {"BTC": {"LN": 0}})
+    await db_session.execute(delete(Outbox))
+    await db_session.commit()
+
+    # the worker died and missed the snapshot that went from 2000 to 500, the next
+    # one is compared with the fees it evaluated last
+    worker = shard_worker()
+    await worker.store.load(db_session, (0, 1))
+    await worker._evaluate({"BTC": {"LN": 400}}, {"BTC": {"LN": 500}})
+    entries = (await db_session.execute(select(Outbox))).scalars().all()
+    assert [(entry.chat_id, entry.fee) for entry in entries] == [(1, 400)]
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_listen_snapshots(
+    db_session: AsyncSession, test_db_url: str, monkeypatch
+):
+    monkeypatch.setattr(sharding, "RECONNECT_DELAY", 0.1)
+    await db_session.execute(delete(PreviousFee))
+    await db_session.commit()
+    await upsert_previous(db_session, ALL_FEES, FEES[0])
+    bot_data = {}
+    listener = asyncio.create_task(
+        listen_snapshots(
+            test_db_url,
+            async_sessionmaker(db_session.bind, expire_on_commit=False),
+            bot_data,
+        )
+    )
+
+    def showing(fees):
+        async def condition() -> bool:
+            return latest_fees(bot_data) == fees
+
+        return condition
+
+    async def notify(fees):
+        payload = json.dumps({"current": fees})
+        await db_session.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": SNAPSHOT_CHANNEL, "payload": payload},
+        )
+        await db_session.commit()
+
+    try:
+        # starts with the stored fees and follows the snapshots
+        await wait_for(showing(FEES[0]))
+        await notify(FEES[1])
+        await wait_for(showing(FEES[1]))
+
+        # a lost connection is taken up again and catches up with the stored fees
+        await upsert_previous(db_session, ALL_FEES, FEES[2])
+        await db_session.execute(
+            text(
+                "SELECT pg_terminate_backend(pid) FROM pg_stat_activity"
+                " WHERE application_name = :name"
+            ),
+            {"name": APPLICATION_NAME},
+        )
+        await db_session.commit()
+        await wait_for(showing(FEES[2]))
+        await notify(FEES[0])
+        await wait_for(showing(FEES[0]))
+    finally:
+        listener.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
@@ -0,0 +1,44 @@
+import pytest
+
+from commands.subscribe import filter_fees
+from db import Subscription
+from snapshot import SNAPSHOT_KEY, latest_fees, publish_snapshot
+
+
+def test_publish_snapshot():
+    bot_data = {}
+    fees = {"BTC": {"LN": 1000}}
+    first = publish_snapshot(bot_data, fees)
+    assert first.version == 1
+    assert bot_data[SNAPSHOT_KEY] is first
+
+    fees["BTC"]["LN"] = 2000
+    assert first.fees["BTC"]["LN"] == 1000, "snapshot must not alias the fetched fees"
+    with pytest.raises(TypeError):
+        first.fees["BTC"]["LN"] = 3000
+
+    second = publish_snapshot(bot_data, fees)
+    assert second.version == 2
+    assert second.fees["BTC"]["LN"] == 2000
+
+
+def test_filter_fees():
+    snapshot = publish_snapshot(
+        {}, {"BTC": {"LN": 1000, "L-BTC": 1000}, "LN": {"BTC": 5000}}
+    )
+    subscriptions = [
+        Subscription(chat_id=1, from_asset="BTC", to_asset="LN", fee_threshold=0),
+        Subscription(chat_id=1, from_asset="LN", to_asset="BTC", fee_threshold=0),
+        Subscription(chat_id=1, from_asset="RBTC", to_asset="BTC", fee_threshold=0),
+    ]
+    assert filter_fees(snapshot.fees, subscriptions) == {"BTC": {"L-BTC": 1000}}
+    assert snapshot.fees == {"BTC": {"LN": 1000, "L-BTC": 1000}, "LN": {"BTC": 5000}}
+
+
+def test_snapshot_networks():
+    bot_data = {}
+    publish_snapshot(bot_data, {"BTC": {"LN": 1000}})
+    publish_snapshot(bot_data, {"BTC": {"LN": 2000}}, "testnet")
+    assert latest_fees(bot_data) == {"BTC": {"LN": 1000}}
+    assert latest_fees(bot_data, "testnet") == {"BTC": {"LN": 2000}}
+    assert latest_fees(bot_data, "regtest") is None
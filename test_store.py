@@ -0,0 +1,144 @@
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from bot import check_subscription
+from consts import DEFAULT_NETWORK
+from db import Subscription
+from metrics import SUBSCRIPTIONS
+from store import SubscriptionStore, record_pair_counts
+from utils import changed_pairs
+
+
+def subscription(id: int, threshold, chat_id: int = 1, pair=("BTC", "LN")):
+    return Subscription(
+        id=id,
+        chat_id=chat_id,
+        from_asset=pair[0],
+        to_asset=pair[1],
+        fee_threshold=threshold,
+    )
+
+
+@pytest.mark.parametrize(
+    "current, previous",
+    [
+        (12000, 10000),
+        (8000, 12000),
+        (12000, 8000),
+        (8000, 10000),
+        (15000, 13000),
+        (10000, 10000),
+        (1000, 2000),
+        (2000, 1000),
+        (500, 1000),
+        (-1500, 0),
+    ],
+)
+def test_crossed_matches_check_subscription(current, previous):
+    thresholds = [1000, 500, -1500, 10000, 5000, 13000]
+    store = SubscriptionStore()
+    subscriptions = [subscription(i, t) for i, t in enumerate(thresholds)]
+    for sub in subscriptions:
+        store.add(sub)
+
+    current_fees = {"BTC": {"LN": current}}
+    previous_fees = {"BTC": {"LN": previous}}
+    crossed = store.crossed(
+        current_fees, previous_fees, changed_pairs(current_fees, previous_fees)
+    )
+
+    assert sorted(sub.id for sub in crossed) == [
+        sub.id
+        for sub in subscriptions
+        if check_subscription(current_fees, previous_fees, sub)
+    ]
+
+
+def test_write_through():
+    store = SubscriptionStore()
+    store.add(subscription(1, 1000, chat_id=1))
+    store.add(subscription(2, 1000, chat_id=1, pair=("LN", "BTC")))
+    store.add(subscription(3, 2000, chat_id=2))
+    assert len(store) == 3
+
+    current, previous = {"BTC": {"LN": 0}}, {"BTC": {"LN": 1500}}
+    pairs = {("BTC", "LN")}
+    assert [sub.id for sub in store.crossed(current, previous, pairs)] == [1]
+
+    store.add(subscription(1, 5000, chat_id=1))
+    assert len(store) == 3
+    assert store.crossed(current, previous, pairs) == []
+
+    store.remove(3)
+    store.remove(3)
+    assert len(store) == 2
+
+    store.remove_chat(1)
+    assert len(store) == 0
+    assert store.crossed(current, previous, pairs) == []
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_load(db_session: AsyncSession):
+    db_session.add(
+        Subscription(chat_id=456, from_asset="LN", to_asset="BTC", fee_threshold=5000)
+    )
+    await db_session.commit()
+
+    store = SubscriptionStore()
+    await store.load(db_session)
+    count = await db_session.scalar(select(func.count()).select_from(Subscription))
+    assert len(store) == count
+
+    crossed = store.crossed(
+        {"LN": {"BTC": 4000}}, {"LN": {"BTC": 6000}}, {("LN", "BTC")}
+    )
+    assert [sub.chat_id for sub in crossed] == [456]
+
+
+@pytest.mark.parametrize(
+    "current, previous",
+    [(12000, 10000), (8000, 12000), (8000, 10000), (10000, 10000), (1000, 2000)],
+)
+def test_crossings(current, previous):
+    thresholds = [1000, 2000, 8000, 10000, 12000, 9000, 15000]
+    store = SubscriptionStore()
+    for i, threshold in enumerate(thresholds):
+        store.add(subscription(i, threshold))
+    index = store._pairs[("BTC", "LN")]
+
+    down, up = index.crossings(current, previous)
+    current_fees, previous_fees = {"BTC": {"LN": current}}, {"BTC": {"LN": previous}}
+    crossed = [
+        sub
+        for sub in index.subscriptions
+        if check_subscription(current_fees, previous_fees, sub)
+    ]
+    below = [sub for sub in crossed if current <= sub.fee_threshold]
+    assert index.subscriptions[down] == below
+    assert index.subscriptions[up] == [sub for sub in crossed if sub not in below]
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_record_pair_counts(db_session: AsyncSession):
+    db_session.add_all(
+        [
+            Subscription(
+                chat_id=457, from_asset="L-BTC", to_asset="LN", fee_threshold=t
+            )
+            for t in (1000, 2000)
+        ]
+    )
+    await db_session.commit()
+    session_maker = async_sessionmaker(db_session.bind)
+
+    # without a store, e.g. in a worker, the database counts them
+    await record_pair_counts(session_maker)
+    from_db = dict(SUBSCRIPTIONS.values)
+    assert from_db[(DEFAULT_NETWORK, "L-BTC", "LN")] == 2
+
+    store = SubscriptionStore()
+    await store.load(db_session)
+    await record_pair_counts(session_maker, store)
+    assert dict(SUBSCRIPTIONS.values) == from_db
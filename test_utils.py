@@ -1,5 +1,5 @@
 import pytest
-from utils import currency_to_asset
+from utils import currency_to_asset, changed_pairs
 from consts import SwapType
 
 
@@ -18,3 +18,20 @@ from consts import SwapType
 )
 def test_currency_to_asset(swap_type, currency, is_send, expected):
     assert currency_to_asset(swap_type, currency, is_send) == expected
+
+
+@pytest.mark.parametrize(
+    "current, previous, expected",
+    [
+        ({"BTC": {"LN": 0.1}}, {"BTC": {"LN": 0.1}}, set()),
+        ({"BTC": {"LN": 0.1}}, {"BTC": {"LN": 0.2}}, {("BTC", "LN")}),
+        (
+            {"BTC": {"LN": 0.1, "L-BTC": 0.1}},
+            {"BTC": {"LN": 0.1}, "LN": {"BTC": 0.5}},
+            {("BTC", "L-BTC")},
+        ),
+        ({}, {}, set()),
+    ],
+)
+def test_changed_pairs(current, previous, expected):
+    assert changed_pairs(current, previous) == expected
@@ -0,0 +1,63 @@
+import httpx
+import pytest
+
+from benchmarks.webhook import (
+    PATH,
+    SECRET,
+    FakeTelegram,
+    build_application,
+    measure,
+    start_update,
+)
+from webhook import start_webhook_server
+
+
+@pytest.mark.asyncio
+async def test_webhook_updates():
+    result = await measure(100, 4)
+    assert result["accepted"] == 100
+    assert result["replies"] == 100
+    assert result["handled_per_s"] > 0
+
+
+@pytest.mark.asyncio
+async def test_webhook_rejects():
+    telegram = FakeTelegram()
+    application = build_application(telegram)
+    async with application:
+        server = await start_webhook_server(application, "127.0.0.1", 0, PATH, SECRET)
+        port = server.sockets[0].getsockname()[1]
+        url = f"http://127.0.0.1:{port}"
+        try:
+            async with httpx.AsyncClient(base_url=url) as client:
+                update = start_update(1)
+                wrong_secret = {"X-Telegram-Bot-Api-Secret-Token": "wrong"}
+                non_ascii = {"X-Telegram-Bot-Api-Secret-Token": "wröng".encode()}
+                secret = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+                responses = [
+                    await client.post(PATH, json=update),
+                    await client.post(PATH, json=update, headers=wrong_secret),
+                    await client.post(PATH, json=update, headers=non_ascii),
+                    await client.post("/other", json=update, headers=secret),
+                    await client.get(PATH, headers=secret),
+                    await client.post(PATH, content=b"{", headers=secret),
+                    await client.post(PATH, json=[1], headers=secret),
+                    await client.post(PATH, json="x", headers=secret),
+                    await client.post(PATH, json={}, headers=secret),
+                ]
+        finally:
+            server.close()
+            server.close_clients()
+
+    assert [r.status_code for r in responses] == [
+        403,
+        403,
+        403,
+        404,
+        404,
+        400,
+        400,
+        400,
+        400,
+    ]
+    assert application.update_queue.empty()
@@ -1,13 +1,34 @@
 from urllib.parse import urlencode
 
-from consts import PRO_URL, SwapType, Fees
+from consts import DEFAULT_NETWORK, PRO_URL, SwapType, Fees, Pair
 from db import Subscription
 
 
-def get_fee(fees: Fees, subscription: Subscription) -> float | None:
+def get_fee(fees: Fees, subscription: Subscription) -> int | None:
     return fees.get(subscription.from_asset, {}).get(subscription.to_asset, None)
 
 
+def network_key(key: str, network: str) -> str:
+    # the default network keeps the keys from before there were several
+    return key if network == DEFAULT_NETWORK else f"{key}:{network}"
+
+
+def iter_pairs(fees: Fees):
+    for from_asset, pairs in fees.items():
+        for to_asset, fee in pairs.items():
+            yield (from_asset, to_asset), fee
+
+
+def changed_pairs(current: Fees, previous: Fees) -> set[Pair]:
+    # a pair missing from the current fees was not fetched, e.g. because its swap
+    # type failed, which is not a change: its previous fee is kept until it is back
+    return {
+        (from_asset, to_asset)
+        for (from_asset, to_asset), fee in iter_pairs(current)
+        if previous.get(from_asset, {}).get(to_asset) != fee
+    }
+
+
 def currency_to_asset(swap_type: SwapType, currency: str, is_send: bool):
     match swap_type:
         case SwapType.SUBMARINE:
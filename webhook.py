@@ -0,0 +1,125 @@
+import asyncio
+import hmac
+import json
+import logging
+import signal
+
+from telegram import Update
+from telegram.ext import Application
+
+from settings import Settings
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+MAX_BODY = 1024 * 1024
+
+
+def response(status: str, keep_alive: bool) -> bytes:
+    return (
+        f"HTTP/1.1 {status}\r\n"
+        "Content-Length: 0\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    ).encode()
+
+
+async def read_request(
+    reader: asyncio.StreamReader,
+) -> tuple[str, str, dict[str, str], bytes] | None:
+    request = await reader.readline()
+    if not request:
+        return None
+    method, path, *_ = request.decode("latin-1").split() + ["", ""]
+    headers = {}
+    while line := (await reader.readline()).strip():
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY:
+        raise ValueError(f"Request body of {length} bytes is too large")
+    body = await reader.readexactly(length) if length else b""
+    return method, path, headers, body
+
+
+def update_handler(application: Application, path: str, secret: str | None):
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # Telegram reuses connections, so serve requests until it closes one
+            while request := await read_request(reader):
+                method, request_path, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                if method != "POST" or request_path != path:
+                    status = "404 Not Found"
+                elif secret and not hmac.compare_digest(
+                    headers.get(SECRET_HEADER, "").encode(), secret.encode()
+                ):
+                    status = "403 Forbidden"
+                else:
+                    try:
+                        data = json.loads(body)
+                        if not isinstance(data, dict):
+                            raise TypeError(f"{type(data).__name__} is not an update")
+                        update = Update.de_json(data, application.bot)
+                        if update is None:
+                            raise ValueError("empty update")
+                    except (ValueError, TypeError, KeyError) as e:
+                        logging.warning(f"Invalid update received: {e}")
+                        status = "400 Bad Request"
+                    else:
+                        await application.update_queue.put(update)
+                        status = "200 OK"
+                writer.write(response(status, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            logging.debug(f"Webhook request failed: {e}")
+        finally:
+            writer.close()
+
+    return handle
+
+
+async def start_webhook_server(
+    application: Application, host: str, port: int, path: str, secret: str | None
+) -> asyncio.Server:
+    server = await asyncio.start_server(
+        update_handler(application, path, secret), host, port
+    )
+    logging.info(f"Receiving updates on http://{host}:{port}{path}")
+    return server
+
+
+async def run_webhook(application: Application, settings: Settings):
+    # the same lifecycle as Application.run_polling, with our server as update source
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        server = await start_webhook_server(
+            application,
+            settings.webhook_host,
+            settings.webhook_port,
+            settings.webhook_path,
+            settings.webhook_secret,
+        )
+        await application.bot.set_webhook(
+            url=settings.webhook_url,
+            secret_token=settings.webhook_secret,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        await application.start()
+        try:
+            await stop.wait()
+        finally:
+            server.close()
+            # otherwise keep-alive connections of Telegram hold up the shutdown
+            server.close_clients()
+            await server.wait_closed()
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+    if application.post_shutdown:
+        await application.post_shutdown(application)